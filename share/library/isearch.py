@@ -56,9 +56,12 @@ if pygtk was installed along with GPS. Otherwise, it is done every time the
 pattern is modified, and will slow things down a little
 """
 
+import re
+import time
 from GPS import CommandWindow, EditorBuffer, Hook, Preference, \
     execute_action, lookup_actions_from_key
 from gps_utils import interactive
+from gps_utils.highlighter import visible_lines
 
 Preference('Plugins/isearch/highlightnext').create(
     'Highlight next matches',
@@ -76,6 +79,19 @@ isearch_action_name = 'isearch'
 isearch_backward_action_name = 'isearch backward'
 # Changing the name of menus should be reflected in emacs.xml
 
+overlays_start_mark = 'isearch overlays start'
+overlays_end_mark = 'isearch overlays end'
+# Names of the marks delimiting the range in which the next matches were
+# highlighted, so that the highlighting can be removed without scanning the
+# whole buffer
+
+lines_per_chunk = 500
+# Number of lines searched at once when highlighting the next matches
+
+time_budget = 0.01
+# Maximum time (in seconds) spent highlighting the next matches in each
+# idle callback
+
 try:
     # If we have PyGTK installed, we'll do the highlighting of the next
     # matches in the background, which makes the interface more responsive
@@ -145,46 +161,150 @@ class Isearch(CommandWindow):
         self.cancel_idle_overlays()
 
         if highlight_next_matches:
-            loc = self.editor.beginning_of_buffer()
-            is_on = loc.has_overlay(self.overlay)
-            end = self.editor.end_of_buffer()
-            while loc < end:
-                loc2 = loc.forward_overlay(self.overlay)
-                if is_on:
-                    self.editor.remove_overlay(self.overlay, loc, loc2)
-                is_on = not is_on
-                loc = loc2
-
-    def insert_next_overlay(self, input):
-        result = self.overlay_loc.search(
-            input, regexp=self.regexp,
-            case_sensitive=self.case_sensitive, dialog_on_failure=False,
-            backward=self.backward)
-        if result:
-            (self.overlay_loc, end_loc) = result
+            try:
+                start_mark = self.editor.get_mark(overlays_start_mark)
+                end_mark = self.editor.get_mark(overlays_end_mark)
+            except Exception:
+                start_mark = None
+
+            if start_mark is not None:
+                # Only remove the highlighting in the range where it was
+                # applied
+                self.editor.remove_overlay(
+                    self.overlay, start_mark.location(), end_mark.location())
+                start_mark.delete()
+                end_mark.delete()
 
-            self.editor.apply_overlay(
-                self.overlay, self.overlay_loc, end_loc - 1)
+            else:
+                loc = self.editor.beginning_of_buffer()
+                is_on = loc.has_overlay(self.overlay)
+                end = self.editor.end_of_buffer()
+                while loc < end:
+                    loc2 = loc.forward_overlay(self.overlay)
+                    if is_on:
+                        self.editor.remove_overlay(self.overlay, loc, loc2)
+                    is_on = not is_on
+                    loc = loc2
+
+    def compile_pattern(self, input):
+        """
+        Return the compiled regexp for input, or None if input is not a valid
+        regexp.
+        """
+
+        flags = re.UNICODE | re.MULTILINE
+        if not self.case_sensitive:
+            flags |= re.IGNORECASE
+
+        try:
+            if isinstance(input, str):
+                input = input.decode('utf8')
+            if not self.regexp:
+                input = re.escape(input)
+            return re.compile(input, flags)
+        except (re.error, UnicodeError):
+            return None
+
+    def next_chunk(self):
+        """
+        Return the range (from, to) of the next chunk of the buffer in which
+        matches should be highlighted, or None when the whole buffer has been
+        processed. The first chunk extends to the end (or beginning when
+        searching backward) of the visible area of the editor.
+        """
+
+        if self.overlay_loc is None:
+            return None
+
+        line = self.overlay_loc.line()
+        visible = visible_lines(self.editor) if self.first_chunk else None
+        self.first_chunk = False
+
+        if self.backward:
+            if visible and visible[0] < line:
+                first = visible[0]
+            else:
+                first = max(1, line - lines_per_chunk)
+
+            frm = self.editor.at(first, 1)
+            to = self.overlay_loc
+            if first <= 1:
+                self.overlay_loc = None
+            else:
+                self.overlay_loc = frm.forward_char(-1)
 
-            self.overlay_loc += 1
-            return True
         else:
-            self.insert_overlays_id = 0
-            return False
+            if visible and visible[1] > line:
+                last = visible[1]
+            else:
+                last = line + lines_per_chunk
+
+            frm = self.overlay_loc
+            if last >= self.editor.lines_count():
+                to = self.editor.end_of_buffer()
+                self.overlay_loc = None
+            else:
+                to = self.editor.at(last, 1).end_of_line()
+                self.overlay_loc = to.forward_char(1)
+
+        return (frm, to)
+
+    def highlight_chunk(self, pattern, frm, to):
+        """Highlight all matches of pattern between frm and to"""
+
+        text = self.editor.get_chars(frm, to).decode('utf8')
+        for m in pattern.finditer(text):
+            if m.end() > m.start():
+                start = frm.forward_char(m.start())
+                self.editor.apply_overlay(
+                    self.overlay, start, start.forward_char(
+                        m.end() - m.start() - 1))
+
+        # Extend the range that will need to be cleaned up
+        if self.backward:
+            frm.create_mark(overlays_start_mark)
+        else:
+            to.create_mark(overlays_end_mark)
+
+    def insert_next_overlay(self, pattern):
+        """
+        Highlight the next chunks of the buffer, until the time budget is
+        exhausted. Return True if more chunks need to be processed.
+        """
+
+        deadline = time.time() + time_budget
+        while True:
+            chunk = self.next_chunk()
+            if chunk is None:
+                self.insert_overlays_id = 0
+                return False
+
+            self.highlight_chunk(pattern, chunk[0], chunk[1])
+            if time.time() >= deadline:
+                return True
 
     def insert_overlays(self):
+        # Remove the previous highlighting and stop the loop that computes
+        # it, since the range it covers is about to be forgotten
+        self.remove_overlays()
+
         highlight_next_matches = Preference(
             'Plugins/isearch/highlightnext').get()
 
         if highlight_next_matches:
             input = self.read()
-            self.overlay_loc = self.loc
-            if input != '':
+            pattern = self.compile_pattern(input) if input != '' else None
+            if pattern is not None:
+                self.overlay_loc = self.loc
+                self.first_chunk = True
+                self.loc.create_mark(overlays_start_mark)
+                self.loc.create_mark(overlays_end_mark)
+
                 if has_pygtk:
                     self.insert_overlays_id = GLib.idle_add(
-                        self.insert_next_overlay, input)
+                        self.insert_next_overlay, pattern)
                 elif len(input) > 2:
-                    while self.insert_next_overlay(input):
+                    while self.insert_next_overlay(pattern):
                         pass
 
     def highlight_match(self, save_in_stack=1):
@@ -335,7 +455,8 @@ class Isearch(CommandWindow):
                 (match_from, match_to) = result
                 self.end_loc = match_to
                 self.highlight_match()
-                self.insert_overlays()
+                if redo_overlays:
+                    self.insert_overlays()
                 return
 
         result = self.loc.search(input, regexp=self.regexp,
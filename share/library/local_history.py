@@ -1,14 +1,16 @@
 """Local history for files
 
 This script provides a local history for files: every time a file is saved,
-it is also committed in a local RCS directory, which can later be used to
-easily revert to a previous version.
+a snapshot of it is also stored in a local history directory, which can
+later be used to easily revert to a previous version.
 Compared to the standard undo feature in GPS, this provides a persistent
 undo across GPS sessions.
 
-You must install RCS. On Unix systems, this is generally available by
-default. On Windows, this is available through the cygwin environment.
-If RCS is not detected on your PATH, this module will do nothing.
+The snapshots are compressed, and stored only once even if several
+revisions (of one or several files) have the same contents. No external
+tool is needed. Histories created by previous versions of this plugin,
+which used RCS, are imported automatically the first time they are
+accessed.
 
 A new contextual menu is shown for files that have a local history. This
 menu allows you to view the diff between the current version of the file
@@ -24,17 +26,19 @@ therefore be reverted.
 ############################################################################
 
 from GPS import Console, Contextual, EditorBuffer, File, Hook, Logger, \
-    Preference, Process, Vdiff, XMLViewer, current_context
+    Preference, Vdiff, XMLViewer, current_context
 import gps_utils
 import os
-import shutil
 import datetime
+import difflib
+import hashlib
 import traceback
 import time
 import re
+import zlib
 
 Preference("Plugins/local_history/rcsdir").create(
-    "Local RCS dir", "string",
+    "Local history dir", "string",
     """Name of the local directory created to store history locally.
 One such directory will be created in each object directory of the project
 and its subprojects""",
@@ -52,8 +56,8 @@ Preference("Plugins/local_history/maxrevisions").create(
 
 Preference("Plugins/local_history/diff_switches").create(
     "Diff switches", "string",
-    """Additional switches to pass to rcsdiff. In particular, this can be used
-to specify your preferred format for diff""",
+    """Format of the diffs shown by Show Patch: -u for a unified diff,
+-c for a context diff""",
     "-u")
 
 Preference("Plugins/local_history/when_no_prj").create(
@@ -64,6 +68,287 @@ of the directory that contains the file. When the file belongs to a project,
 the local history goes to the object directory of the project.""",
     False)
 
+DATE_FORMAT = "%Y.%m.%d.%H.%M.%S"
+# The format of the dates associated with revisions (as used by RCS)
+
+
+###########################################################################
+# Import of RCS archives
+###########################################################################
+
+_rcs_token_r = re.compile(r'@((?:[^@]|@@)*)@|([^\s;:@]+)|([;:])')
+_rcs_num_r = re.compile(r'^[0-9.]+$')
+
+
+def _rcs_tokens(data):
+    """The list of tokens in the contents of a RCS file"""
+    result = []
+    for m in _rcs_token_r.finditer(data):
+        if m.group(1) is not None:
+            result.append((True, m.group(1).replace('@@', '@')))
+        else:
+            result.append((False, m.group(2) or m.group(3)))
+    return result
+
+
+def _apply_rcs_delta(lines, delta):
+    """
+    Apply a RCS reverse delta (a list of 'a' and 'd' commands) to lines,
+    and return the resulting list of lines.
+    """
+    commands = delta.splitlines(True)
+    result = []
+    pos = 0   # number of lines of the original text already handled
+    index = 0
+    while index < len(commands):
+        cmd = commands[index]
+        index += 1
+        line, count = [int(v) for v in cmd[1:].split()]
+        if cmd[0] == 'd':
+            result.extend(lines[pos:line - 1])
+            pos = line - 1 + count
+        elif cmd[0] == 'a':
+            result.extend(lines[pos:line])
+            pos = line
+            result.extend(commands[index:index + count])
+            index += count
+    result.extend(lines[pos:])
+    return result
+
+
+def parse_rcs_file(rcs_file):
+    """
+    Read all revisions on the trunk of a RCS archive.
+    Return a list of (revision, date, contents), oldest first, where
+    revision is the RCS revision number less the "1." prefix.
+    """
+    with open(rcs_file, 'rb') as f:
+        tokens = _rcs_tokens(f.read())
+
+    def is_delta(i):
+        return (not tokens[i][0] and _rcs_num_r.match(tokens[i][1]) and
+                tokens[i + 1] == (False, 'date'))
+
+    def skip_phrase(i):
+        while tokens[i] != (False, ';'):
+            i += 1
+        return i + 1
+
+    head = None
+    dates = {}
+    nexts = {}
+    texts = {}
+
+    # The admin section and the list of deltas
+    i = 0
+    while tokens[i] != (False, 'desc'):
+        if is_delta(i):
+            rev = tokens[i][1]
+            i += 1
+            while tokens[i] != (False, 'desc') and not is_delta(i):
+                key = tokens[i][1]
+                end = skip_phrase(i)
+                values = [t[1] for t in tokens[i + 1:end - 1]]
+                if key == 'date':
+                    dates[rev] = values[0]
+                elif key == 'next':
+                    nexts[rev] = values[0] if values else None
+                i = end
+        else:
+            if tokens[i] == (False, 'head') and tokens[i + 1] != (False, ';'):
+                head = tokens[i + 1][1]
+            i = skip_phrase(i)
+
+    # The description, then the log and text of each delta
+    i += 2
+    while i < len(tokens):
+        rev = tokens[i][1]
+        i += 1
+        while i < len(tokens):
+            if tokens[i] == (False, 'text'):
+                texts[rev] = tokens[i + 1][1]
+                i += 2
+                break
+            elif tokens[i] == (False, 'log'):
+                i += 2
+            else:
+                i = skip_phrase(i)
+
+    result = []
+    rev = head
+    lines = None
+    while rev:
+        if lines is None:
+            lines = texts[rev].splitlines(True)
+        else:
+            lines = _apply_rcs_delta(lines, texts[rev])
+        result.append((int(rev.split('.')[-1]), dates[rev], ''.join(lines)))
+        rev = nexts.get(rev)
+
+    result.reverse()
+    return result
+
+
+###########################################################################
+# The local history store
+###########################################################################
+
+class Store(object):
+
+    """
+    A content-addressed store for the revisions of files.
+
+    Each snapshot is compressed, and stored only once in the objects/
+    subdirectory under the SHA-1 of its contents. The revisions of all the
+    files in the store are listed in an index file, one per line::
+
+        name<TAB>revision<TAB>date<TAB>sha1
+
+    This class does not depend on GPS.
+    """
+
+    def __init__(self, dir):
+        self.dir = dir
+        self.index_file = os.path.join(dir, "index")
+        self.__revisions = None   # (revision, date, sha1) indexed by name
+        self.__index_stamp = None
+
+    def __stamp(self):
+        try:
+            st = os.stat(self.index_file)
+            return (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+
+    def __entries(self):
+        """The parsed index, reloaded if it was modified by someone else"""
+        stamp = self.__stamp()
+        if self.__revisions is None or stamp != self.__index_stamp:
+            self.__revisions = {}
+            if stamp is not None:
+                with open(self.index_file) as f:
+                    for line in f:
+                        name, rev, date, sha = line.rstrip('\n').split('\t')
+                        self.__revisions.setdefault(name, []).append(
+                            (int(rev), date, sha))
+            self.__index_stamp = stamp
+        return self.__revisions
+
+    def __object_file(self, sha):
+        return os.path.join(self.dir, "objects", sha[:2], sha[2:])
+
+    def __write_object(self, contents):
+        """Store contents if needed, and return its key"""
+        sha = hashlib.sha1(contents).hexdigest()
+        name = self.__object_file(sha)
+        if not os.path.isfile(name):
+            if not os.path.isdir(os.path.dirname(name)):
+                os.makedirs(os.path.dirname(name))
+            tmp = name + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(zlib.compress(contents))
+            os.rename(tmp, name)
+        return sha
+
+    def __append(self, name, revisions):
+        """Add revisions, a list of (revision, date, sha1), to the index"""
+        entries = self.__entries()
+        with open(self.index_file, 'a') as f:
+            for rev, date, sha in revisions:
+                f.write("%s\t%d\t%s\t%s\n" % (name, rev, date, sha))
+        entries.setdefault(name, []).extend(revisions)
+        self.__index_stamp = self.__stamp()
+
+    def revisions(self, name):
+        """
+        The revisions of the file name, as a list of (revision, date),
+        most recent first.
+        """
+        return [(rev, date) for rev, date, _ in
+                reversed(self.__entries().get(name, []))]
+
+    def add(self, name, contents, date):
+        """
+        Add a new revision for the file name, unless its contents are
+        the same as the latest revision. Return the revision number.
+        """
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+
+        sha = self.__write_object(contents)
+        revisions = self.__entries().get(name)
+        if revisions:
+            if revisions[-1][2] == sha:
+                return revisions[-1][0]
+            rev = revisions[-1][0] + 1
+        else:
+            rev = 1
+
+        self.__append(name, [(rev, date, sha)])
+        return rev
+
+    def add_revisions(self, name, revisions):
+        """
+        Add several revisions for a file which is not in the store yet.
+
+        :param revisions: a list of (revision, date, contents), oldest first
+        """
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+        self.__append(name, [(rev, date, self.__write_object(contents))
+                             for rev, date, contents in revisions])
+
+    def read(self, name, revision):
+        """The contents of the given revision of the file name, or None"""
+        for rev, _, sha in self.__entries().get(name, []):
+            if rev == revision:
+                with open(self.__object_file(sha), 'rb') as f:
+                    return zlib.decompress(f.read())
+        return None
+
+    def truncate(self, name, revision):
+        """
+        Remove all the revisions of the file name up to revision included,
+        as well as the snapshots that are no longer used.
+        """
+        entries = self.__entries()
+        removed = [r for r in entries.get(name, []) if r[0] <= revision]
+        if not removed:
+            return
+
+        entries[name] = [r for r in entries[name] if r[0] > revision]
+
+        tmp = self.index_file + ".tmp"
+        with open(tmp, 'w') as f:
+            for n, revisions in entries.iteritems():
+                for rev, date, sha in revisions:
+                    f.write("%s\t%d\t%s\t%s\n" % (n, rev, date, sha))
+        if os.path.exists(self.index_file):
+            os.remove(self.index_file)   # needed on Windows
+        os.rename(tmp, self.index_file)
+        self.__index_stamp = self.__stamp()
+
+        used = set(sha for revisions in entries.itervalues()
+                   for _, _, sha in revisions)
+        for _, _, sha in removed:
+            if sha not in used:
+                try:
+                    os.remove(self.__object_file(sha))
+                except OSError:
+                    pass
+
+
+_stores = {}
+# The stores, indexed by directory, so that their index is parsed only once
+
+
+def get_store(dir):
+    """Return the store for the given directory"""
+    store = _stores.get(dir)
+    if store is None:
+        store = _stores[dir] = Store(dir)
+    return store
+
 
 class LocalHistory:
 
@@ -74,6 +359,7 @@ class LocalHistory:
            File must be an instance of GPS.File"""
 
         self.file = file.path
+        self.rcs_dir = None
         project = file.project(default_to_root=False)
         if project:
             dir = project.object_dirs(recursive=False)[0]
@@ -84,73 +370,61 @@ class LocalHistory:
 
         self.rcs_dir = os.path.join(
             dir, Preference("Plugins/local_history/rcsdir").get())
-        self.rcs_file = os.path.join(self.rcs_dir,
-                                     os.path.basename(self.file)) + ",v"
+        self.name = os.path.basename(self.file)
+        self.store = get_store(self.rcs_dir)
+
+        # The RCS archive created by previous versions of this plugin
+        self.rcs_file = os.path.join(self.rcs_dir, self.name) + ",v"
 
-        # convert all \ to / for Cygwin toolset, note that forward
-        # slashes are handled by the native Win32 API. So it is safe to
-        # do that on Windows.
+    def import_rcs_history(self):
+        """Import the RCS archive for self into the store, if there is one.
+           The archive is renamed once imported."""
+        if not os.path.isfile(self.rcs_file):
+            return
+
+        Logger("LocalHist").log("importing %s" % self.rcs_file)
+        try:
+            if not self.store.revisions(self.name):
+                self.store.add_revisions(
+                    self.name, parse_rcs_file(self.rcs_file))
+            os.rename(self.rcs_file, self.rcs_file + ".imported")
+        except Exception:
+            Logger("LocalHist").log(
+                "Could not import %s: %s" % (
+                    self.rcs_file, traceback.format_exc()))
+            return
 
-        self.file = self.file.replace("\\", "/")
-        self.rcs_file = self.rcs_file.replace("\\", "/")
+        # Remove the copy of the file made before each check in
+        try:
+            os.remove(os.path.join(self.rcs_dir, self.name))
+        except OSError:
+            pass
 
     def get_revisions(self):
         """Extract all revisions and associated dates.
-           Result is a list of tuples: (revision_number, date), where
-           revision is the RCS revision number less the "1." prefix.
+           Result is a list of tuples: (revision_number, date).
            First in the list is the most recent revision."""
         if not self.rcs_dir:
             return
         try:
-            f = file(self.rcs_file)
-            result = []
-
-            previous = None
-
-            for line in f.readlines():
-                if line.startswith("log"):
-                    break
-                if line.startswith("date\t") and previous is not None:
-                    date = line.split()[1]
-                    result.append((int(previous[2:]), date[:-1]))
-                previous = line
-
-            f.close()
-            return result
+            self.import_rcs_history()
+            return self.store.revisions(self.name)
         except:
             return None
 
-    def on_lock_taken(self, proc, exit_status, output):
-        """
-        Called when we have finished taking the lock on the local RCS file
-        """
-        pwd = os.getcwd()
-        os.chdir(self.rcs_dir)
-        # Specify our own date, so that the date associated with the revision
-        # is the one when the file was saved. Otherwise, it defaults to the
-        # last modification of the date, and this might dependent on the local
-        # time zone
-        proc = Process(
-            "ci -d" +
-            datetime.datetime.now().strftime("%Y/%m/%d\\ %H:%M:%S") +
-            " " + os.path.basename(self.file))
-        os.chdir(pwd)
-        proc.send(".\n")
-
     def add_to_history(self):
         """Expand the local history for file, to include the current version"""
         if not self.rcs_dir:
-            Logger("LocalHist").log("No RCS dir for file " + self.file)
+            Logger("LocalHist").log("No local history dir for file " +
+                                    self.file)
             return
-        if not os.path.isdir(self.rcs_dir):
-            os.makedirs(self.rcs_dir)
-            Logger("LocalHist").log("creating directory %s" % self.rcs_dir)
 
-        shutil.copy2(self.file, self.rcs_dir)
-        if os.path.isfile(self.rcs_file):
-            Process("rcs -l " + self.rcs_file, on_exit=self.on_lock_taken)
-        else:
-            self.on_lock_taken(None, 0, "")
+        self.import_rcs_history()
+
+        # Use the date when the file was saved, in the local time zone
+        with open(self.file, 'rb') as f:
+            self.store.add(self.name, f.read(),
+                           datetime.datetime.now().strftime(DATE_FORMAT))
 
     def cleanup_history(self):
         """Remove the older revision histories for self"""
@@ -159,7 +433,7 @@ class LocalHistory:
 
         max_days = Preference("Plugins/local_history/maxdays").get()
         older = datetime.datetime.now() - datetime.timedelta(days=max_days)
-        older = older.strftime("%Y.%m.%d.%H.%M.%S")
+        older = older.strftime(DATE_FORMAT)
 
         revisions = self.get_revisions()
         max_revisions = Preference("Plugins/local_history/maxrevisions").get()
@@ -172,38 +446,25 @@ class LocalHistory:
 
             if version >= 1:
                 Logger("LocalHist").log(
-                    "Truncating file %s to revision %s" % (
-                        self.rcs_file, version))
-                proc = Process("rcs -o:1.%s %s" % (version, self.rcs_file))
-                proc.wait()
-
-    def local_checkout(self, revision):
-        """Do a local checkout of file at given revision in the RCS directory.
-           Return the name of the checked out file"""
-        if self.rcs_dir and os.path.isdir(self.rcs_dir):
-            try:
-                os.unlink(os.path.join(self.rcs_dir,
-                                       os.path.basename(self.file)))
-            except:
-                pass
-
-            pwd = os.getcwd()
-            os.chdir(self.rcs_dir)
-            proc = Process("co -r" + revision + " " + self.rcs_file)
-            os.chdir(pwd)
-            if proc.wait() == 0:
-                return os.path.join(self.rcs_dir, os.path.basename(self.file))
-        return None
+                    "Truncating history of %s to revision %s" % (
+                        self.file, version))
+                self.store.truncate(self.name, version)
+
+    def get_contents(self, revision):
+        """The contents of file at the given revision, or None"""
+        if not self.rcs_dir:
+            return None
+        return self.store.read(self.name, int(revision))
 
     def revert_file(self, revision):
         """Revert file to a local history revision"""
         if not self.rcs_dir:
             return
         Logger("LocalHist").log("revert " + self.file + " to " + revision)
-        local = self.local_checkout(revision)
-        if local:
-            shutil.copymode(self.file, local)
-            shutil.move(local, self.file)
+        contents = self.get_contents(revision)
+        if contents is not None:
+            with open(self.file, 'wb') as f:
+                f.write(contents)
             EditorBuffer.get(File(self.file), force=True)
 
     def diff_file(self, revision, file_ext="old"):
@@ -211,11 +472,13 @@ class LocalHistory:
            The referenced file will have a name ending with file_ext"""
         if not self.rcs_dir:
             return
-        local = self.local_checkout(revision)
+        contents = self.get_contents(revision)
+        if contents is None:
+            return
         file_ext = file_ext.replace("/", ".").replace(":", "-")
-        local2 = os.path.basename(local) + " " + file_ext
-        local2 = os.path.join(self.rcs_dir, local2)
-        shutil.move(local, local2)
+        local2 = os.path.join(self.rcs_dir, self.name + " " + file_ext)
+        with open(local2, 'wb') as f:
+            f.write(contents)
         Vdiff.create(File(local2), File(self.file))
         try:
             os.chmod(local2, 0777)
@@ -226,22 +489,30 @@ class LocalHistory:
     def show_diff(self, revision, date):
         """Show, in a console, the diff between the current version and
            revision"""
-        if self.rcs_dir and os.path.isdir(self.rcs_dir):
-            pwd = os.getcwd()
-            os.chdir(os.path.dirname(self.file))
+        contents = self.get_contents(revision)
+        if contents is not None:
+            with open(self.file, 'rb') as f:
+                current = f.read()
+
             diff_switches = Preference(
                 "Plugins/local_history/diff_switches").get()
-            proc = Process("rcsdiff " + diff_switches +
-                           " -r" + revision + " " + self.rcs_file)
-            diff = proc.get_result()
-            os.chdir(pwd)
+            if "-c" in diff_switches.split():
+                diff_func = difflib.context_diff
+            else:
+                diff_func = difflib.unified_diff
+
+            diff = "".join(diff_func(
+                contents.splitlines(True), current.splitlines(True),
+                "%s (%s)" % (self.name, date), self.name))
             Console("Local History").clear()
             Console("Local History").write("Local history at " + date + "\n")
             Console("Local History").write(diff)
 
     def has_local_history(self):
         """Whether there is local history information for self"""
-        return os.path.isfile(self.rcs_file)
+        return self.rcs_dir is not None and (
+            os.path.isfile(self.rcs_file) or
+            bool(self.store.revisions(self.name)))
 
     def on_select_xml_node(self, node_name, attrs, value):
         if node_name == "revision":
@@ -260,9 +531,6 @@ class LocalHistory:
     def view_all(self, revisions, dates):
         """View all revisions of self in a graphical tree"""
         if self.rcs_dir and os.path.isdir(self.rcs_dir):
-            pwd = os.getcwd()
-            os.chdir(os.path.dirname(self.file))
-
             xml = "<local_history>\n"
             for index, r in enumerate(revisions):
                 xml = xml + "  <revision name='" + r + "' date='" \
@@ -275,16 +543,6 @@ class LocalHistory:
                              on_select=self.on_select_xml_node,
                              parser=self.create_xml_node)
             view.parse_string(xml)
-            os.chdir(pwd)
-
-
-def has_RCS_on_path():
-    """True if RCS was found on the PATH"""
-    for path in os.getenv("PATH").split(os.pathsep):
-        if os.path.isfile(os.path.join(path, "ci")) \
-                or os.path.isfile(os.path.join(path, "ci.exe")):
-            return True
-    return False
 
 
 def on_file_saved(hook, file):
@@ -319,11 +577,11 @@ def contextual_factory(context):
         try:
             return context.revisions_menu
         except:
-            context.revisions = ["1.%s" % a[0] for a in revisions]
+            context.revisions = [str(a[0]) for a in revisions]
             result = []
             for a in revisions:
                 date = datetime.datetime(
-                    *(time.strptime(a[1], "%Y.%m.%d.%H.%M.%S")[0:6]))
+                    *(time.strptime(a[1], DATE_FORMAT)[0:6]))
                 result.append(date.strftime("%Y-%m-%d/%H:%M:%S"))
             context.revisions_menu = result
             return context.revisions_menu
@@ -355,29 +613,28 @@ def on_view_all():
 
 
 def register_module(hook):
-    """Activate this local history module if RCS is found on the path"""
-
-    if has_RCS_on_path():
-        Hook("file_saved").add(on_file_saved, last=True)
-        Contextual("Local History Revert to").create_dynamic(
-            factory=contextual_factory,
-            on_activate=on_revert,
-            label="Local History/Revert To",
-            filter=contextual_filter)
-        Contextual("Local History Diff").create_dynamic(
-            factory=contextual_factory,
-            on_activate=on_diff,
-            label="Local History/Diff",
-            filter=contextual_filter)
-        Contextual("Local History Patch").create_dynamic(
-            factory=contextual_factory,
-            on_activate=on_patch,
-            label="Local History/Show Patch",
-            filter=contextual_filter)
-
-        gps_utils.make_interactive(
-            callback=on_view_all,
-            filter=contextual_filter,
-            contextual='Local History/View')
+    """Activate this local history module"""
+
+    Hook("file_saved").add(on_file_saved, last=True)
+    Contextual("Local History Revert to").create_dynamic(
+        factory=contextual_factory,
+        on_activate=on_revert,
+        label="Local History/Revert To",
+        filter=contextual_filter)
+    Contextual("Local History Diff").create_dynamic(
+        factory=contextual_factory,
+        on_activate=on_diff,
+        label="Local History/Diff",
+        filter=contextual_filter)
+    Contextual("Local History Patch").create_dynamic(
+        factory=contextual_factory,
+        on_activate=on_patch,
+        label="Local History/Show Patch",
+        filter=contextual_filter)
+
+    gps_utils.make_interactive(
+        callback=on_view_all,
+        filter=contextual_filter,
+        contextual='Local History/View')
 
 Hook("gps_started").add(register_module)
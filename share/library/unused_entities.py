@@ -22,9 +22,11 @@ they might show references to entities even though these entities are in fact
 no longer used (which means GPS will not correctly report all cases of unused
 entities).
 
-Executing this script blocks the whole GPS interface, so it is normal that
-GPS becomes unresponsive. Depending of the size of your project, this can
-take a while to execute.
+The search is done in the background, and can be interrupted from the Task
+Manager. It first counts the references to each entity, reading the
+references of each source file only once, then reports the unused entities
+in the locations window as soon as they are found. Depending of the size of
+your project, this can take a while to execute.
 Note that you can save the contents of the Locations window, after execution,
 through the GPS.Locations.dump() method in the python console.
 """
@@ -36,6 +38,7 @@ through the GPS.Locations.dump() method in the python console.
 from GPS import Preference, Project, Console, Editor, File, Locations, \
     EditorBuffer, MDI
 from gps_utils import interactive
+import workflows
 
 xmlada_projects = [
     "xmlada_sax", "xmlada_dom", "xmlada_schema", "xmlada_unicode",
@@ -100,6 +103,38 @@ def is_unused(entity):
     return True
 
 
+NOT_A_USE = ('declaration', 'body', 'label')
+# The kinds of references that do not count as a use of the entity
+
+
+def entity_key(entity):
+    """Return a key that identifies the entity in the reference counts"""
+    decl = entity.declaration()
+    return (entity.name(), decl.file().path, decl.line(), decl.column())
+
+
+def count_references(file, counts):
+    """
+    Add to counts the number of uses, in file, of each entity referenced
+    in it. counts is a dict indexed by entity_key.
+    """
+
+    def add(kind, delta):
+        previous = None
+        key = None
+        # Sort by entity, so that we only compute the key when the entity
+        # changes
+        for entity, _ in file.references(kind=kind, sortby=1):
+            if previous is None or not entity == previous:
+                previous = entity
+                key = entity_key(entity)
+            counts[key] = counts.get(key, 0) + delta
+
+    add("", 1)
+    for kind in NOT_A_USE:
+        add(kind, -1)
+
+
 def UnusedIterator(where, globals_only):
     """Return all unused entities from WHERE, and only global entities if
        GLOBALS_ONLY is true"""
@@ -113,22 +148,87 @@ def UnusedIterator(where, globals_only):
             yield e
 
 
+def scope_files(where):
+    """The list of files whose entities should be checked"""
+    if not where:
+        ignore_projects = [s.strip().lower() for s in Preference(
+            "Plugins/unused_entities/ignoreprj").get().split(",")]
+        return [s for p in Project.root().dependencies(recursive=True)
+                if p.name().lower() not in ignore_projects
+                for s in p.sources()]
+    elif isinstance(where, Project):
+        return where.sources()
+    else:
+        return [where]
+
+
+def find_unused_entities(where, globals_only):
+    """
+    Return a workflow that lists the unused entities from WHERE in the
+    locations window, to be run in a task.
+    """
+
+    def workflow(task):
+        files = scope_files(where)
+        all_files = Project.root().sources(recursive=True)
+        total = len(all_files) + len(files)
+        counts = {}
+
+        # Count the uses of all entities, reading the references from each
+        # file of the application once.
+
+        for index, f in enumerate(all_files):
+            task.set_progress(index, total)
+            count_references(f, counts)
+            yield
+
+        # Report the entities from WHERE that are never used
+
+        for index, f in enumerate(files):
+            task.set_progress(len(all_files) + index, total)
+            for e in f.entities(local=True):
+                if globals_only and not e.attributes()["global"]:
+                    continue
+                if counts.get(entity_key(e), 0) > 0 or e.primitive_of():
+                    # If we have a primitive operation, do not report it for
+                    # now, since it might actually be called through
+                    # dispatching. We do not know yet how to test that
+                    continue
+
+                Locations.add(category="Unused entity",
+                              file=e.declaration().file(),
+                              line=e.declaration().line(),
+                              column=e.declaration().column(),
+                              message="unused entity " + e.name(),
+                              highlight="Unused_Entities",
+                              length=len(e.name()))
+            yield
+
+        Console().write("Done searching for unused entities\n")
+
+    return workflow
+
+
+current_task = None
+# The task searching for unused entities, if any
+
+
 def show_unused_entities(where, globals_only):
     """List all unused global entities from WHERE in the locations window"""
+    global current_task
+
+    if current_task is not None:
+        try:
+            current_task.interrupt()
+        except Exception:
+            pass   # already finished
+
     Editor.register_highlighting("Unused_Entities", "blue")
     Locations.remove_category("Unused entity")
     MDI.get("Messages").raise_window()
 
-    for e in UnusedIterator(where, globals_only=globals_only):
-        Locations.add(category="Unused entity",
-                      file=e.declaration().file(),
-                      line=e.declaration().line(),
-                      column=e.declaration().column(),
-                      message="unused entity " + e.name(),
-                      highlight="Unused_Entities",
-                      length=len(e.name()))
-
-    Console().write("Done searching for unused entities\n")
+    current_task = workflows.task_workflow(
+        "unused entities", find_unused_entities(where, globals_only))
 
 
 @interactive(name='show unused entities from file',
@@ -32,7 +32,11 @@ import GPS
 # from gps_utils import *
 from gps_utils import hook
 from gps_utils.highlighter import Location_Highlighter, OverlayStyle
+from collections import OrderedDict
+import os.path
 import re
+import workflows
+from workflows.promises import timeout
 
 GPS.Preference(
     "Plugins/auto_highlight_occurrences/highlight_entities").create(
@@ -61,11 +65,60 @@ GPS.Preference(
 MSG_PREFIX = 'dynamic occurrences '
 # Messages created by this plugin have a category that starts with this
 
+CASE_INSENSITIVE_LANGUAGES = ("ada", "vhdl")
+# Languages for which words are matched without taking the case into account
+
+IDENTIFIER_RE = re.compile(r'^[^\W\d]\w*$', re.UNICODE)
+# Only the words matching this are highlighted in text mode
+
+
+def entity_key(entity):
+    """
+    Return a key that identifies the entity in the references cache.
+    """
+    decl = entity.declaration()
+    return (entity.name(), decl.file().path, decl.line(), decl.column())
+
+
+def file_version(file):
+    """
+    Return a value that changes whenever file is modified on disk.
+    """
+    try:
+        return os.path.getmtime(file.path)
+    except OSError:
+        return 0
+
+
+def word_regexp(word, language):
+    """
+    Return a compiled regexp matching the occurrences of word as a whole
+    identifier, or None if word is not an identifier.
+
+    :param unicode word: the word to search for
+    :param string language: the language of the buffer, to know whether the
+       search should be case sensitive
+    """
+    if not IDENTIFIER_RE.match(word):
+        return None
+
+    flags = re.UNICODE
+    if language.lower() in CASE_INSENSITIVE_LANGUAGES:
+        flags |= re.IGNORECASE
+
+    return re.compile(r'(?<!\w)' + re.escape(word) + r'(?!\w)', flags)
+
 
 class Current_Entity_Highlighter(Location_Highlighter):
 
     """Class to handle the highlighting of local occurrences."""
 
+    max_cached_refs = 64
+    # Maximum number of (entity, file) for which references are cached
+
+    refs_poll_ms = 20
+    # Interval at which we check whether a references query has completed
+
     def __init__(self):
         """
         Initialize a new highlighter. It monitors changes in the current
@@ -81,6 +134,13 @@ class Current_Entity_Highlighter(Location_Highlighter):
         self.highlight_word = None
         self.entity = None
         self.word = None
+        self.word_re = None
+        self.refs_cache = OrderedDict()
+        # The references of entities, indexed by
+        # (entity_key, file path, file_version)
+        self.__refs_generation = 0
+        # Incremented whenever a new references query is started, so that
+        # the results of obsolete queries can be ignored
         self.styles = {
             "text": OverlayStyle(
                 name="{}simple".format(MSG_PREFIX),
@@ -107,12 +167,19 @@ class Current_Entity_Highlighter(Location_Highlighter):
         GPS.Hook("preferences_changed").add(self._on_preferences_changed)
         GPS.Hook("location_changed").add_debounce(self.highlight)
         GPS.Hook("file_closed").add(self.__on_file_closed)
+        GPS.Hook("xref_updated").add(self.__on_xref_updated)
 
     def __on_file_closed(self, hook, file):
         if self.current_buffer:
             if self.current_buffer.file() == file:
                 self.current_buffer = None
 
+        for key in [k for k in self.refs_cache if k[1] == file.path]:
+            del self.refs_cache[key]
+
+    def __on_xref_updated(self, hook):
+        self.refs_cache.clear()
+
     def _on_preferences_changed(self, hook_name):
         """
         Called whenever one of the preferences has changed.
@@ -145,18 +212,58 @@ class Current_Entity_Highlighter(Location_Highlighter):
             self.remove_highlight()
             self.highlight()
 
+    def __refs_key(self, entity, buffer):
+        file = buffer.file()
+        return (entity_key(entity), file.path, file_version(file))
+
+    def __cache_refs(self, key, refs):
+        self.refs_cache[key] = refs
+        while len(self.refs_cache) > self.max_cached_refs:
+            self.refs_cache.popitem(last=False)
+
+    @workflows.run_as_workflow
+    def __fetch_refs(self, entity, buffer):
+        """
+        Query the references of entity in buffer in the background, then
+        start highlighting them if entity is still the current entity.
+        """
+        self.__refs_generation += 1
+        generation = self.__refs_generation
+        key = self.__refs_key(entity, buffer)
+
+        command = entity.references(
+            include_implicit=False,
+            synchronous=False,
+            in_file=buffer.file())
+
+        while command is not None:
+            current, total = command.progress()
+            if (total > 0 and current >= total) or \
+                    command not in GPS.Command.list():
+                break
+            yield timeout(self.refs_poll_ms)
+
+            if generation != self.__refs_generation:
+                # Another entity has been selected in the meantime
+                command.interrupt()
+                return
+
+        n = entity.name()
+        result = command.get_result() if command is not None else None
+        self.__cache_refs(key, [(n, r) for r in result or []])
+
+        if (generation == self.__refs_generation and
+                self.entity == entity and self.current_buffer == buffer):
+            self.start_highlight(buffer=buffer)
+
     def recompute_refs(self, buffer):
         if self.entity:
-            # Compute all refs to the entity immediately, so that we do not
-            # have to do any xref query later on when doing the highlighting
-            # This query is fast since it only involves a single source file.
+            # The references have been computed before starting the
+            # highlighting (see __fetch_refs), so that we do not have to do
+            # any xref query when doing the highlighting.
 
-            n = self.entity.name()
-
-            return [(n, r) for r in self.entity.references(
-                include_implicit=False,
-                synchronous=True,
-                in_file=buffer.file())]
+            return self.refs_cache.get(
+                self.__refs_key(self.entity, buffer), [])
 
         else:
             return []   # irrelevant
@@ -166,54 +273,37 @@ class Current_Entity_Highlighter(Location_Highlighter):
 
         if self.entity:
             Location_Highlighter.process(self, start, end)
-        else:
-            buffer = start.buffer()
-            while start < end:
-
-                # Get the string on the line
-                end_loc = start.end_of_line()
-                s = buffer.get_chars(start, end_loc)  # byte-sequence
-                s = s.decode("utf8")  # make unicode-string
-                s_len = len(s)
-
-                # Find the tokens on the current line
-                index = 0
-                visible_column = 0
-
-                while index < s_len:
-                    if s[index].isalpha() or s[index] == '_':
-                        end_index = index + 1
+        elif self.word_re:
+            # Search the whole range at once, then compute the line and
+            # visible column of each occurrence.
 
-                        while end_index < s_len and (
-                                s[end_index].isalnum() or s[end_index] == '_'):
-                            end_index += 1
-
-                        if s[index:end_index] == self.word:
-                            self.highlighted += 1
-                            self.style.apply(
-                                start=GPS.EditorLocation(
-                                    buffer,
-                                    start.line(),
-                                    start.column() + visible_column),
-                                end=GPS.EditorLocation(
-                                    buffer,
-                                    start.line(),
-                                    start.column() +
-                                    visible_column + len(self.word) - 1))
-
-                        visible_column += end_index - index
-                        index = end_index
-
-                    else:
-                        visible_column += 1
-
-                        if s[index] == '\t':
-                            visible_column = (visible_column +
-                                              8 - (visible_column % 8))
-
-                        index += 1
-
-                start = end_loc + 1
+            buffer = start.buffer()
+            text = buffer.get_chars(start, end)  # byte-sequence
+            text = text.decode("utf8")  # make unicode-string
+
+            line = start.line()
+            column = start.column()
+            line_start = 0  # index of the beginning of the current line
+
+            for m in self.word_re.finditer(text):
+                index = m.start()
+                newlines = text.count('\n', line_start, index)
+                if newlines:
+                    line += newlines
+                    line_start = text.rindex('\n', line_start, index) + 1
+                    column = 1
+
+                prefix = text[line_start:index]
+                if '\t' in prefix:
+                    prefix = prefix.expandtabs(8)
+                visible_column = column + len(prefix)
+
+                self.highlighted += 1
+                self.style.apply(
+                    start=GPS.EditorLocation(buffer, line, visible_column),
+                    end=GPS.EditorLocation(
+                        buffer, line,
+                        visible_column + len(self.word) - 1))
 
     def highlight(self, *args, **kwargs):
         """
@@ -303,6 +393,9 @@ class Current_Entity_Highlighter(Location_Highlighter):
 
         self.entity = entity
         self.word = word
+        self.word_re = None
+        if word and not entity:
+            self.word_re = word_regexp(word, buffer.get_lang().name)
 
         if self.current_buffer and (self.current_buffer != buffer):
             # We have just switched buffers: clear the highlighting on the
@@ -316,7 +409,12 @@ class Current_Entity_Highlighter(Location_Highlighter):
             self.set_style(self.styles["text"])
 
         self.current_buffer = buffer
-        self.start_highlight(buffer=buffer)
+
+        if self.entity and \
+                self.__refs_key(self.entity, buffer) not in self.refs_cache:
+            self.__fetch_refs(self.entity, buffer)
+        else:
+            self.start_highlight(buffer=buffer)
 
 
 def cleanup_autohighlight_messages():
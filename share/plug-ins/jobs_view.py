@@ -11,8 +11,11 @@ import GPS
 import os
 import shutil
 import datetime
+import hashlib
+import json
 import yaml
 import glob
+import zlib
 import tool_output
 from modules import Module
 from gi.repository import Gtk
@@ -21,64 +24,326 @@ from gps_utils import make_interactive
 
 MAX_SAVED_RUNS = 16  # The maximum number of runs to remember
 
+ARCHIVE_DIR = 'runs_archive'  # The archive, in the artifacts directory
+
+CHUNK_SIZE = 256 * 1024  # The size of the chunks read from the objects
+
+
+class RunArchive(object):
+    """The saved runs, stored in a directory which contains:
+
+       - an "objects" directory, with the contents of the saved files and
+         the output of the runs. Each object is compressed and stored under
+         its SHA-1, so that identical contents are only stored once.
+
+       - an "index" file, which lists the runs, one JSON object per line.
+         New runs are appended to it, and only the new lines are read
+         when the archive is loaded again.
+
+       The saved files are described by manifests, stored as objects,
+       which map the name of each file, relative to the saved directory,
+       to [sha, size, mtime] (or None for directories).
+
+       Only the last max_runs runs are kept: when a run is added, the index
+       is rewritten without the oldest runs, and the objects they were the
+       only ones to use are removed.
+
+       The directory is only created when the first run is added.
+    """
+
+    def __init__(self, directory, max_runs=MAX_SAVED_RUNS):
+        self.directory = directory
+        self.max_runs = max_runs
+        self.runs = {}  # The runs, indexed by their timestamp
+        self._offset = 0  # How much of the index has been read
+
+    def _index_file(self):
+        return os.path.join(self.directory, 'index')
+
+    def _object_file(self, sha):
+        return os.path.join(self.directory, 'objects', sha[:2], sha[2:])
+
+    def _write_object(self, data):
+        """Store data, if not already stored, and return its SHA-1"""
+        sha = hashlib.sha1(data).hexdigest()
+        f = self._object_file(sha)
+        if not os.path.exists(f):
+            d = os.path.dirname(f)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            with open(f + '.tmp', 'wb') as fd:
+                fd.write(zlib.compress(data))
+            os.rename(f + '.tmp', f)
+        return sha
+
+    def _read_object(self, sha):
+        with open(self._object_file(sha), 'rb') as fd:
+            return zlib.decompress(fd.read())
+
+    def _read_object_chunks(self, sha):
+        """Yield the contents of an object, in chunks that end on a line
+           boundary, so that large objects are never fully loaded.
+        """
+        decompressor = zlib.decompressobj()
+        pending = ''
+        with open(self._object_file(sha), 'rb') as fd:
+            while True:
+                data = fd.read(CHUNK_SIZE)
+                if not data:
+                    break
+                pending += decompressor.decompress(data)
+                last = pending.rfind('\n')
+                if last >= 0:
+                    yield pending[:last + 1]
+                    pending = pending[last + 1:]
+        pending += decompressor.flush()
+        if pending:
+            yield pending
+
+    def load(self):
+        """Read the runs added to the index since the last call.
+           Return True if the list of runs has changed.
+        """
+        try:
+            size = os.stat(self._index_file()).st_size
+        except OSError:
+            size = 0
+
+        changed = False
+        if size < self._offset:
+            # The index was rewritten: read it again
+            self.runs = {}
+            self._offset = 0
+            changed = True
+
+        if size == self._offset:
+            return changed
+
+        with open(self._index_file(), 'rb') as fd:
+            fd.seek(self._offset)
+            data = fd.read(size - self._offset)
+
+        # Ignore the last line if it is incomplete
+        end = data.rfind('\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                run = json.loads(line)
+                self.runs[run['timestamp']] = run
+                changed = True
+            except (ValueError, KeyError):
+                pass
+        self._offset += end
+        return changed
+
+    def _previous_manifest(self, name):
+        """Return the manifest for the directory name in the latest run that
+           saved it, or an empty dict.
+        """
+        for timestamp in sorted(self.runs, reverse=True):
+            sha = self.runs[timestamp]['files'].get(name)
+            if sha:
+                try:
+                    return json.loads(self._read_object(sha))
+                except (IOError, ValueError, zlib.error):
+                    return {}
+        return {}
+
+    def _save_dir(self, directory):
+        """Store the files in directory, and return the SHA-1 of their
+           manifest.
+        """
+        previous = self._previous_manifest(os.path.basename(directory))
+        manifest = {}
+        for root, dirs, files in os.walk(directory, followlinks=True):
+            rel_root = os.path.relpath(root, directory)
+            for d in dirs:
+                manifest[os.path.normpath(os.path.join(rel_root, d))] = None
+            for f in files:
+                path = os.path.join(root, f)
+                rel = os.path.normpath(os.path.join(rel_root, f))
+                st = os.stat(path)
+                entry = previous.get(rel)
+
+                # Files that have the same size and date as in the previous
+                # run are not read again.
+                if (entry is None or entry[1] != st.st_size or
+                        entry[2] != st.st_mtime or
+                        not os.path.exists(self._object_file(entry[0]))):
+                    with open(path, 'rb') as fd:
+                        entry = [self._write_object(fd.read()),
+                                 st.st_size, st.st_mtime]
+                manifest[rel] = entry
+
+        return self._write_object(json.dumps(manifest, sort_keys=True))
+
+    def add(self, run, dirs, output):
+        """Add a run to the archive.
+
+           :param dict run: the description of the run, with at least
+              a 'timestamp' key
+           :param list dirs: the directories to save with the run
+           :param str output: the output of the run
+        """
+        self.load()
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+
+        run = dict(run)
+        run['output'] = self._write_object(output)
+        run['files'] = {os.path.basename(d): self._save_dir(d)
+                        for d in dirs if os.path.isdir(d)}
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(self._index_file(), 'ab') as fd:
+            fd.write(json.dumps(run) + '\n')
+        self.load()
+
+        if len(self.runs) > self.max_runs:
+            self.prune()
+
+    def _referenced_objects(self):
+        """Return the set of objects used by the runs"""
+        used = set()
+        for run in self.runs.itervalues():
+            used.add(run['output'])
+            for sha in run['files'].itervalues():
+                used.add(sha)
+                try:
+                    manifest = json.loads(self._read_object(sha))
+                except (IOError, ValueError, zlib.error):
+                    continue
+                used.update(entry[0] for entry in manifest.itervalues()
+                            if entry is not None)
+        return used
+
+    def prune(self):
+        """Remove the oldest runs, so that only max_runs remain, and the
+           objects that are no longer used.
+        """
+        self.load()
+        kept = sorted(self.runs)[-self.max_runs:]
+        self.runs = {timestamp: self.runs[timestamp] for timestamp in kept}
+
+        index = self._index_file()
+        with open(index + '.tmp', 'wb') as fd:
+            for timestamp in kept:
+                fd.write(json.dumps(self.runs[timestamp]) + '\n')
+        os.rename(index + '.tmp', index)
+        self._offset = os.stat(index).st_size
+
+        used = self._referenced_objects()
+        objects = os.path.join(self.directory, 'objects')
+        for prefix in os.listdir(objects):
+            d = os.path.join(objects, prefix)
+            for name in os.listdir(d):
+                if prefix + name not in used:
+                    os.remove(os.path.join(d, name))
+            if not os.listdir(d):
+                os.rmdir(d)
+
+    def restore_files(self, run, dest):
+        """Restore the directories saved with run in dest"""
+        for name, sha in run['files'].iteritems():
+            manifest = json.loads(self._read_object(sha))
+            tgt = os.path.join(dest, name)
+            if os.path.exists(tgt):
+                shutil.rmtree(tgt)
+            os.makedirs(tgt)
+
+            # Sorting creates the directories before their contents
+            for rel in sorted(manifest):
+                entry = manifest[rel]
+                path = os.path.join(tgt, rel)
+                if entry is None:
+                    if not os.path.isdir(path):
+                        os.makedirs(path)
+                else:
+                    with open(path, 'wb') as fd:
+                        for chunk in self._read_object_chunks(entry[0]):
+                            fd.write(chunk)
+                    # Restore the date, so that the file is not read again
+                    # when the next run is saved.
+                    os.utime(path, (entry[2], entry[2]))
+
+    def read_output(self, run):
+        """Yield the output of run, in chunks that end on a line boundary"""
+        return self._read_object_chunks(run['output'])
+
 
 class SavedRunManager(object):
     """A singleton which handles the global list of saved runs"""
 
     def __init__(self):
         self.widget = None  # The view
+        self.archive = None  # The RunArchive for the current project
         self.runs = {}  # The saved runs, indexed by their timestamp
         self.reload_from_disk()
 
-    def _get_archive_file(self):
+    def _get_archive_dir(self):
         return os.path.join(
             GPS.Project.root().artifacts_dir(),
-            'runs.yaml')
+            ARCHIVE_DIR)
+
+    def _import_yaml_archive(self):
+        """Import the runs saved in runs.yaml by previous versions of GPS,
+           and remove the old copies of their files.
+        """
+        base = GPS.Project.root().artifacts_dir()
+        f = os.path.join(base, 'runs.yaml')
+        if not os.path.exists(f):
+            return
+
+        with open(f, 'rb') as fd:
+            runs = yaml.load(fd.read()) or {}
+
+        saved_runs = os.path.join(base, 'saved_runs')
+        for timestamp in sorted(runs):
+            run = runs[timestamp]
+            output = run.pop('output', '')
+            run.pop('files', None)
+            self.archive.add(
+                run,
+                glob.glob(os.path.join(saved_runs,
+                                       timestamp.replace(':', '_'), '*')),
+                output)
+
+        os.rename(f, f + '.imported')
+        shutil.rmtree(saved_runs, ignore_errors=True)
 
     def reload_from_disk(self):
-        f = self._get_archive_file()
-        if os.path.exists(f):
-            with open(f, 'rb') as fd:
-                self.runs = yaml.load(fd.read())
+        directory = self._get_archive_dir()
+        changed = self.archive is None or self.archive.directory != directory
+        if changed:
+            self.archive = RunArchive(directory)
+            self._import_yaml_archive()
+
+        changed = self.archive.load() or changed
+        self.runs = self.archive.runs
 
         # Refresh the widget
-        if self.widget:
+        if self.widget and changed:
             self.widget.refresh()
 
-    def _save_to_disk(self):
-        with open(self._get_archive_file(), 'wb') as fd:
-            fd.write(yaml.dump(self.runs))
-
-    def _save_dir(self, run):
-        base = os.path.join(GPS.Project.root().artifacts_dir(),
-                            'saved_runs')
-        if not os.path.exists(base):
-            os.mkdir(base)
-        return os.path.join(base, run['timestamp'].replace(':', '_'))
-
     def restore_run(self, run_timestamp):
         run = self.runs[run_timestamp]
-        # Restore the files from the saved dir
-        src = self._save_dir(run)
-        dest = GPS.Project.root().artifacts_dir()
-        for f in glob.glob(os.path.join(src, '*')):
-            tgt = os.path.join(dest, os.path.basename(f))
-            if os.path.exists(tgt):
-                shutil.rmtree(tgt)
-            shutil.copytree(f, tgt)
+        # Restore the files from the archive
+        self.archive.restore_files(run, GPS.Project.root().artifacts_dir())
 
         # Clear the Messages view
         GPS.Console("Messages").clear()
         # Clear the locations
         GPS.Locations.remove_category(run["category"])
 
-        # Get the output parser and run the output through it
+        # Get the output parser and run the output through it, one chunk
+        # at a time
         parser_text = run['output_parser']
         # TODO: make this part more generic
         if parser_text == "GNATprove_Parser":
             import spark2014
             parser = spark2014.GNATprove_Parser(None)
-        parser.on_stdout(run['output'], None)
+        for chunk in self.archive.read_output(run):
+            parser.on_stdout(chunk, None)
         parser.on_exit(0, None)  # TODO save status?
 
     def add_run(self, label, output_parser, files, output):
@@ -87,25 +352,14 @@ class SavedRunManager(object):
             label: a string in pango markup format, used for display in
             the tree
         """
-        # Add the run to the list
+        # Add the run to the archive, with a copy of the files
         run = {'label': label,
                'category': output_parser.split('_')[0],  # TODO: improve
                'output_parser': output_parser,
-               'files': files,
-               'output': output,
                'timestamp': datetime.datetime.now().isoformat()}
-        self.runs[run['timestamp']] = run
-
-        # Copy the files to the save dir
-        dest = self._save_dir(run)
-        if os.path.exists(dest):
-            shutil.rmtree(dest)
-        os.mkdir(dest)
-        for f in files:
-            shutil.copytree(f, os.path.join(dest, os.path.basename(f)))
-
-        # Save the list to disk
-        self._save_to_disk()
+        self.reload_from_disk()
+        self.archive.add(run, files, output)
+        self.runs = self.archive.runs
 
         # Refresh the widget
         if self.widget:
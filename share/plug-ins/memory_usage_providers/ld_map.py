@@ -0,0 +1,300 @@
+"""
+A parser for the memory map files generated by ld with the '-map' switch.
+
+This module does not depend on GPS, so that it can be tested and benchmarked
+outside of it. The map file is read line by line, so that huge map files do
+not need to be loaded in memory, and the result is cached until the map file
+changes on disk.
+
+Here is an example of use::
+
+    parser = MapFileParser(map_dir)
+    with open(map_file_name) as f:
+        for line in f:
+            parser.feed(line)
+    regions, sections, modules = parser.result()
+"""
+
+import bisect
+import os.path
+import re
+
+# The regexps used to match the information we want to fetch. Regions and
+# sections are described on lines starting with their name, modules and
+# symbols on lines starting with spaces.
+
+region_r = re.compile(r'^(?P<name>\w+)\s+(?P<origin>0x[0-9a-f]+)' +
+                      r'\s+(?P<length>0x[0-9a-f]+)\s+x?r?w?')
+section_r = re.compile(r'^(?P<name>[\w.]+)\s+(?P<origin>0x[0-9a-f]+)' +
+                       r'\s+(?P<length>0x[0-9a-f]+)')
+module_r = re.compile(r'^\s+[\w.]*\s+(?P<origin>0x[0-9a-f]+)\s+' +
+                      r'(?P<size>0x[0-9a-f]+) (?P<files>.+\.o\)?)')
+symbol_r = re.compile(r'^\s+(?P<address>0x[0-9a-f]+)\s+' +
+                      r'(?P<name>[A-Za-z_][\w.$]*)\s*$')
+files_r = re.compile(r'\(|\)')
+
+# Sections with these prefixes are not loaded on the target
+NOT_ALLOCATED_SECTIONS_PREFIXES = ('.debug', '.comment')
+
+
+class RegionIndex(object):
+    """
+    Find the memory region containing a given address, using a binary search
+    on the regions sorted by origin.
+    """
+
+    def __init__(self):
+        self.__starts = []
+        self.__regions = []   # (start, end, name), sorted by start
+        self.__overlapping = False
+        self.__all = []       # (start, end, name), in declaration order
+
+    def add(self, name, origin, length):
+        """
+        Add a region.
+
+        :param str name: the name of the region
+        :param int origin: the address of the region
+        :param int length: the length of the region
+        """
+        region = (origin, origin + length, name)
+        self.__all.append(region)
+
+        index = bisect.bisect_right(self.__starts, origin)
+        if ((index > 0 and self.__regions[index - 1][1] > origin) or
+                (index < len(self.__regions) and
+                 self.__regions[index][0] < origin + length)):
+            self.__overlapping = True
+
+        self.__starts.insert(index, origin)
+        self.__regions.insert(index, region)
+
+    def find(self, addr):
+        """
+        Return the name of the region associated with the given address or
+        an empty string if not found. If several regions contain addr,
+        the one declared first wins.
+
+        :param int addr: the address
+        """
+        if self.__overlapping:
+            for start, end, name in self.__all:
+                if start <= addr < end:
+                    return name
+            return ""
+
+        index = bisect.bisect_right(self.__starts, addr) - 1
+        if index >= 0:
+            start, end, name = self.__regions[index]
+            if addr < end:
+                return name
+        return ""
+
+
+def is_section_allocated(section):
+    """
+    Return True if the given section tuple is going to be allocated in
+    memory, False otherwise.
+
+    An allocated section is a memory section that will actually be
+    loaded by the target. Sections related with debug information,
+    code comments or that have null size are typically not allocated
+    and should be ignored.
+    """
+    return (section[2] != 0 and
+            not section[0].startswith(NOT_ALLOCATED_SECTIONS_PREFIXES))
+
+
+class MapFileParser(object):
+    """
+    Parse a map file, one line at a time.
+    """
+
+    def __init__(self, map_dir, with_symbols=False):
+        """
+        :param str map_dir: the directory of the map file, used for the
+           object files given without any directory
+        :param bool with_symbols: whether to also collect the symbols
+        """
+        self.map_dir = map_dir
+        self.with_symbols = with_symbols
+
+        self.regions = []
+        self.sections = []
+        self.symbols = []
+        self.__region_index = RegionIndex()
+        self.__modules = {}     # indexed by (files_info, section_name)
+        self.__modules_order = []
+        self.__current_module = None
+        self.__section_allocated = False
+
+    def feed(self, line):
+        """Parse one line of the map file"""
+
+        if not line:
+            return
+
+        # Cheap substring tests are used to avoid running the regexps on
+        # lines that cannot match.
+
+        if line[0] in ' \t':
+            # Only modules and symbols are described on indented lines
+            m = module_r.search(line) if '.o' in line else None
+            if m:
+                self.__add_module(m)
+            elif self.with_symbols and self.__current_module:
+                m = symbol_r.search(line)
+                if m:
+                    self.__add_symbol(m)
+            return
+
+        if '0x' not in line:
+            return
+
+        m = region_r.search(line)
+        if m:
+            origin = m.group('origin')
+            length = int(m.group('length'), 16)
+            self.regions.append((m.group('name'), origin, length))
+            self.__region_index.add(m.group('name'), int(origin, 16), length)
+            return
+
+        m = section_r.search(line)
+        if m:
+            origin = m.group('origin')
+            section = (m.group('name'), origin,
+                       int(m.group('length'), 16),
+                       self.__region_index.find(int(origin, 16)))
+            self.sections.append(section)
+            self.__section_allocated = is_section_allocated(section)
+            self.__current_module = None
+
+    def __add_module(self, m):
+        """
+        Handle a module description, which gives information about the size
+        taken by an object file in a given section.
+        """
+
+        # Do nothing if sections have not been parsed yet, if the module
+        # belongs to a section that will not be allocated or if its size is
+        # null.
+
+        self.__current_module = None
+        if not self.sections or not self.__section_allocated:
+            return
+
+        module_size = int(m.group('size'), 16)
+        if module_size == 0:
+            return
+
+        files_info = m.group('files')
+        section = self.sections[-1]
+        section_name = section[0]
+        key = (files_info, section_name)
+        module = self.__modules.get(key, None)
+
+        # If a previous module decription has been found for the same
+        # key, just add the size of this one to the previously found
+        # one.
+
+        if module:
+            module[3] += module_size
+        else:
+            # Get the object file name and, if any, information about
+            # the library for which this file has been compiled.
+
+            files = files_r.split(files_info)
+            obj_file = files[0] if len(files) == 1 else files[1]
+            lib_file = files[0] if len(files) > 1 else ""
+
+            # If the object file name does not contain any directory
+            # information assume that this file is located in the same
+            # directory as the map file.
+
+            if not os.path.dirname(obj_file) and not lib_file:
+                obj_file = os.path.join(self.map_dir, obj_file)
+
+            module = [obj_file, lib_file, m.group('origin'), module_size,
+                      section[3], section_name]
+            self.__modules[key] = module
+            self.__modules_order.append(module)
+
+        self.__current_module = module
+
+    def __add_symbol(self, m):
+        """
+        Handle a symbol defined in the current module
+        """
+        module = self.__current_module
+        self.symbols.append(
+            (m.group('name'), m.group('address'),
+             module[0], module[1], module[4], module[5]))
+
+    def result(self):
+        """
+        Return the parsed data, as expected by
+        GPS.MemoryUsageProviderVisitor.on_memory_usage_data_fetched: a tuple
+        (regions, sections, modules).
+        Only the sections that will be allocated in memory are kept.
+        """
+        return (self.regions,
+                [s for s in self.sections if is_section_allocated(s)],
+                [tuple(m) for m in self.__modules_order])
+
+
+_cache = {}
+# The parsed map files, indexed by file name. The values are tuples
+# (mtime, size, with_symbols, result, symbols).
+
+
+def get_cached(map_file_name, with_symbols=False):
+    """
+    Return the (regions, sections, modules, symbols) parsed from the given
+    map file during a previous call to parse_map_file, or None if the file
+    has changed since then.
+    """
+    try:
+        st = os.stat(map_file_name)
+    except OSError:
+        return None
+
+    cached = _cache.get(map_file_name)
+    if (cached and cached[0] == st.st_mtime and cached[1] == st.st_size and
+            (cached[2] or not with_symbols)):
+        return cached[3] + (cached[4], )
+    return None
+
+
+def set_cached(map_file_name, parser):
+    """
+    Store the result of parser for map_file_name in the cache, and
+    return (regions, sections, modules, symbols).
+    """
+    result = parser.result()
+    try:
+        st = os.stat(map_file_name)
+        _cache[map_file_name] = (st.st_mtime, st.st_size,
+                                 parser.with_symbols, result, parser.symbols)
+    except OSError:
+        pass
+    return result + (parser.symbols, )
+
+
+def parse_map_file(map_file_name, with_symbols=False):
+    """
+    Parse the given map file, or reuse the result of a previous parse if
+    the file has not changed.
+    Return a tuple (regions, sections, modules, symbols). symbols is a list
+    of (name, address, obj_file, lib_file, region_name, section_name) tuples,
+    empty unless with_symbols is True.
+    """
+    cached = get_cached(map_file_name, with_symbols)
+    if cached is not None:
+        return cached
+
+    parser = MapFileParser(os.path.dirname(map_file_name), with_symbols)
+    with open(map_file_name, 'r') as f:
+        for line in f:
+            parser.feed(line)
+
+    return set_cached(map_file_name, parser)
@@ -17,6 +17,7 @@ import json
 import re
 import sys
 import fnmatch
+from gps_utils import xml_registry
 
 # We create the actions and menus in XML instead of python to share the same
 # source for GPS and GNATbench (which only understands the XML input for now).
@@ -1164,11 +1165,20 @@ class GNATProve_Plugin:
     # The GNATprove_Parser instance used to parse the tool's output
 
     def __init__(self):
-        process = GPS.Process("gnatprove -h")
-        help_msg = process.get_result()
-        GPS.parse_xml(xml_gnatprove.format(help=help_msg,
-                                           output_parsers=OUTPUT_PARSERS))
-        GPS.parse_xml(xml_gnatprove_menus % {'prefix': prefix})
+        def generate():
+            process = GPS.Process("gnatprove -h")
+            help_msg = process.get_result()
+            return xml_gnatprove.format(help=help_msg,
+                                        output_parsers=OUTPUT_PARSERS)
+
+        # Running gnatprove is slow: reuse the previous result as long as
+        # neither gnatprove nor this plugin have changed.
+        xml_registry.register_generated(
+            "gnatprove", generate,
+            depends_on=[__file__, gnatprove_file, gnatprove],
+            defer=False)
+        xml_registry.register(
+            xml_gnatprove_menus % {'prefix': prefix}, defer=False)
 
     def show_report(self):
         """Display the Analysis Report with the GNATprove messages."""
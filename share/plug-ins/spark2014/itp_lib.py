@@ -1,8 +1,10 @@
 import GPS
 import json
+import time
+from collections import deque, OrderedDict
 from os import path, utime
 # Import graphics Gtk libraries for proof interactive elements
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GLib
 
 debug_mode = False
 # This is a file which is used as output to the stderr of gnat_server (in cases
@@ -19,6 +21,15 @@ is_init = False
 GREEN = Gdk.RGBA(0, 1, 0, 0.2)
 RED = Gdk.RGBA(1, 0, 0, 0.2)
 
+# The notifications of the ITP server are applied in batches, in an idle
+# callback. BATCH_DURATION is the maximal time (in seconds) spent in one
+# batch before giving control back to the interface.
+BATCH_DURATION = 0.05
+
+# When at least this number of notifications are waiting, the proof tree is
+# detached from its view while they are applied.
+DETACH_THRESHOLD = 100
+
 # By default the root node of the proof tree is 0. It does not correspond to
 # a visible node: it is used when no node can be found.
 ROOT_NODE = 0
@@ -242,7 +253,7 @@ def parse_notif(j, abs_tree, proof_task):
             tree.update_iter(node_id, 2, new_prover_name)
         else:
             print_debug("TODO")
-        abs_tree.get_next_id(str(node_id))
+        abs_tree.request_next_id(str(node_id))
         print_debug(NODE_CHANGE)
     elif notif_type == REMOVE:
         node_id = j[NODE_ID]
@@ -418,10 +429,81 @@ class Tree:
         # find something that do exactly this in Gtk ??? (does not exist ?)
         self.node_id_to_row_ref = {}
 
+        # Between begin_update and end_update, the changes to existing rows
+        # are stored in pending (a dictionary from node_id to a dictionary
+        # from field to value) and applied only once per node, and the
+        # expansion of the tree and the jumps to other nodes are delayed.
+        # The jumps are then replayed in order, since each of them only
+        # applies if its origin is selected at that point.
+        self.updating = False
+        self.pending = {}
+        self.need_expand = False
+        self.pending_jumps = OrderedDict()
+
+        # The selection, saved while the view is detached from the model
+        self.detached = False
+        self.selected = []
+        self.restoring_selection = False
+
+    def begin_update(self, detach):
+        """ Start applying a batch of changes. If detach is True, the model
+            is also detached from the view until end_update.
+        """
+        self.updating = True
+        if detach:
+            model, paths = self.view.get_selection().get_selected_rows()
+            self.selected = [Gtk.TreeRowReference.new(self.model, p)
+                             for p in paths]
+            self.view.set_model(None)
+            self.detached = True
+
+    def end_update(self):
+        """ Apply the changes delayed since begin_update """
+        self.updating = False
+        self.flush()
+
+        if self.detached:
+            self.view.set_model(self.model)
+            self.detached = False
+            self.restoring_selection = True
+            tree_selection = self.view.get_selection()
+            for row in self.selected:
+                if row.valid():
+                    tree_selection.select_path(row.get_path())
+            self.selected = []
+            self.restoring_selection = False
+            self.need_expand = True
+
+        if self.need_expand:
+            self.need_expand = False
+            self.view.expand_all()
+
+        jumps = self.pending_jumps
+        self.pending_jumps = OrderedDict()
+        for from_node, to_node in jumps:
+            self.node_jump_select(from_node, to_node)
+
+    def flush(self):
+        """ Apply the pending changes to the rows """
+        pending = self.pending
+        self.pending = {}
+        for node_id, fields in pending.iteritems():
+            row = self.node_id_to_row_ref.get(node_id)
+            if row is None or not row.valid():
+                print_debug("update of a removed node: " + str(node_id))
+                continue
+            iter = self.model.get_iter(row.get_path())
+            values = self.model[iter]
+            for field, value in fields.iteritems():
+                if field == 4:
+                    values[5] = create_color(value)
+                values[field] = value
+
     def clear(self):
         """ clear the content of the tree """
         self.node_id_to_row_ref = {}
         self.roots = []
+        self.pending = {}
         self.model.clear()
 
     def get_iter(self, node):
@@ -465,11 +547,18 @@ class Tree:
         self.set_iter(new_iter, node)
         # ??? We currently always expand the tree. We may not want to do that
         # in the future.
-        self.view.expand_all()
+        if self.updating:
+            self.need_expand = True
+        else:
+            self.view.expand_all()
 
     def update_iter(self, node_id, field, value):
         """ update a node of the tree"""
 
+        if self.updating:
+            self.pending.setdefault(node_id, {})[field] = value
+            return
+
         row = self.node_id_to_row_ref[node_id]
         path = row.get_path()
         iter = self.model.get_iter(path)
@@ -486,11 +575,16 @@ class Tree:
         iter = self.model.get_iter(path)
         self.model.remove(iter)
         del self.node_id_to_row_ref[node_id]
+        self.pending.pop(node_id, None)
 
     def node_jump_select(self, from_node, to_node):
         """  Automatically jumps from from_node to to_node if from_node is
              selected """
 
+        if self.updating:
+            self.pending_jumps[(from_node, to_node)] = True
+            return
+
         tree_selection = self.view.get_selection()
         try:
             if not tree_selection.count_selected_rows() == 0 and \
@@ -526,10 +620,13 @@ class Tree:
         """
         b = is_init
         for node_id in self.roots:
-            row = self.node_id_to_row_ref[node_id]
-            path = row.get_path()
-            iter = self.model.get_iter(path)
-            b = b and self.model[iter][4] == UPROVED
+            status = self.pending.get(node_id, {}).get(4)
+            if status is None:
+                row = self.node_id_to_row_ref[node_id]
+                path = row.get_path()
+                iter = self.model.get_iter(path)
+                status = self.model[iter][4]
+            b = b and status == UPROVED
         return(b)
 
 
@@ -547,6 +644,13 @@ class Tree_with_process:
         self.send_queue = ""
         self.size_queue = 0
         self.checking_notification = False
+        # The notifications received from the ITP server and not applied yet
+        self.notifications = deque()
+        # The idle callback applying the notifications, if any
+        self.processing = None
+        # The nodes for which the next unproven node should be requested,
+        # once the current batch of notifications has been applied.
+        self.next_id_requests = OrderedDict()
         print_debug("ITP launched")
 
     def start(self, command, source_file_path, dir_gnat_server, mlw_file):
@@ -558,6 +662,8 @@ class Tree_with_process:
         self.file_name = source_file_path
         # init local variables
         self.save_and_exit = False
+        self.notifications.clear()
+        self.next_id_requests.clear()
 
         # init the tree
         self.tree = Tree()
@@ -597,6 +703,7 @@ class Tree_with_process:
 
         global itp_started
         itp_started = False
+        self.notifications.clear()
 
         a = GPS.Console(ITP_CONSOLE)
         # Any closing destroying can fail so try are needed to avoid killing
@@ -644,8 +751,51 @@ class Tree_with_process:
     def check_notifications(self, unused, delimiter, notification):
         """ function used as an on_match by the GPS.Process used to launch
             the itp server. This does the server to plugin communication.
+            The notifications are queued, and applied in batches by
+            apply_notifications.
         """
+        self.notifications.append(notification)
+        if self.processing is None:
+            self.processing = GLib.idle_add(self.apply_notifications)
+
+    def apply_notifications(self):
+        """ Apply the queued notifications during at most BATCH_DURATION.
+            This is an idle callback, which returns True while notifications
+            remain to be applied.
+        """
+        if not itp_started:
+            self.notifications.clear()
+            self.processing = None
+            return False
+
         self.checking_notification = True
+        deadline = time.time() + BATCH_DURATION
+        self.tree.begin_update(
+            detach=len(self.notifications) >= DETACH_THRESHOLD)
+        try:
+            while self.notifications and itp_started:
+                self.apply_notification(self.notifications.popleft())
+                if time.time() > deadline:
+                    break
+        finally:
+            # The tree has been destroyed if the session was killed
+            if itp_started:
+                self.tree.end_update()
+            self.checking_notification = False
+
+        requests = self.next_id_requests
+        self.next_id_requests = OrderedDict()
+        if itp_started:
+            for node_id in requests:
+                self.get_next_id(node_id)
+
+        if self.notifications and itp_started:
+            return True
+        self.processing = None
+        return False
+
+    def apply_notification(self, notification):
+        """ Parse one notification of the itp server, and apply it """
         print_debug(notification)
         try:
             # Remove remaining stderr output (stderr and stdout are mixed) by
@@ -668,12 +818,13 @@ class Tree_with_process:
         except (TypeError):
             print ("Bad type")
             print (notification)
-        self.checking_notification = False
 
     def select_function(self, select, model, path, currently_selected):
         """ function used as the select function of the proof tree """
 
-        if not currently_selected:
+        if self.tree.restoring_selection:
+            return True
+        elif not currently_selected:
             tree_iter = model.get_iter(path)
             self.get_task(model[tree_iter][0])
             return True
@@ -781,6 +932,13 @@ class Tree_with_process:
                    '"full_context": false }')
         self.send(request)
 
+    def request_next_id(self, modified_id):
+        """ Request the next unproven node after modified_id, once the
+            current batch of notifications has been applied. A single
+            request is sent for each node modified in the batch.
+        """
+        self.next_id_requests[modified_id] = True
+
     def get_next_id(self, modified_id):
         """ Specific request for the next unproven node to the server """
         req = '{"ide_request": "Get_first_unproven_node", "' + NODE_ID + '":'
@@ -21,6 +21,10 @@ from xml.sax.saxutils import escape
 
 prev_xml = ""
 
+prev_rules = None
+# The warnings list from which prev_xml was generated. gnat_rules only
+# replaces this list when the output of codepeer-gnatmake has changed.
+
 xml_codepeer = """<?xml version="1.0"?>
   <CODEPEER>
     <doc_path>{root}/share/doc/codepeer</doc_path>
@@ -771,14 +775,17 @@ xmlTrailer = """
 
 
 def get_supported_warnings():
-    global prev_xml
+    global prev_xml, prev_rules
+    rules = gps_utils.gnat_rules.get_warnings_list("codepeer-gnatmake", "-h")
+    if rules is prev_rules:
+        return
+
     default_on = ""
     # Then retrieve warnings checks from gnatmake
     xml = """
        <popup label="Warnings">
        <expansion switch="--gnat-warnings="/>
     """
-    rules = gps_utils.gnat_rules.get_warnings_list("codepeer-gnatmake", "-h")
     for rule in rules:
         r = copy.deepcopy(rule)
         default_on += r.switch[6:] if r.default else ""
@@ -799,6 +806,7 @@ def get_supported_warnings():
     if prev_xml != xml:
         GPS.parse_xml(xmlHead + xml + xmlTrailer)
         prev_xml = xml
+    prev_rules = rules
 
 
 def on_project_view_changed(hook):
@@ -18,50 +18,83 @@ Note that GPS calls gcov so that the .gcov files are generated
 ###########################################################################
 
 import GPS
+import multiprocessing
 import os
 import re
+import shutil
 from gps_utils import interactive
 from GPS import MDI, Project, Process, CodeAnalysis
+from workflows import task_workflow
+from workflows.promises import Promise
 
-# A class to display the output of gcov in a separate console.
+UNITS_PER_SHARD = 100
+# The maximum number of units given to one gcov process
 
+WATCHDOG_PERIOD = 500
+# How often, in milliseconds, to check whether the gcov task was interrupted
 
-class Gcov_Process (GPS.Console, GPS.Process):
+SHARD_DIR = "gcov_shard_%d"
+# The directories, in the gcov directory, where the gcov processes run
 
-    def on_output(self, unmatched, matched):
-        self.write(unmatched + matched)
+RESPONSE_FILE = "gcov_input.txt"
+# The response file listing the units of a shard, in its directory
 
-    def on_exit(self, status, remaining_output):
-        self.write(remaining_output)
-        if status == 0:
-            self.write("process terminated successfully")
-        else:
-            self.write("process terminated [" + str(status) + "]")
 
-        # Show coverage report
-        analysis = CodeAnalysis.get("Coverage")
+def show_coverage_report():
+    """Load the .gcov files and show the coverage report"""
+    analysis = CodeAnalysis.get("Coverage")
 
-        if GPS.Project.root().is_harness_project():
-            original = GPS.Project.root().original_project().file()
-            analysis.add_gcov_project_info(original)
-        else:
-            analysis.add_all_gcov_project_info()
+    if GPS.Project.root().is_harness_project():
+        original = GPS.Project.root().original_project().file()
+        analysis.add_gcov_project_info(original)
+    else:
+        analysis.add_all_gcov_project_info()
 
-        analysis.show_analysis_report()
+    analysis.show_analysis_report()
 
-        self.kill()
 
-    def on_input(self, input):
-        self.send(input)
+def collect_shard(shard_dir, gcov_dir):
+    """
+    Move the .gcov files generated in shard_dir to gcov_dir, then remove
+    shard_dir along with its response file.
+    A source shared by units of several shards (a generic or a header) is
+    processed by each of them: the last shard to terminate provides its
+    .gcov file, as when gcov processes the units one after the other.
+    """
+    try:
+        names = os.listdir(shard_dir)
+    except OSError:
+        return
 
-    def on_destroy(self):
-        self.kill()
+    for name in names:
+        if name.endswith(".gcov"):
+            target = os.path.join(gcov_dir, name)
+            try:
+                if os.path.exists(target):
+                    os.remove(target)
+                os.rename(os.path.join(shard_dir, name), target)
+            except OSError:
+                pass
+
+    shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+# A gcov process, processing the units listed in one response file, and
+# displaying its output in a console shared by all the gcov processes.
 
-    def __init__(self, process, args="", directory=""):
-        GPS.Console.__init__(self, "Executing gcov",
-                             on_input=Gcov_Process.on_input,
-                             on_destroy=Gcov_Process.on_destroy,
-                             force=True)
+class Gcov_Process (GPS.Process):
+
+    def on_output(self, unmatched, matched):
+        self.console.write(unmatched + matched)
+
+    def on_exit(self, status, remaining_output):
+        self.console.write(remaining_output)
+        self.promise.resolve(status)
+
+    def __init__(self, console, process, args="", directory=""):
+        self.console = console
+        self.promise = Promise()
+        # Resolved with the exit status of the process
 
         GPS.Process.__init__(self, process + ' ' + args, ".+",
                              remote_server="Build_Server",
@@ -70,6 +103,152 @@ class Gcov_Process (GPS.Console, GPS.Process):
                              on_match=Gcov_Process.on_output)
 
 
+class Gcov_Collector(object):
+    """
+    Run several gcov processes in parallel, each on its own response file.
+    Each process runs in its own shard directory, so that the processes
+    never write the same .gcov file at the same time: the .gcov files are
+    moved to directory once the process has exited.
+    """
+
+    def __init__(self, shards, directory, jobs):
+        self.shards = list(shards)   # The shard directories
+        self.directory = directory
+        self.jobs = jobs
+        self.processes = []   # The gcov processes currently running
+        self.done = 0
+        self.failed = 0
+        self.interrupted = False
+        self.task = None
+        self.watchdog = None
+        self.promise = Promise()
+        self.console = GPS.Console("Executing gcov", force=True,
+                                   on_destroy=self.__on_destroy)
+
+    def __start_next(self):
+        """Start gcov on the next response file"""
+        shard = self.shards[self.done + len(self.processes)]
+        process = Gcov_Process(
+            self.console, "gcov",
+            "@%s" % os.path.join(shard, RESPONSE_FILE), directory=shard)
+        self.processes.append(process)
+        process.promise.then(
+            lambda status: self.__on_exit(process, shard, status))
+
+    def __on_exit(self, process, shard, status):
+        self.processes.remove(process)
+        collect_shard(shard, self.directory)
+        self.done += 1
+        if status != 0:
+            self.failed += 1
+
+        if self.task and not self.interrupted:
+            self.task.set_progress(self.done, len(self.shards))
+
+        if (not self.interrupted and
+                self.done + len(self.processes) < len(self.shards)):
+            self.__start_next()
+        elif not self.processes:
+            # Remove the shards which were never started
+            for shard in self.shards[self.done:]:
+                shutil.rmtree(shard, ignore_errors=True)
+            self.promise.resolve(self.failed)
+
+    def kill(self):
+        """Stop all the gcov processes"""
+        self.interrupted = True
+        for process in list(self.processes):
+            process.kill()
+
+    def __on_destroy(self, console):
+        self.kill()
+
+    def __check_task(self, timeout):
+        """Stop the gcov processes if the task has been interrupted"""
+        if self.task not in GPS.Task.list():
+            timeout.remove()
+            self.watchdog = None
+            self.kill()
+
+    def run(self, task):
+        """
+        A workflow which runs all the gcov processes, monitored by task.
+        """
+        self.task = task
+        task.set_progress(0, len(self.shards))
+        self.watchdog = GPS.Timeout(WATCHDOG_PERIOD, self.__check_task)
+        for _ in range(min(self.jobs, len(self.shards))):
+            self.__start_next()
+
+        failed = yield self.promise
+
+        if self.watchdog:
+            self.watchdog.remove()
+            self.watchdog = None
+
+        if self.interrupted:
+            return
+
+        if failed == 0:
+            self.console.write("process terminated successfully\n")
+        else:
+            self.console.write(
+                "%s gcov process(es) terminated with errors\n" % failed)
+
+        show_coverage_report()
+
+
+def index_object_dir(object_dir):
+    """
+    List the coverage files in object_dir.
+    Return a tuple (gcda, gcno): gcda is a dict associating the name of a
+    unit with the path of its .gcda file, gcno is the set of units for
+    which a .gcno file was found.
+    """
+    gcda = {}
+    gcno = set()
+
+    try:
+        names = os.listdir(object_dir)
+    except OSError:
+        return gcda, gcno
+
+    for name in names:
+        unit, ext = os.path.splitext(name)
+        if ext == ".gcda":
+            gcda[unit] = os.path.join(object_dir, name)
+        elif ext == ".gcno":
+            gcno.add(unit)
+
+    return gcda, gcno
+
+
+def is_up_to_date(gcda, gcov_files):
+    """
+    Whether the .gcov files of a unit were generated after the last update
+    of its .gcda file, in which case gcov does not need to run again for
+    this unit. gcov_files are the .gcov files found for the sources of the
+    unit: a spec without code has none.
+    """
+    if not gcov_files:
+        return False
+
+    try:
+        gcda_mtime = os.stat(gcda).st_mtime
+        return all(os.stat(gcov).st_mtime >= gcda_mtime
+                   for gcov in gcov_files)
+    except OSError:
+        return False
+
+
+def get_jobs():
+    """The number of gcov processes to run in parallel"""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
 def using_gcov(context):
     return GPS.Preference('Coverage-Toolchain').get() == 'Gcov'
 
@@ -129,53 +308,84 @@ Please point the environment variable GCOV_ROOT to a directory
 on which you have permission to read and write.
          """)
 
-    input_file = os.path.abspath(os.path.join(gcov_dir, "gcov_input.txt"))
-
     # List all the projects
     projects = root_project.dependencies(True)
     # List all object dirs
     object_dirs = root_project.object_dirs(True)
 
-    # Write the response file
-    res = file(input_file, 'wb')
+    # Read each object directory, and the gcov directory, only once, instead
+    # of checking the existence of the files for each unit.
+
+    indexes = [index_object_dir(d) for d in object_dirs]
+
+    try:
+        existing_gcov = set(os.listdir(gcov_dir))
+    except OSError:
+        existing_gcov = set()
 
     gcda_file_found = False
     gcno_file_found = False
+    gcda_files = []
 
-    for p in projects:
-        sources = p.sources(False)
+    # The units of the projects, associated with the base names of their
+    # sources (for instance the spec and the body of an Ada package)
+    units = {}
 
-        for s in sources:
+    for p in projects:
+        for s in p.sources(False):
             n = s.path
             basename = n[max(n.rfind('\\'), n.rfind('/')) + 1:len(n)]
             unit = basename[0:basename.rfind('.')]
+            units.setdefault(unit, []).append(basename)
 
-            for object_dir in object_dirs:
-                gcda = object_dir + os.sep + unit + ".gcda"
+    seen = set()   # The .gcda files already handled
 
-                # If we have not yet found at least one .gcno file, attempt to
-                # find one. This is to improve the precision of error messages,
-                # and detect the case where compilation was successful but the
-                # executable has never been run.
+    for unit, basenames in units.iteritems():
+        # If we have not yet found at least one .gcno file, attempt to
+        # find one. This is to improve the precision of error messages,
+        # and detect the case where compilation was successful but the
+        # executable has never been run.
 
-                if not gcno_file_found:
-                    gcno = object_dir + os.sep + unit + ".gcno"
-                    if os.access(gcno, os.F_OK):
-                        gcno_file_found = True
+        if not gcno_file_found:
+            gcno_file_found = any(unit in gcno for _, gcno in indexes)
 
-                if os.access(gcda, os.F_OK):
-                    gcda_file_found = True
-                    # Write one entry in response file
-
-                    # Escape all backslashes.
-                    gcda = gcda.replace('\\', '\\\\')
-
-                    res.write('"' + gcda + '"' + "\n")
+        for gcda_index, _ in indexes:
+            gcda = gcda_index.get(unit)
+            if gcda:
+                gcda_file_found = True
+                if gcda in seen:
                     break
-
-    res.close()
-
-    file(input_file).read()
+                seen.add(gcda)
+
+                # Do not run gcov again if the unit has not been
+                # executed since the last run.
+                gcov_files = [os.path.join(gcov_dir, b + ".gcov")
+                              for b in basenames
+                              if b + ".gcov" in existing_gcov]
+                if not is_up_to_date(gcda, gcov_files):
+                    gcda_files.append(gcda)
+                break
+
+    # Write the response files, one per gcov process, each in the directory
+    # where its process runs
+
+    jobs = get_jobs()
+    shard_size = max(1, min(UNITS_PER_SHARD,
+                            (len(gcda_files) + jobs - 1) // jobs))
+    shards = []
+
+    for index in range(0, len(gcda_files), shard_size):
+        shard = os.path.abspath(os.path.join(
+            gcov_dir, SHARD_DIR % len(shards)))
+        shutil.rmtree(shard, ignore_errors=True)
+        os.mkdir(shard)
+        shards.append(shard)
+
+        with open(os.path.join(shard, RESPONSE_FILE), 'wb') as res:
+            for gcda in gcda_files[index:index + shard_size]:
+                # Escape all backslashes.
+                gcda = gcda.replace('\\', '\\\\')
+                res.write('"' + gcda + '"' + "\n")
 
     if not gcno_file_found:
         # No gcno file was found: display an appropriate message.
@@ -192,9 +402,14 @@ the "Code coverage" flags.""")
 Make sure you have run the executable(s) at least once.
 """)
 
+        elif not shards:
+            # All the .gcov files are up to date
+            show_coverage_report()
+
         else:
             # Run gcov
-            Gcov_Process("gcov", "@%s" % input_file, directory=gcov_dir)
+            collector = Gcov_Collector(shards, gcov_dir, jobs)
+            task_workflow("gcov", collector.run)
 
 
 @interactive(name='gcov remove coverage files',
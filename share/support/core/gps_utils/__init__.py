@@ -6,6 +6,7 @@ import UserDict
 import types
 import GPS
 import GPS.Browsers
+from gps_utils import hook_profiler
 
 # The autodoc may not have visibility on gi.repository
 try:
@@ -125,6 +126,7 @@ class hook:
     def __call__(self, fn):
         def do_work(hook, *args, **kwargs):
             return fn(*args, **kwargs)
+        do_work = hook_profiler.profiled(self.name, fn, do_work)
         do_work.__name__ = fn.__name__   # Reset name for interactive()
         do_work.__doc__ = fn.__doc__
         GPS.Hook(self.name).add(do_work, last=self.last)
@@ -7,6 +7,7 @@ And finally a number of predefined text aliases are defined.
 """
 
 import GPS
+import json
 import os
 import os.path
 import re
@@ -15,11 +16,22 @@ import traceback
 import os_utils
 import gnat_switches
 import gps_utils
+import workflows
 from gps_utils.switches import Check, Spin
+from gps_utils.xml_registry import signature
+from workflows.promises import ProcessWrapper
 from xml.sax.saxutils import escape
 
 gnatmakeproc = None
 
+CACHE_FILE = "switches_cache.json"
+# The file, in the GPS home directory, in which the output of the tools
+# "-h" switch is cached across sessions. It is indexed by the command
+# line, and the values are dicts with "signature" (see
+# xml_registry.signature) and "output" keys.
+
+_help_cache = None
+
 
 def EnsureInitialized():
     global gnatmakeproc
@@ -114,6 +126,25 @@ def Style(switch, defaulttip, defaultstate, before=False):
                  defaultstate, before)
 
 
+def _load_help_cache():
+    global _help_cache
+    if _help_cache is None:
+        try:
+            with open(os.path.join(GPS.get_home_dir(), CACHE_FILE)) as f:
+                _help_cache = json.load(f)
+        except (IOError, ValueError):
+            _help_cache = {}
+    return _help_cache
+
+
+def _save_help_cache():
+    try:
+        with open(os.path.join(GPS.get_home_dir(), CACHE_FILE), "w") as f:
+            json.dump(_help_cache, f, separators=(",", ":"))
+    except IOError:
+        pass
+
+
 class gnatMakeProc:
 
     """This class controls the gnatmake execution"""
@@ -123,12 +154,23 @@ class gnatMakeProc:
         self.validity_checks_list = []
         self.style_checks_list = []
         self.gnatCmd = ""
+        self.args = ""
+
+        self.parsed = {}
+        # The switches parsed during this session, indexed by command line.
+        # The values are tuples (warnings, validity checks, style checks).
+
+        self.xml_warnings_list = None
+        # The warnings list used to generate the switches editor
 
     def init_switches(self):
-        # ensure_switches returns true if the gnat command is not identical to
-        # the previous one. In this case, we need to recreate the whole xml
-        # tree and call GPS.parse_xml to update the switch editor.
-        if self.ensure_switches():
+        # The lists are only replaced when the switches of another command
+        # are needed, or when the output of the command has changed. In this
+        # case, we need to recreate the whole xml tree and call
+        # GPS.parse_xml to update the switch editor.
+        if (self.ensure_switches() is not None and
+                self.warnings_list is not self.xml_warnings_list):
+            self.xml_warnings_list = self.warnings_list
             try:
                 xmlCompiler = self.__get_xml()
             except Exception:
@@ -181,7 +223,8 @@ class gnatMakeProc:
                 self.gnatCmd = cmd
 
         # gnat check command changed: we reinitialize the rules list
-        if prev_cmd != self.gnatCmd:
+        if prev_cmd != self.gnatCmd or args != self.args:
+            self.args = args
             self.__get_switches_from_help(self.gnatCmd, args)
             return True
         else:
@@ -283,127 +326,125 @@ class gnatMakeProc:
         xmlCompiler = xmlCompilerHead + xml + xmlCompilerTrailer
         return xmlCompiler
 
-    def __add_switch_callback(self, process, matched, unmatched):
-        if unmatched.startswith("\n"):
-            line = self.msg
-            self.msg = ""
-            if re.search("^ +[-]gnatwxx", line):
-                self.warnings_analysis = True
-            elif re.search("^ +[-]gnatVxx", line):
-                self.validity_checks_analysis = True
-            elif re.search("^ +[-]gnatyxx", line):
-                self.style_checks_analysis = True
-            elif re.search("^ +[-]gnat", line):
-                self.warnings_analysis = False
-                self.validity_checks_analysis = False
-            elif self.style_checks_analysis and re.search("^ *[-]", line):
-                self.style_checks_analysis = False
-
-            elif self.warnings_analysis:
-                res = re.split("^ *([^ *+]+)([*]?)([+]?) +(.+) *$", line)
-                i_sw = 1
-                i_star = 2
-                i_plus = 3
-                i_desc = 4
-                if len(res) > 2:
-                    if res[i_sw] == "a":
-                        # retrieve the list of warnings not activated by
-                        # -gnatwa Note that this is not used anymore with
-                        # recent GNAT version: the all_warnings_exception_list
-                        # is now determined by '+' sign after the switch
-                        # definition
-                        exception = re.split(
-                            "\(except ([a-zA-Z. ]*)\) *$", res[i_desc])
-                        if len(exception) > 1:
-                            self.all_warnings_exception_list = re.findall(
-                                "[.]?[a-zA-Z]", exception[1] + ".e")
-                        self.warnings_list.append(
-                            Warning(res[i_sw], res[i_desc], False, True))
-
-                    elif res[i_sw] in ("e", ".e", "s"):
-                        # include the global switches directly.
-                        self.warnings_list.append(
-                            Warning(res[i_sw], res[i_desc], False, True))
-
-                    # include only on warnings, and a limited list of global
-                    # warnings (gnatwa, gnatws, gnatw.e)
-                    elif (
-                        not re.search("turn off", res[i_desc]) and not
-                            re.search("(all|every)", res[i_desc]) and not
-                            re.search("^normal warning", res[i_desc])
-                    ):
-                        # two ways to determine if the switch is part of gnatwa
-                        # or not: the old way used the gnatwa exception list,
-                        # that was part of the -gnatwa description, while we
-                        # now use with recent gnat versions the '+' sign after
-                        # the switch description
-                        if len(self.all_warnings_exception_list) == 0:
-                            is_alias_part = res[i_plus] == "+"
-                        else:
+    def __parse_line(self, line):
+        if re.search("^ +[-]gnatwxx", line):
+            self.warnings_analysis = True
+        elif re.search("^ +[-]gnatVxx", line):
+            self.validity_checks_analysis = True
+        elif re.search("^ +[-]gnatyxx", line):
+            self.style_checks_analysis = True
+        elif re.search("^ +[-]gnat", line):
+            self.warnings_analysis = False
+            self.validity_checks_analysis = False
+        elif self.style_checks_analysis and re.search("^ *[-]", line):
+            self.style_checks_analysis = False
+
+        elif self.warnings_analysis:
+            res = re.split("^ *([^ *+]+)([*]?)([+]?) +(.+) *$", line)
+            i_sw = 1
+            i_star = 2
+            i_plus = 3
+            i_desc = 4
+            if len(res) > 2:
+                if res[i_sw] == "a":
+                    # retrieve the list of warnings not activated by
+                    # -gnatwa Note that this is not used anymore with
+                    # recent GNAT version: the all_warnings_exception_list
+                    # is now determined by '+' sign after the switch
+                    # definition
+                    exception = re.split(
+                        "\(except ([a-zA-Z. ]*)\) *$", res[i_desc])
+                    if len(exception) > 1:
+                        self.all_warnings_exception_list = re.findall(
+                            "[.]?[a-zA-Z]", exception[1] + ".e")
+                    self.warnings_list.append(
+                        Warning(res[i_sw], res[i_desc], False, True))
+
+                elif res[i_sw] in ("e", ".e", "s"):
+                    # include the global switches directly.
+                    self.warnings_list.append(
+                        Warning(res[i_sw], res[i_desc], False, True))
+
+                # include only on warnings, and a limited list of global
+                # warnings (gnatwa, gnatws, gnatw.e)
+                elif (
+                    not re.search("turn off", res[i_desc]) and not
+                        re.search("(all|every)", res[i_desc]) and not
+                        re.search("^normal warning", res[i_desc])
+                ):
+                    # two ways to determine if the switch is part of gnatwa
+                    # or not: the old way used the gnatwa exception list,
+                    # that was part of the -gnatwa description, while we
+                    # now use with recent gnat versions the '+' sign after
+                    # the switch description
+                    if len(self.all_warnings_exception_list) == 0:
+                        is_alias_part = res[i_plus] == "+"
+                    else:
+                        is_alias_part = False
+                        # switches activated by default are not part of
+                        # gnatwa
+                        if res[i_star] == "*":
                             is_alias_part = False
-                            # switches activated by default are not part of
-                            # gnatwa
-                            if res[i_star] == "*":
-                                is_alias_part = False
-                            else:
-                                if re.search("turn on", res[i_desc]):
-                                    # part of gnatwa, unless explicitely part
-                                    # of the gnatwa exception list search if
-                                    # warning is not part of gnatwa
-                                    is_alias_part = True
-                                    for ex in self.all_warnings_exception_list:
-                                        if ex == res[i_sw]:
-                                            is_alias_part = False
-                                            break
-
-                        # warnings_list is a list of [switch, description,
-                        # default value, part_of_gnatwa] remove the 'turn on'
-                        # in the description
-                        warn = Warning(
-                            res[i_sw], res[i_desc], res[i_star] == "*")
-                        if is_alias_part:
-                            warn.Add_Default_Val_Dependency("-gnatwa", True)
-                        warn.Add_Default_Val_Dependency("-gnatw.e", True)
-                        warn.Add_Default_Val_Dependency("-gnatws", False)
-                        self.warnings_list.append(warn)
-
-            elif self.validity_checks_analysis:
-                res = re.split("^ *([^ *]+) +(.+) *$", line)
-                if len(res) > 2:
-                    if res[1] == "a" or res[1] == "n":
-                        self.validity_checks_list.append(
-                            Validity(res[1], res[2], False, True))
-                    elif res[1].lower() == res[1]:
-                        val = Validity(res[1], res[2], res[1] == "d")
-                        if res[1] != "d":
-                            val.Add_Default_Val_Dependency("-gnatVa", True)
-                        val.Add_Default_Val_Dependency("-gnatVn", False)
-                        self.validity_checks_list.append(val)
-
-            elif self.style_checks_analysis:
-                res = re.split("^ *(1[-]9|.)(n*) +(.+) *$", line)
-                if len(res) > 2:
-                    if res[1] == "1-9":
-                        self.style_checks_list.append(StyleSpin(
-                            switch="", defaulttip=res[3], defaultval=0,
-                            minval=0, maxval=9, before=True))
-
-                    # no parameters. Do not include -gnatyN (remove all checks)
-                    # and -gnatym (alias of -gnatyM79)
-                    elif res[1] != "N" and res[1] != "m":
-                        if res[2] == "":
-                            self.style_checks_list.append(
-                                Style(switch=res[1], defaulttip=res[3],
-                                      defaultstate=False))
                         else:
-                            self.style_checks_list.append(StyleSpin(
-                                switch=res[1], defaulttip=res[3],
-                                defaultval=0, minval=0, maxval=32768))
-
-        self.msg += matched
+                            if re.search("turn on", res[i_desc]):
+                                # part of gnatwa, unless explicitely part
+                                # of the gnatwa exception list search if
+                                # warning is not part of gnatwa
+                                is_alias_part = True
+                                for ex in self.all_warnings_exception_list:
+                                    if ex == res[i_sw]:
+                                        is_alias_part = False
+                                        break
+
+                    # warnings_list is a list of [switch, description,
+                    # default value, part_of_gnatwa] remove the 'turn on'
+                    # in the description
+                    warn = Warning(
+                        res[i_sw], res[i_desc], res[i_star] == "*")
+                    if is_alias_part:
+                        warn.Add_Default_Val_Dependency("-gnatwa", True)
+                    warn.Add_Default_Val_Dependency("-gnatw.e", True)
+                    warn.Add_Default_Val_Dependency("-gnatws", False)
+                    self.warnings_list.append(warn)
+
+        elif self.validity_checks_analysis:
+            res = re.split("^ *([^ *]+) +(.+) *$", line)
+            if len(res) > 2:
+                if res[1] == "a" or res[1] == "n":
+                    self.validity_checks_list.append(
+                        Validity(res[1], res[2], False, True))
+                elif res[1].lower() == res[1]:
+                    val = Validity(res[1], res[2], res[1] == "d")
+                    if res[1] != "d":
+                        val.Add_Default_Val_Dependency("-gnatVa", True)
+                    val.Add_Default_Val_Dependency("-gnatVn", False)
+                    self.validity_checks_list.append(val)
+
+        elif self.style_checks_analysis:
+            res = re.split("^ *(1[-]9|.)(n*) +(.+) *$", line)
+            if len(res) > 2:
+                if res[1] == "1-9":
+                    self.style_checks_list.append(StyleSpin(
+                        switch="", defaulttip=res[3], defaultval=0,
+                        minval=0, maxval=9, before=True))
+
+                # no parameters. Do not include -gnatyN (remove all checks)
+                # and -gnatym (alias of -gnatyM79)
+                elif res[1] != "N" and res[1] != "m":
+                    if res[2] == "":
+                        self.style_checks_list.append(
+                            Style(switch=res[1], defaulttip=res[3],
+                                  defaultstate=False))
+                    else:
+                        self.style_checks_list.append(StyleSpin(
+                            switch=res[1], defaulttip=res[3],
+                            defaultval=0, minval=0, maxval=32768))
 
-    def __get_switches_from_help(self, gnatCmd, args):
-        # Verify we have the correct gnatcheck executable
+    def __parse_help(self, output):
+        """
+        Parse the output of "gnatmake -h", and return a tuple (warnings,
+        validity checks, style checks).
+        """
         self.warnings_list = []
         self.validity_checks_list = []
         self.style_checks_list = []
@@ -412,23 +453,89 @@ class gnatMakeProc:
         self.validity_checks_analysis = False
         self.style_checks_analysis = False
 
-        if gnatCmd != "":
-            # Then retrieve warnings/style/restriction checks from gnatmake
-            self.msg = ""
-            # ??? We don't spawn this process on the build server as this leads
-            # to undesired results: this spawn command becomes asynchronous
-            # because of the rsync commands that are enqueued. Thus the result
-            # of the gnatmake -h analysis arrives after the switches dialog is
-            # created, leading to empty boxes.
-            # The behavior is then to try getting a valid gnat make command
-            # from the local machine, and fallback to the default switches if
-            # not found.
-            process = GPS.Process(
-                "\"\"\"" + gnatCmd + "\"\"\" " + args,
-                "^.+\r?$",
-                on_match=self.__add_switch_callback,
-                remote_server="Build_Server")
-            process.get_result()
+        # As when the output was parsed while the process was running,
+        # the last line is ignored.
+        lines = [line for line in output.split("\n") if line]
+        for line in lines[:-1]:
+            self.__parse_line(line)
+
+        return (self.warnings_list, self.validity_checks_list,
+                self.style_checks_list)
+
+    def __run_help(self, gnatCmd, args):
+        """Run gnatCmd synchronously, and return its output"""
+        # ??? We don't spawn this process on the build server as this leads
+        # to undesired results: this spawn command becomes asynchronous
+        # because of the rsync commands that are enqueued. Thus the result
+        # of the gnatmake -h analysis arrives after the switches dialog is
+        # created, leading to empty boxes.
+        # The behavior is then to try getting a valid gnat make command
+        # from the local machine, and fallback to the default switches if
+        # not found.
+        process = GPS.Process(
+            "\"\"\"" + gnatCmd + "\"\"\" " + args,
+            remote_server="Build_Server")
+        return process.get_result()
+
+    @workflows.run_as_workflow
+    def __refresh_help(self, gnatCmd, args, sig):
+        """
+        Run gnatCmd in the background, and update the cache and the
+        switches if its output has changed.
+        """
+        key = gnatCmd + " " + args
+        process = ProcessWrapper([gnatCmd] + args.split(), block_exit=False)
+        status, output = yield process.wait_until_terminate()
+
+        cache = _load_help_cache()
+        if status != 0 or output == cache.get(key, {}).get("output"):
+            cache[key] = dict(cache.get(key, {}), signature=sig)
+        else:
+            cache[key] = {"signature": sig, "output": output}
+            current = (self.warnings_list, self.validity_checks_list,
+                       self.style_checks_list)
+            self.parsed[key] = self.__parse_help(output)
+            if (gnatCmd, args) != (self.gnatCmd, self.args):
+                # Restore the lists of the current command
+                (self.warnings_list, self.validity_checks_list,
+                 self.style_checks_list) = current
+        _save_help_cache()
+
+    def __get_switches_from_help(self, gnatCmd, args):
+        """
+        Set the lists of switches for gnatCmd. The output of the command is
+        cached across sessions: it is only run again, in the background, if
+        the executable has changed since it was cached.
+        """
+        key = gnatCmd + " " + args
+        parsed = self.parsed.get(key)
+
+        if parsed is None and gnatCmd != "":
+            cache = _load_help_cache()
+            entry = cache.get(key)
+            local = GPS.is_server_local("Build_Server")
+            sig = signature([gnatCmd]) if local else None
+
+            if entry is None or entry.get("output") is None:
+                # Then retrieve warnings/style/restriction checks from
+                # gnatmake
+                output = self.__run_help(gnatCmd, args)
+                if local:
+                    cache[key] = {"signature": sig, "output": output}
+                    _save_help_cache()
+            else:
+                output = entry["output"]
+                if local and entry["signature"] != sig:
+                    # Use the previous output until the new one is known
+                    self.__refresh_help(gnatCmd, args, sig)
+
+            parsed = self.parsed[key] = self.__parse_help(output)
+
+        if parsed is None:
+            parsed = ([], [], [])
+
+        (self.warnings_list, self.validity_checks_list,
+         self.style_checks_list) = parsed
         return True
 
 # Constant definitions: those are switches that we define for all versions of
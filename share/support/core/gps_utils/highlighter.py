@@ -4,6 +4,7 @@ files.
 """
 
 import GPS
+import bisect
 import time
 import traceback
 
@@ -172,6 +173,127 @@ class OverlayStyle(object):
             buffer.remove_overlay(over, start, end)
 
 
+def visible_lines(buffer):
+    """
+    Return the range of lines (first, last) visible in the current view of
+    buffer, or None if it cannot be computed.
+
+    :param GPS.EditorBuffer buffer: the buffer
+    """
+    if not gobject_available:
+        return None
+
+    try:
+        from gi.repository import Gtk
+        from pygps import get_widgets_by_type
+
+        view = buffer.current_view()
+        if view is None:
+            return None
+
+        text_view = get_widgets_by_type(Gtk.TextView, view.pywidget())[0]
+        rect = text_view.get_visible_rect()
+        first = text_view.get_line_at_y(rect.y)[0].get_line()
+        last = text_view.get_line_at_y(rect.y + rect.height)[0].get_line()
+        return (first + 1, last + 1)
+    except Exception:
+        return None
+
+
+class _Highlight_Scheduler(object):
+
+    """
+    Process the batches of all the active Background_Highlighter instances
+    from a single background source. Each time the source is run, the
+    highlighters are run in turn until the time budget is exhausted.
+    """
+
+    def __init__(self):
+        self.__source_id = None  # The gtk source_id or GPS.Timeout instance
+        self.__highlighters = []
+        self.__running = False
+
+    def add(self, highlighter):
+        """
+        Schedule a highlighter, which will be run until it has nothing left
+        to highlight.
+        """
+        if highlighter not in self.__highlighters:
+            self.__highlighters.append(highlighter)
+
+        if self.__source_id is None:
+            if gobject_available:
+                self.__source_id = GLib.idle_add(self.__run)
+            else:
+                self.__source_id = GPS.Timeout(
+                    Background_Highlighter.timeout_ms, self.__run)
+
+    def remove(self, highlighter):
+        """
+        Unschedule a highlighter.
+        """
+        if highlighter in self.__highlighters:
+            self.__highlighters.remove(highlighter)
+
+        if not self.__highlighters and not self.__running:
+            self.__remove_source()
+
+    def terminate(self):
+        """
+        Called when GPS is about to exit: the source will be killed anyway.
+        """
+        self.__source_id = None
+        self.__highlighters = []
+
+    def __remove_source(self):
+        if self.__source_id is not None:
+            if gobject_available:
+                GLib.source_remove(self.__source_id)
+            else:
+                self.__source_id.remove()
+            self.__source_id = None
+
+    def __run(self, *args, **kwargs):
+        """
+        Run one batch of each highlighter in turn, until the time budget
+        is exhausted or there is nothing left to do.
+        """
+        self.__running = True
+        try:
+            budget = Background_Highlighter.time_budget_ms / 1000.0
+            deadline = time.time() + budget
+
+            while self.__highlighters:
+                for h in list(self.__highlighters):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+
+                    # Share the remaining time between the highlighters that
+                    # have not run yet in this round.
+                    time_slice = remaining / len(self.__highlighters)
+                    if not h._highlight_batch(time_slice):
+                        self.remove(h)
+
+                if time.time() >= deadline:
+                    break
+        finally:
+            self.__running = False
+
+        if self.__highlighters:
+            return True
+
+        if gobject_available:
+            # Returning False removes the idle callback
+            self.__source_id = None
+        else:
+            self.__remove_source()
+        return False
+
+
+_scheduler = _Highlight_Scheduler()
+
+
 class Background_Highlighter(object):
 
     """
@@ -189,23 +311,38 @@ class Background_Highlighter(object):
         e.start_highlight(buffer1)   # start highlighting a first buffer
         e.start_highlight(buffer2)   # start highlighting a second buffer
 
+    All the highlighters share a single background source. The number of
+    lines processed at each iteration is adapted to the time it took to
+    process the previous ones, so that the total time spent in each
+    iteration stays within time_budget_ms.
+
     :param OverlayStyle style: style to use for highlighting.
     """
-    # Interval in milliseconds between two batches.
+    # Interval in milliseconds between two iterations.
     # This is only used when gobject is not available
     timeout_ms = 40
 
-    # Number of lines to process at each iteration
+    # Maximum time in milliseconds spent highlighting in each iteration,
+    # shared between all highlighters.
+    time_budget_ms = 20
+
+    # Number of lines to process in the first batch, before the time needed
+    # to process a line is known.
     batch_size = 20
 
+    # Bounds for the number of lines processed in a single batch
+    min_batch_size = 1
+    max_batch_size = 2000
+
     # If True, highlighting is always done in the
     # foreground. This is for testsuite purposes
     synchronous = False
 
     def __init__(self, style, initial_timeout=None):
-        self.__source_id = None  # The gtk source_id used for background
-        # or the GPS.Timeout instance
+        self.__source_id = None  # The gtk source_id for the initial timeout
+        self.__scheduled = False  # Whether registered with the scheduler
         self.__buffers = []      # The list of buffers to highlight
+        self.__line_cost = None  # Average time (s) to process one line
         self.terminated = False
         self.highlighted = 0
         self.highlighted_limit = 0
@@ -235,6 +372,8 @@ class Background_Highlighter(object):
         """
         self.terminated = True
         self.__source_id = None  # Don't try to kill the idle, GPS is quitting
+        _scheduler.terminate()
+        self.__scheduled = False
         self.stop_highlight()
         return True
 
@@ -257,10 +396,11 @@ class Background_Highlighter(object):
            when other buffers are finished.
 
         :param integer line:
-           The line the highlighting should start from. By default, this
-           is the current line in the editor, so that the user sees
-           changes immediately. But you could chose to start from the
-           top of the file instead.
+           The line the highlighting should start from. By default, the
+           lines visible in the editor are highlighted first (or the
+           lines around the cursor if they cannot be computed), so that
+           the user sees changes immediately. But you could chose to start
+           from the top of the file instead.
 
         :param integer context:
            Number of lines before and after 'line' that should be
@@ -275,51 +415,58 @@ class Background_Highlighter(object):
             # closing of that file.
             return
 
-        if buffer is not None and line is None:
+        # Is the buffer already in the list ?
+        for b in self.__buffers:
+            if b[0] == buffer:
+                return
+
+        visible = None
+        if line is None:
+            if context is None:
+                visible = visible_lines(buffer)
             view = buffer.current_view()
             line = view.cursor().line() if view is not None else 1
 
-        if buffer is not None:
-            # Is the buffer already in the list ?
-            for b in self.__buffers:
-                if b[0] == buffer:
-                    return
-
-            end_line = buffer.lines_count()
-            if context is not None:
-                start_line = max(0, line - context)
-                end_line = min(end_line, line + context)
-            else:
-                start_line = 0
+        end_line = buffer.lines_count()
+        if context is not None:
+            start_line = max(0, line - context)
+            end_line = min(end_line, line + context)
+        else:
+            start_line = 0
+
+        if visible is not None:
+            # Process the visible lines forward first, then extend the
+            # highlighted range in both directions.
+            first = max(start_line, min(visible[0], end_line))
+            state = (buffer, first - 1, first, start_line, end_line,
+                     False, 0, min(visible[1], end_line - 1))
+        else:
+            state = (buffer, line, line + 1, start_line, end_line,
+                     True, 0, 0)
 
-            # push at the back, so that we do not change the current buffer,
-            # in case the user has computed data for it (see
-            # Location_Highlighter)
-            self.__buffers.append(
-                (buffer, line, line + 1, start_line, end_line, True, 0))
+        # push at the back, so that we do not change the current buffer,
+        # in case the user has computed data for it (see
+        # Location_Highlighter)
+        self.__buffers.append(state)
 
-            if self.style and self.style.use_messages():
-                self.style.remove(buffer)
+        if self.style and self.style.use_messages():
+            self.style.remove(buffer)
 
-            if self.synchronous:
-                self.on_start_buffer(buffer)
-                while self.__do_highlight():
-                    pass
+        if self.synchronous:
+            self.on_start_buffer(buffer)
+            while self.__do_highlight():
+                pass
 
-            elif self.__source_id is None:
-                if gobject_available:
-                    if self.initial_timeout:
-                        self.__source_id = GLib.timeout_add(
-                            self.initial_timeout,
-                            self.__initial_do_highlight)
-                    else:
-                        self.__source_id = GLib.idle_add(
-                            self.__do_highlight)
-                else:
-                    self.__source_id = GPS.Timeout(
-                        self.timeout_ms, self.__do_highlight)
+        elif self.__source_id is None and not self.__scheduled:
+            if gobject_available and self.initial_timeout:
+                self.__source_id = GLib.timeout_add(
+                    self.initial_timeout,
+                    self.__initial_do_highlight)
+            else:
+                self.__scheduled = True
+                _scheduler.add(self)
 
-                self.on_start_buffer(buffer)
+            self.on_start_buffer(buffer)
 
     def __on_file_closed(self, hook, file):
         for b in self.__buffers:
@@ -359,12 +506,14 @@ class Background_Highlighter(object):
                     self.__buffers.remove(b)
                     return
 
-        elif self.__source_id:
-            if gobject_available:
+        else:
+            if self.__source_id:
                 GLib.source_remove(self.__source_id)
-            else:
-                self.__source_id.remove()
-            self.__source_id = None
+                self.__source_id = None
+
+            if self.__scheduled:
+                self.__scheduled = False
+                _scheduler.remove(self)
 
             self.__buffers = []
 
@@ -394,14 +543,62 @@ class Background_Highlighter(object):
         """
         We waited the initial timeout, thus start the highlighter
         """
-        GLib.source_remove(self.__source_id)
-        self.__source_id = GLib.idle_add(self.__do_highlight)
+        self.__source_id = None
+        if self.__buffers and not self.terminated:
+            self.__scheduled = True
+            _scheduler.add(self)
         return False
 
-    def __do_highlight(self, *args, **kwargs):
+    def __process_lines(self, buffer, from_line, to_line):
         """
-        The function called at regular intervals, and that computes
-        the range of lines to highlight.
+        Highlight the lines from_line .. to_line of buffer, and update the
+        average time needed to process one line.
+        """
+        start = time.time()
+        f = buffer.at(from_line, 1)
+
+        # Do not process if the line is folded
+        if from_line > 1 and f.offset() == 0:
+            return
+
+        e = buffer.at(to_line, 1).end_of_line()
+        if self.style:
+            self.style.remove(f, e)
+        self.process(f, e)
+
+        cost = (time.time() - start) / (to_line - from_line + 1)
+        if self.__line_cost is None:
+            self.__line_cost = cost
+        else:
+            self.__line_cost = (self.__line_cost + cost) / 2
+
+    def __next_batch_size(self, time_slice):
+        """
+        The number of lines that can be processed in time_slice seconds.
+        """
+        if time_slice is None or not self.__line_cost:
+            return self.batch_size
+
+        return max(self.min_batch_size,
+                   min(self.max_batch_size,
+                       int(time_slice / self.__line_cost)))
+
+    def _highlight_batch(self, time_slice):
+        """
+        Process one batch of lines, taking about time_slice seconds.
+        Return False when there is nothing left to highlight. This is
+        called by the scheduler.
+        """
+        if self.__do_highlight(time_slice):
+            return True
+
+        self.__scheduled = False
+        return False
+
+    def __do_highlight(self, time_slice=None):
+        """
+        Process one batch of lines, and computes the range of lines to
+        highlight in the next one.
         """
         if self.terminated:
             return False
@@ -413,22 +610,18 @@ class Background_Highlighter(object):
         try:
             (buffer, min_line, max_line,
              start_line, end_line, backward,
-             self.highlighted) = self.__buffers[0]
+             self.highlighted, visible_end) = self.__buffers[0]
 
+            batch_size = self.__next_batch_size(time_slice)
             changed = False
 
-            if min_line >= start_line and (backward or max_line >= end_line):
-                from_line = max(start_line, min_line - self.batch_size)
-
-                f = buffer.at(from_line, 1)
+            # Lines up to visible_end are processed before going backward
+            forward_first = max_line <= visible_end and max_line < end_line
 
-                # Do not process if the line is folded
-                if not (from_line > 1 and f.offset() == 0):
-                    e = buffer.at(min_line, 1).end_of_line()
-                    if self.style:
-                        self.style.remove(f, e)
-
-                    self.process(f, e)
+            if (min_line >= start_line and not forward_first and
+                    (backward or max_line >= end_line)):
+                from_line = max(start_line, min_line - batch_size)
+                self.__process_lines(buffer, from_line, min_line)
 
                 min_line = from_line - 1
                 if max_line < end_line:
@@ -436,20 +629,14 @@ class Background_Highlighter(object):
                 changed = True
 
             elif max_line < end_line:
-                to_line = min(end_line - 1, max_line + self.batch_size)
+                to_line = min(end_line - 1, max_line + batch_size)
+                if forward_first:
+                    to_line = min(to_line, visible_end)
 
                 # It is possible that the buffer has been changed so that one
                 # of the locations is now invalid, so we just protect.
                 try:
-                    f = buffer.at(max_line, 1)
-
-                    # Do not process if the line is folded
-                    if not (max_line > 1 and f.offset() == 0):
-                        e = buffer.at(to_line, 1).end_of_line()
-
-                        if self.style:
-                            self.style.remove(f, e)
-                        self.process(f, e)
+                    self.__process_lines(buffer, max_line, to_line)
 
                     max_line = to_line + 1
                     if min_line >= start_line:
@@ -462,7 +649,7 @@ class Background_Highlighter(object):
                             self.highlighted < self.highlighted_limit):
                 self.__buffers[0] = (
                     buffer, min_line, max_line, start_line, end_line,
-                    backward, self.highlighted)
+                    backward, self.highlighted, visible_end)
             else:
                 self.__buffers.pop(0)
                 if self.__buffers:
@@ -561,6 +748,89 @@ class On_The_Fly_Highlighter(Background_Highlighter):
             self.start_highlight(buffer, context=self.context_lines)
 
 
+class Sorted_References(object):
+    """
+    The references to highlight in a buffer, sorted by location so that the
+    ones within a range of the buffer are found with a binary search.
+    """
+
+    def __init__(self):
+        self.__keys = []  # sorted list of (line, column, name)
+        self.__refs = []  # the GPS.FileLocation for each key
+
+    def __len__(self):
+        return len(self.__keys)
+
+    @staticmethod
+    def __key(name, ref):
+        return (ref.line(), ref.column(), name)
+
+    def add(self, name, ref):
+        """
+        Add a reference, unless it is already known.
+
+        :param str name: the name of the entity
+        :param GPS.FileLocation ref: the location of the reference
+        """
+        key = self.__key(name, ref)
+        index = bisect.bisect_left(self.__keys, key)
+        if index == len(self.__keys) or self.__keys[index] != key:
+            self.__keys.insert(index, key)
+            self.__refs.insert(index, ref)
+
+    def remove(self, name, ref):
+        """
+        Remove a reference, if it is known.
+
+        :param str name: the name of the entity
+        :param GPS.FileLocation ref: the location of the reference
+        """
+        self.__remove_key(self.__key(name, ref))
+
+    def __remove_key(self, key):
+        index = bisect.bisect_left(self.__keys, key)
+        if index < len(self.__keys) and self.__keys[index] == key:
+            del self.__keys[index]
+            del self.__refs[index]
+
+    def set_references(self, refs):
+        """
+        Replace all the references. When few references changed, they are
+        inserted or removed individually, otherwise the list is sorted
+        again.
+
+        :param refs: a list of (name, GPS.FileLocation)
+        """
+        new = {}
+        for name, ref in refs:
+            new[self.__key(name, ref)] = ref
+
+        old = set(self.__keys)
+        removed = [k for k in self.__keys if k not in new]
+        added = [k for k in new if k not in old]
+
+        if (len(removed) + len(added)) * 4 > len(new):
+            self.__keys = sorted(new)
+            self.__refs = [new[k] for k in self.__keys]
+        else:
+            for key in removed:
+                self.__remove_key(key)
+            for key in added:
+                index = bisect.bisect_left(self.__keys, key)
+                self.__keys.insert(index, key)
+                self.__refs.insert(index, new[key])
+
+    def in_range(self, start_line, start_column, end_line, end_column):
+        """
+        Return the references between the two locations (inclusive), as a
+        list of (name, GPS.FileLocation) sorted by location.
+        """
+        low = bisect.bisect_left(self.__keys, (start_line, start_column))
+        high = bisect.bisect_left(self.__keys, (end_line, end_column + 1))
+        return [(self.__keys[index][2], self.__refs[index])
+                for index in range(low, high)]
+
+
 class Location_Highlighter(Background_Highlighter):
     """
     An abstract class that can be used to implement highlighter related to
@@ -582,8 +852,17 @@ class Location_Highlighter(Background_Highlighter):
 
     def __init__(self, style, context=2, initial_timeout=None):
         Background_Highlighter.__init__(self, style, initial_timeout)
-        self._refs = []  # list of (entity, ref) in the current buffer
+        self._refs = Sorted_References()  # references in the current buffer
+        self.__refs_by_file = {}  # Sorted_References, indexed by file path
         self.context = context
+        GPS.Hook("file_closed").add(self.__on_file_closed)
+
+    def __del__(self):
+        Background_Highlighter.__del__(self)
+        GPS.Hook("file_closed").remove(self.__on_file_closed)
+
+    def __on_file_closed(self, hook, file):
+        self.__refs_by_file.pop(file.path, None)
 
     def recompute_refs(self, buffer):
         """
@@ -598,58 +877,71 @@ class Location_Highlighter(Background_Highlighter):
         """
         return []
 
+    def set_references(self, buffer, refs):
+        """
+        Set the references to highlight in buffer. Only the references that
+        differ from the ones previously set for this buffer are inserted or
+        removed.
+
+        :param GPS.EditorBuffer buffer: the buffer
+        :param refs: a list of (name, GPS.FileLocation), as returned by
+            recompute_refs
+        """
+        sorted_refs = self.__refs_by_file.get(buffer.file().path)
+        if sorted_refs is None:
+            sorted_refs = self.__refs_by_file[buffer.file().path] = \
+                Sorted_References()
+        sorted_refs.set_references(refs)
+        return sorted_refs
+
     def on_start_buffer(self, buffer):  # overriding
-        # ??? Should use a more efficient data structure where we can
-        # easily find the references within a given range.
-        self._refs = self.recompute_refs(buffer=buffer)
+        self._refs = self.set_references(
+            buffer, self.recompute_refs(buffer=buffer))
 
     def process(self, start, end):  # overriding
         ed = start.buffer()
 
-        s = GPS.FileLocation(ed.file(), start.line(), start.column())
-        e = GPS.FileLocation(ed.file(), end.line(), end.column())
-
-        for entity_name, ref in self._refs:
-            if s <= ref <= e:
-                u = entity_name.decode("utf-8").lower()
-                s2 = ed.at(ref.line(), ref.column())
-
-                try:
-                    e2 = s2 + (len(u) - 1)
-                except Exception:
-                    # An invalid location ?
-                    continue
-
-                b = ed.get_chars(s2, e2).decode("utf-8").lower()
-                if b == u:
-                    self.highlighted += 1
-                    self.style.apply(s2, e2)
-
-                elif self.context > 0:
-                    for c in range(1, self.context + 1):
-                        # Search after original xref line (same column)
-                        try:
-                            s2 = GPS.EditorLocation(
-                                ed, ref.line() + c, ref.column())
-                            e2 = s2 + (len(u) - 1)
-                            b = ed.get_chars(s2, e2).decode("utf-8").lower()
-                            if b == u:
-                                self.highlighted += 1
-                                self.style.apply(s2, e2)
-                                break
-
-                            # Search before original xref line
-                            s2 = GPS.EditorLocation(
-                                ed, ref.line() - c, ref.column())
-                            e2 = s2 + (len(u) - 1)
-                            b = ed.get_chars(s2, e2).decode("utf-8").lower()
-                            if b == u:
-                                self.highlighted += 1
-                                self.style.apply(s2, e2)
-                                break
-                        except Exception:
-                            # An invalid location ?
-                            continue
+        for entity_name, ref in self._refs.in_range(
+                start.line(), start.column(), end.line(), end.column()):
+            u = entity_name.decode("utf-8").lower()
+            s2 = ed.at(ref.line(), ref.column())
+
+            try:
+                e2 = s2 + (len(u) - 1)
+            except Exception:
+                # An invalid location ?
+                continue
+
+            b = ed.get_chars(s2, e2).decode("utf-8").lower()
+            if b == u:
+                self.highlighted += 1
+                self.style.apply(s2, e2)
+
+            elif self.context > 0:
+                for c in range(1, self.context + 1):
+                    # Search after original xref line (same column)
+                    try:
+                        s2 = GPS.EditorLocation(
+                            ed, ref.line() + c, ref.column())
+                        e2 = s2 + (len(u) - 1)
+                        b = ed.get_chars(s2, e2).decode("utf-8").lower()
+                        if b == u:
+                            self.highlighted += 1
+                            self.style.apply(s2, e2)
+                            break
+
+                        # Search before original xref line
+                        s2 = GPS.EditorLocation(
+                            ed, ref.line() - c, ref.column())
+                        e2 = s2 + (len(u) - 1)
+                        b = ed.get_chars(s2, e2).decode("utf-8").lower()
+                        if b == u:
+                            self.highlighted += 1
+                            self.style.apply(s2, e2)
+                            break
+                    except Exception:
+                        # An invalid location ?
+                        continue
 
 
 class Regexp_Highlighter(On_The_Fly_Highlighter):
@@ -0,0 +1,189 @@
+"""
+This package measures the time spent in the Python callbacks connected to
+the GPS hooks through gps_utils.hook or the methods of modules.Module.
+
+Profiling is disabled by default. It is enabled with the action
+"toggle hooks profiling", or when GPS is started with the environment
+variable GPS_PROFILE_HOOKS set to a threshold in milliseconds, for
+instance::
+
+    GPS_PROFILE_HOOKS=50 gps -P project.gpr
+
+While profiling is enabled, the number of calls and the cumulative and
+maximum durations are recorded for each (hook, callback) pair. The first
+time a callback exceeds the threshold, and each time it gets slower, a
+line is written in the Messages view. The action "show hooks profile"
+displays the callbacks sorted by cumulative duration, and dumps all the
+measures in hooks_profile.csv, in the GPS home directory.
+
+The duration of a callback includes the duration of the hooks it runs
+itself.
+"""
+
+import GPS
+import os
+import time
+
+THRESHOLD = 0.05
+# The duration, in seconds, above which a callback is reported
+
+REPORT_FILE = "hooks_profile.csv"
+# The file, in the GPS home directory, in which the report is dumped
+
+enabled = False
+# Whether the callbacks are currently profiled
+
+_stats = {}
+# The measures, indexed by (hook name, callback name). The values are
+# lists [count, total, max].
+
+
+def callback_name(fn):
+    """
+    Return a name that identifies fn in the reports, including the name of
+    the plugin that defines it.
+    """
+    cls = getattr(fn, "im_class", None)
+    if cls is not None:
+        return "%s.%s.%s" % (cls.__module__, cls.__name__, fn.__name__)
+    return "%s.%s" % (getattr(fn, "__module__", None) or "?",
+                      getattr(fn, "__name__", repr(fn)))
+
+
+def profiled(hook_name, fn, wrapper):
+    """
+    Return a function that calls wrapper, and records its duration for
+    fn on the hook hook_name when profiling is enabled.
+
+    :param str hook_name: the name of the hook
+    :param fn: the callback provided by the plugin, used for the reports
+    :param wrapper: the function actually connected to the hook
+    """
+    key = (hook_name, callback_name(fn))
+
+    def profiled_wrapper(*args, **kwargs):
+        if not enabled:
+            return wrapper(*args, **kwargs)
+
+        start = time.time()
+        try:
+            return wrapper(*args, **kwargs)
+        finally:
+            _record(key, time.time() - start)
+
+    profiled_wrapper.__name__ = getattr(wrapper, "__name__", "hook")
+    profiled_wrapper.__doc__ = getattr(wrapper, "__doc__", None)
+    return profiled_wrapper
+
+
+def _record(key, elapsed):
+    stats = _stats.get(key)
+    if stats is None:
+        stats = _stats[key] = [0, 0.0, 0.0]
+
+    stats[0] += 1
+    stats[1] += elapsed
+    if elapsed > stats[2]:
+        if elapsed > THRESHOLD:
+            GPS.Console("Messages").write(
+                "slow hook callback: %s on %s took %.1f ms\n"
+                % (key[1], key[0], elapsed * 1000))
+        stats[2] = elapsed
+
+
+def start(threshold=None):
+    """
+    Enable profiling, and reset the measures.
+
+    :param float threshold: if specified, the new value for THRESHOLD
+    """
+    global enabled, THRESHOLD
+    if threshold is not None:
+        THRESHOLD = threshold
+    _stats.clear()
+    enabled = True
+
+
+def stop():
+    """Disable profiling. The measures are kept."""
+    global enabled
+    enabled = False
+
+
+def report(sort_by="total"):
+    """
+    Return the measures, as a list of (hook, callback, count, total, max,
+    mean) tuples sorted by decreasing value of sort_by.
+
+    :param str sort_by: one of "count", "total", "max" or "mean"
+    """
+    rows = [(hook, name, s[0], s[1], s[2], s[1] / s[0])
+            for (hook, name), s in _stats.iteritems()]
+    index = {"count": 2, "total": 3, "max": 4, "mean": 5}[sort_by]
+    rows.sort(key=lambda r: r[index], reverse=True)
+    return rows
+
+
+def dump(filename=None, sort_by="total"):
+    """
+    Write the report in CSV format, and return the name of the file.
+
+    :param str filename: defaults to REPORT_FILE in the GPS home directory
+    :param str sort_by: see report
+    """
+    filename = filename or os.path.join(GPS.get_home_dir(), REPORT_FILE)
+    with open(filename, "w") as f:
+        f.write("hook,callback,count,total_ms,max_ms,mean_ms\n")
+        for hook, name, count, total, max_time, mean in report(sort_by):
+            f.write("%s,%s,%d,%.3f,%.3f,%.3f\n"
+                    % (hook, name, count,
+                       total * 1000, max_time * 1000, mean * 1000))
+    return filename
+
+
+def show_report(count=20):
+    """
+    Display the most expensive callbacks in the Messages view, and dump
+    the full report.
+    """
+    console = GPS.Console("Messages")
+    console.write("%-20s %-50s %8s %10s %10s\n"
+                  % ("hook", "callback", "calls", "total ms", "max ms"))
+    for hook, name, calls, total, max_time, _ in report()[:count]:
+        console.write("%-20s %-50s %8d %10.1f %10.1f\n"
+                      % (hook, name, calls, total * 1000, max_time * 1000))
+    console.write("Full report in %s\n" % dump())
+
+
+def toggle():
+    """Start or stop profiling the hooks callbacks"""
+    if enabled:
+        stop()
+        show_report()
+    else:
+        start()
+        GPS.Console("Messages").write(
+            "Profiling the hooks callbacks, threshold %.1f ms\n"
+            % (THRESHOLD * 1000))
+
+
+def _on_gps_started(hook):
+    from gps_utils import make_interactive
+
+    make_interactive(
+        toggle, category="Debug", name="toggle hooks profiling",
+        description="Start or stop profiling the Python callbacks" +
+        " connected to the hooks")
+    make_interactive(
+        show_report, category="Debug", name="show hooks profile",
+        description="Display the Python callbacks connected to the hooks" +
+        " that took the most time since profiling was started")
+
+
+if os.environ.get("GPS_PROFILE_HOOKS"):
+    try:
+        start(float(os.environ["GPS_PROFILE_HOOKS"]) / 1000)
+    except ValueError:
+        start()
+
+GPS.Hook("gps_started").add(_on_gps_started)
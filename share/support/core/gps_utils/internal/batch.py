@@ -0,0 +1,166 @@
+"""
+Run several tests in the same GPS instance, to avoid paying the startup
+cost of GPS for each of them. This is used by the batch driver of the
+testsuite (testsuite/drivers/batch.py), which loads this module with
+--load and communicates with it through the standard input and output:
+
+- the driver writes one request per line on the standard input of GPS,
+  as a JSON object {"id": <int>, "dir": <the test directory>}
+
+- the output of each test is surrounded by lines containing BEGIN and END
+  on the TESTSUITE trace, which the testsuite sends to the standard
+  error. The END line also contains the status of the test, as it would
+  be returned by GPS when running the test in its own process.
+
+Before each test, the state of GPS is reset: the debuggers, the editors
+and the views opened since the start of GPS are closed, the messages are
+removed, the preferences set through GPS.Preference.set are restored, and
+the project of the test (or a default project) is loaded.
+
+Other changes are not undone, in particular the hooks added by a test and
+the preferences modified in the preferences dialog: such tests must add
+    batch: false
+to their test.yaml.
+
+If a test exits GPS or makes it crash, the driver reruns it in a fresh
+GPS process, and starts a new instance for the next tests.
+"""
+
+import GPS
+import glob
+import imp
+import json
+import os
+import traceback
+from gi.repository import GLib
+from gps_utils.internal import asserts, driver, utils
+
+READY = "@@batch ready@@"
+BEGIN = "@@batch begin {}@@"
+END = "@@batch end {} {}@@"
+# The markers written on the TESTSUITE trace
+
+DEFAULT_PROJECT = "project Default is\nend Default;\n"
+
+_modified_preferences = []
+# The preferences set since the last reset, with their previous value, as
+# a list of (GPS.Preference, value)
+
+_original_set = GPS.Preference.set
+
+
+def _recording_set(self, value, save=True):
+    """Replaces GPS.Preference.set, to record the modified preferences"""
+    _modified_preferences.append((self, self.get()))
+    _original_set(self, value, save)
+
+
+def restore_preferences():
+    """Restore the preferences set since the last call"""
+    while _modified_preferences:
+        pref, value = _modified_preferences.pop()
+        _original_set(pref, value)
+
+
+class Batch_Runner(object):
+
+    def __init__(self):
+        self.requests = []    # The requests not processed yet
+        self.current = None   # The id of the test being run
+        self.pending = ""     # The input received but not processed yet
+        self.logger = GPS.Logger("TESTSUITE")
+
+        channel = GLib.IOChannel.unix_new(0)
+        GLib.io_add_watch(
+            channel, GLib.PRIORITY_DEFAULT,
+            GLib.IOCondition.IN | GLib.IOCondition.HUP, self._on_input)
+
+        # The views present at startup, which are kept between tests
+        self.views = set(c.name() for c in GPS.MDI.children())
+        GPS.Preference.set = _recording_set
+
+        driver.batch_runner = self
+        self.logger.log(READY)
+
+    def _on_input(self, channel, condition):
+        data = os.read(0, 65536)
+        if not data:
+            # The driver has closed our input: exit
+            GPS.exit(force=True)
+            return False
+
+        lines = (self.pending + data).split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                self.requests.append(json.loads(line))
+
+        self._run_next()
+        return True
+
+    def _run_next(self):
+        if self.current is None and self.requests:
+            request = self.requests.pop(0)
+            self.current = request["id"]
+            self.logger.log(BEGIN.format(self.current))
+            self._run(request["dir"])
+
+    def _reset(self, directory):
+        """Reset the state of GPS before running the test in directory"""
+        for debugger in GPS.Debugger.list():
+            debugger.close()
+
+        for buffer in GPS.EditorBuffer.list():
+            buffer.close(force=True)
+
+        for child in GPS.MDI.children():
+            if child.name() not in self.views:
+                child.close(force=True)
+
+        restore_preferences()
+
+        for message in GPS.Message.list():
+            message.remove()
+
+        GPS.Console("Messages").clear()
+
+        asserts.exit_status = asserts.SUCCESS
+        utils.exit_status = asserts.SUCCESS
+
+        GPS.cd(directory)
+
+        # GPS loads the project in the current directory when there is
+        # only one, and a default project otherwise.
+        projects = glob.glob(os.path.join(directory, "*.gpr"))
+        if len(projects) != 1:
+            default = os.path.join(GPS.get_home_dir(), "default.gpr")
+            with open(default, "w") as f:
+                f.write(DEFAULT_PROJECT)
+            projects = [default]
+        GPS.Project.load(projects[0], force=True)
+
+    def _run(self, directory):
+        try:
+            self._reset(directory)
+            imp.load_source("test_{}".format(self.current),
+                            os.path.join(directory, "test.py"))
+        except Exception:
+            self.logger.log("Batch runner received an exception\n%s"
+                            % traceback.format_exc())
+            self.test_done(asserts.FAILURE)
+
+    def test_done(self, status):
+        """Called at the end of each test"""
+        if self.current is not None:
+            self.logger.log(END.format(self.current, status))
+            self.current = None
+
+        # Wait for the end of the test workflow before running the next one
+        GLib.idle_add(self._run_next)
+
+
+def on_gps_started(hook):
+    Batch_Runner()
+
+
+GPS.Hook("gps_started").add(on_gps_started)
@@ -13,6 +13,11 @@ from gps_utils.internal.asserts import SUCCESS, FAILURE, NOT_RUN, XFAIL
 # Some of the imports here are necessary for some of the tests
 from workflows.promises import hook, timeout, wait_tasks, wait_idle
 
+batch_runner = None
+# When several tests are run in the same GPS instance (see batch.py), the
+# object that runs them. Its test_done(status) method is called at the end
+# of each test, instead of exiting GPS.
+
 
 def do_exit(timeout):
     """ Force an exit of GPS right now, logging as an error the contents
@@ -53,7 +58,8 @@ def run_test_driver(action_fn):
     """
 
     def workflow():
-        _ = yield hook("gps_started")
+        if batch_runner is None:
+            _ = yield hook("gps_started")
         yield timeout(10)
 
         last_result = None
@@ -72,20 +78,26 @@ def run_test_driver(action_fn):
                    traceback.format_exc()))
 
         finally:
-            if "GPS_PREVENT_EXIT" not in os.environ:
-                if last_result in (SUCCESS, FAILURE, NOT_RUN, XFAIL):
-                    status = last_result
-                else:
-                    status = 0
+            if last_result in (SUCCESS, FAILURE, NOT_RUN, XFAIL):
+                status = last_result
+            else:
+                status = 0
+
+            if batch_runner is not None:
+                batch_runner.test_done(status)
+            elif "GPS_PREVENT_EXIT" not in os.environ:
                 GPS.exit(force=True, status=status)
 
     # Install a timeout to catch the errors in GPS, if any, before rlimit
-    # kills everything.
+    # kills everything. In batch mode, the testsuite driver handles the
+    # timeouts itself.
 
     # Exit GPS 10 seconds before the rlimit expires. If the rlimit
     # is not set, default to waiting 130 seconds.
-    timeout_seconds = int(os.environ.get('GPS_RLIMIT_SECONDS', '130')) - 10
-    GPS.Timeout(timeout_seconds * 1000, do_exit)
+    if batch_runner is None:
+        timeout_seconds = int(
+            os.environ.get('GPS_RLIMIT_SECONDS', '130')) - 10
+        GPS.Timeout(timeout_seconds * 1000, do_exit)
 
     # Run the workflow
 
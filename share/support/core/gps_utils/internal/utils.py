@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import GPS
 import inspect
+import json
 import os
 import imp
 import sys
@@ -251,6 +252,43 @@ def record_time(t):
     f.close()
 
 
+def record_metric(name, value):
+    """ Record a named measure in the metrics.out file, for use by the
+        benchmark driver of the testsuite. Each call adds one line to the
+        file, as a JSON object {"name": name, "value": value}.
+        By convention, times are given in seconds and memory sizes in
+        kilobytes.
+    """
+
+    with open('metrics.out', 'a') as f:
+        f.write(json.dumps({"name": name, "value": value}) + "\n")
+
+
+def peak_memory():
+    """ Return the peak memory used by GPS so far, in kilobytes, or None
+        if this is not available on this platform.
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if system_is_osx:
+        # ru_maxrss is in bytes on OSX
+        peak /= 1024
+    return peak
+
+
+def record_peak_memory():
+    """ Record the peak memory used by GPS, see record_metric. """
+
+    peak = peak_memory()
+    if peak is not None:
+        record_metric("peak_memory", peak)
+
+
 def recompute_xref():
     """ Force an Xref recomputation immediately. """
 
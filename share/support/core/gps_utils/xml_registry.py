@@ -0,0 +1,212 @@
+"""
+This package lets plugins register their XML customizations, instead of
+calling GPS.parse_xml directly.
+
+The fragments registered while GPS is starting are merged into a single
+document, which is parsed by a single call to GPS.parse_xml at the end of
+each startup phase: when the project is about to be loaded, and when GPS
+has started. Once GPS has started, fragments are parsed immediately.
+Plugins that need their customizations to be available right away can
+register them with defer=False, or call flush(). This is the case of the
+plugins loaded with GPS, whose customizations must be parsed before the
+user's custom files and plugins, so that the latter can override them.
+
+A fragment that is not well formed is parsed on its own, so that it does
+not prevent the other fragments from being loaded.
+
+Fragments that are expensive to compute (for instance because they embed
+the output of a tool) can be registered with register_generated: their
+value is cached across sessions, and is only computed again when one of
+the files it depends on has changed. Example of use::
+
+    from gps_utils import xml_registry
+
+    xml_registry.register(XML)
+    xml_registry.register_generated(
+        "gnatprove", lambda: XML_TEMPLATE.format(help=get_help()),
+        depends_on=[__file__, gnatprove])
+"""
+
+import GPS
+import json
+import os
+import re
+import traceback
+from xml.parsers import expat
+
+CACHE_FILE = "xml_cache.json"
+# The file, in the GPS home directory, in which generated fragments are
+# cached
+
+_root_re = re.compile(
+    r'^\s*(?:<\?xml[^>]*\?>\s*)?<(GPS|CUSTOM)\s*>(.*)</\1>\s*$', re.S)
+# Matches a full document, to extract its contents when merging
+
+_pending = []
+# The fragments registered in the current phase
+
+_started = False
+# Whether GPS has started: fragments are no longer deferred
+
+_cache = None
+# The generated fragments, indexed by name. The values are dicts with
+# "signature" and "xml" keys.
+
+_cache_modified = False
+
+
+def _cache_file():
+    return os.path.join(GPS.get_home_dir(), CACHE_FILE)
+
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        try:
+            with open(_cache_file()) as f:
+                _cache = json.load(f)
+        except (IOError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _save_cache():
+    global _cache_modified
+    if _cache_modified:
+        try:
+            with open(_cache_file(), "w") as f:
+                json.dump(_cache, f, separators=(",", ":"))
+        except IOError:
+            pass
+        _cache_modified = False
+
+
+def signature(files):
+    """
+    Return a value that changes whenever one of the files is modified.
+
+    :param files: a list of file names. Names of files that do not exist
+       are accepted.
+    """
+    result = []
+    for f in files:
+        try:
+            st = os.stat(f)
+            result.append([f, st.st_size, st.st_mtime])
+        except (OSError, TypeError):
+            result.append([f, None, None])
+    return result
+
+
+def _is_well_formed(contents):
+    """Whether the contents of a <GPS> node are well formed XML"""
+    try:
+        expat.ParserCreate().Parse(
+            "<?xml version='1.0' ?><GPS>%s</GPS>" % contents, True)
+        return True
+    except expat.ExpatError:
+        return False
+
+
+def _parse(xml):
+    """Parse xml, reporting errors without interrupting the caller"""
+    try:
+        GPS.parse_xml(xml)
+    except Exception:
+        GPS.Console("Messages").write(
+            "Error while parsing a customization:\n%s"
+            % traceback.format_exc())
+
+
+def flush():
+    """
+    Parse all the fragments registered so far. The fragments are merged
+    into as few documents as possible, preserving their order.
+    """
+    global _pending
+
+    fragments, _pending = _pending, []
+    merged = []    # (contents, original fragment)
+
+    def parse_merged():
+        if len(merged) == 1:
+            _parse(merged[0][1])
+        elif merged:
+            try:
+                GPS.parse_xml("<?xml version='1.0' ?><GPS>%s</GPS>"
+                              % "".join(c for c, _ in merged))
+            except Exception:
+                # Find the faulty fragments, without losing the others
+                for _, xml in merged:
+                    _parse(xml)
+        del merged[:]
+
+    for xml in fragments:
+        m = _root_re.match(xml)
+        contents = m.group(2) if m else xml
+        if (m or not xml.lstrip().startswith("<?xml")) and \
+                _is_well_formed(contents):
+            merged.append((contents, xml))
+        else:
+            # A document with another root node, or which is not well
+            # formed: parse it on its own
+            parse_merged()
+            _parse(xml)
+
+    parse_merged()
+    _save_cache()
+
+
+def register(xml, defer=True):
+    """
+    Register an XML customization string, as accepted by GPS.parse_xml.
+
+    :param str xml: the customization string
+    :param bool defer: if False, xml, as well as all the fragments
+       registered before it, are parsed immediately
+    """
+    _pending.append(xml)
+    if _started or not defer:
+        flush()
+
+
+def register_generated(name, generator, depends_on, defer=True):
+    """
+    Register the XML customization string returned by generator. The
+    string is cached, and generator is only called if one of the files in
+    depends_on has changed since the last time it was called.
+
+    :param str name: a name that identifies the fragment in the cache
+    :param generator: a function with no parameter that returns the string
+    :param depends_on: a list of file names
+    :param bool defer: see register
+    """
+    global _cache_modified
+
+    cache = _load_cache()
+    sig = signature(depends_on)
+    entry = cache.get(name)
+    if entry is not None and entry["signature"] == sig:
+        xml = entry["xml"].encode("utf-8")
+    else:
+        xml = generator()
+        cache[name] = {"signature": sig,
+                       "xml": xml.decode("utf-8")
+                       if isinstance(xml, str) else xml}
+        _cache_modified = True
+
+    register(xml, defer=defer)
+
+
+def _on_project_changing(hook, file):
+    flush()
+
+
+def _on_gps_started(hook):
+    global _started
+    _started = True
+    flush()
+
+
+GPS.Hook("project_changing").add(_on_project_changing, last=False)
+GPS.Hook("gps_started").add(_on_gps_started, last=False)
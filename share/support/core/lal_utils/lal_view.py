@@ -14,6 +14,7 @@ COL_START_LINE = 2
 COL_START_COLUMN = 3
 COL_END_LINE = 4
 COL_END_COLUMN = 5
+COL_NODE = 6
 
 
 class LAL_View_Widget():
@@ -24,18 +25,21 @@ class LAL_View_Widget():
 
         self.compact_mode = True
         # The view has a compact mode (the default) and a full tree mode.
-        # In full tree mode, the whole tree is displayed and refreshed when
-        # the buffer is modified. In compact mode, The tree is refreshed
-        # everytime the cursor location changes, and only shows the current
-        # tree path.
+        # In full tree mode, the whole tree is expanded. In compact mode,
+        # only the current tree path is expanded. In both modes, the rows
+        # are only created when their parent is expanded, and the tree is
+        # only rebuilt when the buffer is modified.
 
         # A label to push diagnostics messages and token info
         self.message_label = Gtk.Label()
         self.message_label.set_halign(Gtk.Align.START)
         self.message_label.set_ellipsize(Pango.EllipsizeMode.END)
 
-        # The model: see COL_* constants above
-        self.store = Gtk.TreeStore(str, Gdk.RGBA, int, int, int, int)
+        # The model: see COL_* constants above. COL_NODE is the index of
+        # the node in self.nodes, or -1 for the placeholder rows added below
+        # the rows that have not been expanded yet.
+        self.store = Gtk.TreeStore(str, Gdk.RGBA, int, int, int, int, int)
+        self.nodes = []
 
         # Initialize the tree view
         self.view = Gtk.TreeView(self.store)
@@ -46,6 +50,7 @@ class LAL_View_Widget():
         self.node_col.add_attribute(cell, "foreground-rgba", COL_FOREGROUND)
         self.view.append_column(self.node_col)
         self.view.connect("button_press_event", self._on_view_button_press)
+        self.view.connect("test-expand-row", self._on_test_expand_row)
 
         full_mode_toggle = Gtk.CheckButton("full tree (slow)")
         full_mode_toggle.connect("toggled", self._full_mode_toggled)
@@ -91,7 +96,8 @@ class LAL_View_Widget():
     def _full_mode_toggled(self, b):
         """React to the toggle of the full mode button"""
         self.compact_mode = not b.get_active()
-        self.refresh()
+        if not self.compact_mode:
+            self.view.expand_all()
         b = GPS.EditorBuffer.get(open=False)
         if b:
             cursor = b.current_view().cursor()
@@ -158,74 +164,71 @@ class LAL_View_Widget():
         if prev != (self.default_fg, self.highlight_fg):
             self.show_current_location(self.line, self.column)
 
-    def _add_node(self, parent, node):
-        """Add a node as child of parent. parent can be None"""
-        if not node:
-            return
+    def _on_test_expand_row(self, view, it, path):
+        """Create the children of a row before it is expanded"""
+        self._populate(it)
+        return False
 
+    def _add_node(self, parent, node):
+        """Add a row for node as child of parent. parent can be None.
+           The rows for the children of node are only created when the
+           row is expanded: until then, a placeholder row is added below
+           it so that it can be expanded.
+        """
         start_line = node.sloc_range.start.line
         start_column = node.sloc_range.start.column
         end_line = node.sloc_range.end.line
         end_column = node.sloc_range.end.column
 
-        if not self.compact_mode or (
-            (start_line, start_column) <=
-                (self.line, self.column) <=
-                (end_line, end_column)):
-
-            it = self.store.append(parent)
-            text = "<b>{}</b>{}".format(
-                # Uncomment this for a representation useful for debug:
-                # GLib.markup_escape_text(repr(node)),
-                node.kind_name,
-                " {}".format(GLib.markup_escape_text(node.text))
-                if start_line == end_line else "")
-
-            self.store[it] = [
-                text,
-                self.default_fg,
-                start_line,
-                start_column,
-                end_line,
-                end_column,
-            ]
-
-            for n in node.children:
+        text = "<b>{}</b>{}".format(
+            # Uncomment this for a representation useful for debug:
+            # GLib.markup_escape_text(repr(node)),
+            node.kind_name,
+            " {}".format(GLib.markup_escape_text(node.text))
+            if start_line == end_line else "")
+
+        it = self.store.append(parent, [
+            text,
+            self.default_fg,
+            start_line,
+            start_column,
+            end_line,
+            end_column,
+            len(self.nodes),
+        ])
+        self.nodes.append(node)
+
+        if any(n for n in node.children):
+            self.store.append(it, ["", self.default_fg, 0, 0, 0, 0, -1])
+
+    def _populate(self, it):
+        """Create the rows for the children of the node at iter it, if
+           this was not done yet.
+        """
+        placeholder = self.store.iter_children(it)
+        if placeholder is None or self.store[placeholder][COL_NODE] != -1:
+            return
+
+        for n in self.nodes[self.store[it][COL_NODE]].children:
+            if n:
                 self._add_node(it, n)
 
-    def _traverse_and_highlight(self, it, line, column):
-        """Traverse the subtree starting at iter it, and highlight the
-           nodes that encompass the location at line/column.
+        # Remove the placeholder last, so that the row is never left
+        # without children, which would collapse it.
+        self.store.remove(placeholder)
 
-           Return the deepest iter found that matches.
+    def _find_child(self, it, node):
+        """Return the child of iter it (or the top-level row if it is None)
+           that corresponds to node, creating the rows as needed.
         """
-        lowest_found = None
+        if it:
+            self._populate(it)
         child = self.store.iter_children(it)
         while child:
-            row = self.store[child]
-
-            if row[COL_START_LINE] > line:
-                # We are past the point where the nodes will match the
-                # location: we can stop traversing.
-                return lowest_found
-
-            if ((row[COL_START_LINE], row[COL_START_COLUMN]) <=
-                (line, column) <=
-                    (row[COL_END_LINE], row[COL_END_COLUMN])):
-
-                # This node encompasses the location: highlight it...
-                lowest_found = child
-                self.highlighted_iters.append(child)
-                row[COL_FOREGROUND] = self.highlight_fg
-
-                # ... and look below it for more
-                below = self._traverse_and_highlight(child, line, column)
-                if below:
-                    lowest_found = below
-
+            if self.nodes[self.store[child][COL_NODE]] == node:
+                return child
             child = self.store.iter_next(child)
-
-        return lowest_found
+        return None
 
     def show_current_location(self, line, column):
         """Highlight the given location in the tree and scroll to it"""
@@ -236,23 +239,39 @@ class LAL_View_Widget():
         self.line = line
         self.column = column
 
-        if self.compact_mode:
-            self.store.clear()
-            self._add_node(None, self.unit.root)
-            self.view.expand_all()
-        else:
-            # Clear all previous highlighting
-            for j in self.highlighted_iters:
-                self.store[j][COL_FOREGROUND] = self.default_fg
-            self.highlighted_iters = []
+        # Clear all previous highlighting
+        for j in self.highlighted_iters:
+            self.store[j][COL_FOREGROUND] = self.default_fg
+        self.highlighted_iters = []
 
-            lowest_found = self._traverse_and_highlight(None, line, column)
+        # Compute the path from the root to the node under the cursor, and
+        # highlight the corresponding rows: only the rows along this path
+        # need to be created.
+        nodes = []
+        node = self.unit.root.lookup(libadalang.Sloc(line, column))
+        while node:
+            nodes.append(node)
+            node = node.parent
+
+        lowest_found = None
+        for node in reversed(nodes):
+            child = self._find_child(lowest_found, node)
+            if not child:
+                break
+            lowest_found = child
+            self.highlighted_iters.append(child)
+            self.store[child][COL_FOREGROUND] = self.highlight_fg
+
+        if self.compact_mode:
+            self.view.collapse_all()
 
-            # If we have finished iterating, scroll to the lowest found
-            if lowest_found:
-                self.view.scroll_to_cell(
-                    self.store.get_path(lowest_found),
-                    self.node_col, True, 0.5, 0.5)
+        if lowest_found:
+            path = self.store.get_path(lowest_found)
+            parent = self.store.iter_parent(lowest_found)
+            if parent:
+                self.view.expand_to_path(self.store.get_path(parent))
+            self.view.get_selection().select_path(path)
+            self.view.scroll_to_cell(path, self.node_col, True, 0.5, 0.5)
 
         # Display the current token in the label
         self.token = self.unit.lookup_token(libadalang.Sloc(line, column))
@@ -264,44 +283,47 @@ class LAL_View_Widget():
         else:
             self.message_label.set_text("")
 
-    def refresh(self):
-        """Refresh the contents of the view"""
+    def refresh(self, force=False):
+        """Refresh the contents of the view.
+           The tree is only rebuilt if the current file has changed, or if
+           force is True.
+        """
         buf = GPS.EditorBuffer.get(open=False)
 
         if not buf:
             return
 
+        if not force and buf.file() == self.file:
+            return
+
         self.view.set_model(None)
         self.store.clear()
+        self.nodes = []
         self.highlighted_iters = []
+        self.unit = None
 
         self.file = buf.file()
         if not self.file.language().lower() == "ada":
             return
 
-        self.store.clear()
         unit = buf.get_analysis_unit()
 
         if unit.diagnostics:
             self.message_label.set_text(
                 "\n".join([str(d) for d in unit.diagnostics]))
-            self.unit = None
             return
         else:
             self.unit = unit
             self.message_label.set_text("{} loaded ok".format(
                 os.path.basename(buf.file().name())))
 
-        if self.compact_mode:
-            # In compact mode, the view is regenerated when we change
-            # locations
-            pass
-        else:
-            # In full mode, display the whole tree now
+        if unit.root:
             self._add_node(None, unit.root)
 
         self.view.set_model(self.store)
-        self.view.expand_all()
+        if not self.compact_mode:
+            # This creates all the rows
+            self.view.expand_all()
 
 
 class LAL_View(Module):
@@ -334,8 +356,8 @@ class LAL_View(Module):
             self.widget.show_current_location(line, column)
 
     def buffer_edited(self, file):
-        if self.widget:
-            self.widget.refresh()
+        if self.widget and file == self.widget.file:
+            self.widget.refresh(force=True)
 
     def on_view_destroy(self):
         self.widget = None
@@ -10,7 +10,7 @@ languages.
 """
 
 
-import GPS
+from gps_utils import xml_registry
 
 XML = r"""<?xml version="1.0" ?>
 <GPS>
@@ -274,4 +274,4 @@ XML = r"""<?xml version="1.0" ?>
 </GPS>
 """
 
-GPS.parse_xml(XML)
+xml_registry.register(XML, defer=False)
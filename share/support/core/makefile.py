@@ -44,6 +44,10 @@ A similar behavior is applied for build.xml files for ant, where the
 
 When you select one of the new menus, GPS will run ant or make, and parse
 error messages to display them in the locations window as usual.
+
+The targets are cached, along with the timestamps of the build file and
+of the Makefiles it includes. When one of them changes, the cached
+targets are still used while the files are read again in the background.
 """
 
 
@@ -53,6 +57,24 @@ import os
 import os_utils
 from GPS import Logger, Hook, parse_xml, Project
 from gps_utils import hook
+from workflows import task_workflow
+
+LINES_PER_STEP = 2000
+# How many lines of a Makefile are read before giving control back to GPS,
+# when reading it in the background
+
+BYTES_PER_STEP = 65536
+# How many bytes of an Ant file are parsed before giving control back to
+# GPS, when reading it in the background
+
+
+def file_mtime(filename):
+    """Return the timestamp of filename, or None if it doesn't exist"""
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return None
+
 
 # This is an XML model for make/gnumake
 Make_Model = """
@@ -156,11 +178,47 @@ class Builder:
         Logger("MAKE").log(
             "Build file for %s is %s" % (self.pkg_name, self.buildfile))
 
+    def scan(self, buildfile):
+        """
+        A generator which reads the targets of buildfile, and stores them
+        in self.cache. It yields from time to time, so that it can be run
+        in the background.
+        """
+        return iter(())
+
     def read_targets(self):
         """Read all targets from the build file, and return a list targets"""
-        return None
+        entry = self.cache.get(self.buildfile)
+        if entry is None:
+            # No target known yet: read them now
+            for _ in self.scan(self.buildfile):
+                pass
+            entry = self.cache[self.buildfile]
+
+        elif (self.buildfile not in self.scanning and
+              any(file_mtime(f) != mtime for f, mtime in entry[0])):
+            # The files have changed: use the old targets until they have
+            # been read again
+            self.scanning.add(self.buildfile)
+            task_workflow(
+                "reading %s targets" % self.pkg_name,
+                lambda task, buildfile=self.buildfile:
+                    self.__scan_in_background(buildfile))
+
+        return entry[1]
+
+    def __scan_in_background(self, buildfile):
+        try:
+            for _ in self.scan(buildfile):
+                yield
+        finally:
+            self.scanning.discard(buildfile)
 
     def compute_build_targets(self, name):
+        if name == self.pkg_name:
+            self.compute_buildfile()
+            if self.buildfile:
+                return self.read_targets()
         return None
 
     def on_compute_build_targets(self, hook, name):
@@ -174,6 +232,15 @@ class Builder:
 
     def __init__(self):
         self.targets = []
+
+        self.cache = {}
+        # For each build file, a tuple (signature, targets). The signature
+        # is the list of (file, timestamp) for the files read to compute
+        # the targets.
+
+        self.scanning = set()
+        # The build files being read in the background
+
         Hook("compute_build_targets").add(self.on_compute_build_targets)
 
 
@@ -200,61 +267,61 @@ class Makefile (Builder):
         # make at least.
         self.target_matcher = re.compile(targets + "::?" + deps + comments)
 
-        self.include_matcher = re.compile("^include (?P<file>.*)$")
-
-        self.current_dir = None
-        # The directory of the toplevel makefile. All include statements
-        # are resolved relative to that directory
+        # GNU make also accepts "-include" and "sinclude", which do not
+        # complain about missing files, and several files per directive.
+        self.include_matcher = re.compile(
+            "^(?:-|s)?include\\s+(?P<files>.*)$")
 
         Builder.__init__(self)
 
-    def __read_targets(self, filename):
+    def scan(self, buildfile):
         """
-        Return a set of all targets for a given Makefile
+        Read the targets from buildfile and the Makefiles it includes
         """
-        if not self.current_dir:
-            self.current_dir = os.path.join(
-                os.getcwd(), os.path.dirname(filename))
-        else:
-            filename = os.path.join(self.current_dir, filename)
-
+        # Include statements are resolved relative to the directory of the
+        # toplevel Makefile
+        current_dir = os.path.dirname(os.path.abspath(buildfile))
+        to_read = [os.path.abspath(buildfile)]
+        seen = set()
+        signature = []
         targets = set()
-        try:
-            f = file(filename)
-        except IOError:
-            # Can't read the file
-            return targets
-        for line in f:
-            matches = self.target_matcher.match(line)
-            if matches:
-                if matches.group('comments'):
-                    if matches.group('comments').strip() != "IGNORE":
-                        target_name = matches.group('targets')
-                        targets.add((target_name, target_name, ''))
-                else:
-                    # Handle multiple targets on same line
-                    for target in matches.group('targets').split():
-                        targets.add((target, target, ''))
-
-            else:
-                matches = self.include_matcher.match(line)
-                if matches:
-                    # filenames are relative to the directory of the
-                    # current Makefile
-                    targets.update(
-                        self.__read_targets(matches.group('file')))
-
-        f.close()
-        return targets
-
-    def compute_build_targets(self, name):
-        if name == "make":
-            self.compute_buildfile()
-            if self.buildfile:
-                return sorted(self.__read_targets(self.buildfile))
-        return None
 
-ant_targets = []
+        while to_read:
+            filename = os.path.normpath(
+                os.path.join(current_dir, to_read.pop(0)))
+            if filename in seen:
+                continue
+            seen.add(filename)
+            signature.append((filename, file_mtime(filename)))
+
+            try:
+                f = open(filename)
+            except IOError:
+                # Can't read the file
+                continue
+
+            with f:
+                for count, line in enumerate(f, 1):
+                    matches = self.target_matcher.match(line)
+                    if matches:
+                        if matches.group('comments'):
+                            if matches.group('comments').strip() != "IGNORE":
+                                target_name = matches.group('targets')
+                                targets.add((target_name, target_name, ''))
+                        else:
+                            # Handle multiple targets on same line
+                            for target in matches.group('targets').split():
+                                targets.add((target, target, ''))
+
+                    else:
+                        matches = self.include_matcher.match(line)
+                        if matches:
+                            to_read.extend(matches.group('files').split())
+
+                    if count % LINES_PER_STEP == 0:
+                        yield
+
+        self.cache[buildfile] = (signature, sorted(targets))
 
 
 class Antfile (Builder):
@@ -265,14 +332,12 @@ class Antfile (Builder):
         self.default_build_files = ["build.xml"]
         Builder.__init__(self)
 
-    def read_targets(self):
-        global ant_targets
-        ant_targets = []
+    def scan(self, buildfile):
+        targets = []
 
         class MySaxDocumentHandler (handler.ContentHandler):
 
             def startElement(self, name, attrs):
-                global ant_targets
                 if name == "target":
                     target = None
                     description = ''
@@ -281,24 +346,22 @@ class Antfile (Builder):
                             target = attrs.get(attrName)
                         if attrName == "description":
                             description = attrs.get(attrName)
-                    ant_targets += [(str(target), description, '')]
+                    targets.append((str(target), description, ''))
 
+        signature = [(buildfile, file_mtime(buildfile))]
         parser = make_parser()
         parser.setContentHandler(MySaxDocumentHandler())
-        inFile = open(self.buildfile, 'r')
-
-        parser.parse(inFile)
-
-        inFile.close()
 
-        return ant_targets
+        with open(buildfile, 'r') as inFile:
+            while True:
+                data = inFile.read(BYTES_PER_STEP)
+                if not data:
+                    break
+                parser.feed(data)
+                yield
+        parser.close()
 
-    def compute_build_targets(self, name):
-        if name == "ant":
-            self.compute_buildfile()
-            if self.buildfile:
-                return self.read_targets()
-        return None
+        self.cache[buildfile] = (signature, targets)
 
 ant_support = False
 
@@ -52,6 +52,7 @@ underscore) as a parameter to :func:`GPS.Browsers.View.create`.
 import GPS
 import traceback
 import sys
+from gps_utils import hook_profiler
 
 try:
     # While building the doc, we might not have access to this module
@@ -269,6 +270,7 @@ class Module(object):
                         return pref(hook, *args, **kwargs)
                 else:
                     return pref(*args, **kwargs)
+            internal = hook_profiler.profiled(hook_name, pref, internal)
             setattr(self, "__%s" % hook_name, internal)
             p = getattr(self, "__%s" % hook_name)
             if hook_name == "context_changed":
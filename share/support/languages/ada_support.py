@@ -11,7 +11,7 @@ editing of Ada files.
 
 import GPS
 import gps_utils.gnat_rules
-from gps_utils import hook
+from gps_utils import hook, xml_registry
 
 
 @hook('project_editor')
@@ -204,7 +204,7 @@ end;</text>
 </GPS>
 """
 
-GPS.parse_xml(XML)
+xml_registry.register(XML, defer=False)
 
 
 def __add_to_main_units(project, file):
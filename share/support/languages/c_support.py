@@ -16,7 +16,7 @@ not defined in this file.
 ###########################################################################
 
 import GPS
-from gps_utils import hook
+from gps_utils import hook, xml_registry
 
 XML = r"""<?xml version="1.0" ?>
 <GPS>
@@ -226,7 +226,7 @@ XML = r"""<?xml version="1.0" ?>
 </GPS>
 """
 
-GPS.parse_xml(XML)
+xml_registry.register(XML, defer=False)
 
 
 @hook('gps_started')
@@ -6,6 +6,7 @@ GPS.Libclang API.
 """
 
 import GPS
+import time
 from gi.repository import GLib
 from modules import Module
 import colorschemes
@@ -21,6 +22,8 @@ show_diags_pref.create(
     0, EDITOR_LOCATIONS, EDITOR, DISABLED
 )
 
+CATEGORY = "Clang live diagnostics"
+
 ####################
 # Main clang class #
 ####################
@@ -28,8 +31,21 @@ show_diags_pref.create(
 
 class Clang(object):
 
+    max_refresh_time = 0.02
+    # Maximum time, in seconds, spent creating or removing messages in one
+    # idle callback. The remaining work is done in the next callbacks.
+
     def __init__(self):
-        self.messages = []
+        self.messages = {}
+        # The messages currently displayed, indexed by file path and then by
+        # diagnostic key (see diagnostic_key)
+
+        self.__pending = {}
+        # The changes not applied yet, indexed by file path. Each value is a
+        # tuple (file, keys to remove, keys to add). The keys to add are
+        # stored in reverse order.
+
+        self.__idle_id = None
 
     def get_translation_unit(self, ed_buffer, update=False):
         return GPS.Libclang.get_translation_unit(ed_buffer.file())
@@ -44,11 +60,21 @@ class Clang(object):
         if f.language() in ("c", "c++") and GPS.SemanticTree(f).is_ready():
             self.add_diagnostics(ed_buffer)
 
+    @staticmethod
+    def diagnostic_key(d):
+        """
+        Return a key identifying the diagnostic d, which stays the same when
+        the translation unit is reparsed and the diagnostic is unchanged.
+        """
+        return (d.location.line, d.location.column, d.severity, d.spelling)
+
     def add_diagnostics(self, ed_buffer):
         """Add diagnostic information to the side of the buffer
 
            This will request a Translation_Unit, and therefore will be
-           blocking if the Translation_Unit is not ready.
+           blocking if the Translation_Unit is not ready. The messages
+           themselves are only updated for the diagnostics that changed
+           since the last call, in the background.
         """
         f = ed_buffer.file()
 
@@ -58,10 +84,7 @@ class Clang(object):
         if not tu:
             return
 
-        for m in self.messages:
-            m.remove()
-        self.messages = []
-
+        keys = []
         for d in tu.diagnostics:
             # Skip diagnostics that are not in the current file. If diagnostic
             # has no file, it might be a config error (bad switch for example)
@@ -69,24 +92,116 @@ class Clang(object):
             # ??? Did we mean 'name()' (or path) below, instead of just 'name'
             if not d.location.file or d.location.file.name != f.path:
                 continue
-            m = GPS.Message(
-                category="Clang live diagnostics",
-                file=f,
-                line=d.location.line,
-                column=d.location.column,
-                text=GLib.markup_escape_text(d.spelling),
-                show_in_locations=(show_diags_pref.get() == EDITOR_LOCATIONS),
-                allow_auto_jump_to_first=False
-            )
-
-            if d.severity < 3:
-                m.set_action("", "gps-emblem-build-warning", d.spelling)
-                m.set_style(colorschemes.STYLE_WARNING, 1)
-            else:
-                m.set_action("", "gps-emblem-build-error", d.spelling)
-                m.set_style(colorschemes.STYLE_ERROR, 1)
-
-            self.messages.append(m)
+            keys.append(self.diagnostic_key(d))
+
+        # Compare with what is already displayed (or about to be, if a
+        # refresh is still pending for this file)
+
+        displayed = self.__displayed(f)
+        new_keys = set(keys)
+        to_remove = [k for k in displayed if k not in new_keys]
+        to_add = []
+        added = set()
+        for k in keys:
+            if k not in displayed and k not in added:
+                added.add(k)
+                to_add.append(k)
+        to_add.reverse()
+
+        if to_remove or to_add:
+            self.__pending[f.path] = (f, to_remove, to_add)
+            if self.__idle_id is None:
+                self.__idle_id = GLib.idle_add(self.__process_pending)
+        else:
+            self.__pending.pop(f.path, None)
+
+    def __displayed(self, f):
+        """
+        Return the messages displayed for f, indexed by diagnostic key.
+        The messages can also be removed by the user, for instance from the
+        Locations view: in this case the remaining ones are removed too, so
+        that all the diagnostics are displayed again.
+        """
+        displayed = self.messages.get(f.path, {})
+        if displayed:
+            live = GPS.Message.list(category=CATEGORY, file=f)
+            if len(live) != len(displayed):
+                for m in live:
+                    m.remove()
+                displayed = {}
+                self.messages[f.path] = displayed
+        return displayed
+
+    def __create_message(self, f, key):
+        """Create the message for the diagnostic identified by key"""
+        line, column, severity, spelling = key
+        m = GPS.Message(
+            category=CATEGORY,
+            file=f,
+            line=line,
+            column=column,
+            text=GLib.markup_escape_text(spelling),
+            show_in_locations=(show_diags_pref.get() == EDITOR_LOCATIONS),
+            allow_auto_jump_to_first=False
+        )
+
+        if severity < 3:
+            m.set_action("", "gps-emblem-build-warning", spelling)
+            m.set_style(colorschemes.STYLE_WARNING, 1)
+        else:
+            m.set_action("", "gps-emblem-build-error", spelling)
+            m.set_style(colorschemes.STYLE_ERROR, 1)
+
+        return m
+
+    def __process_pending(self):
+        """
+        Apply the pending changes to the messages, until max_refresh_time
+        is exceeded. Return True if this should be called again.
+        """
+        start = time.time()
+
+        while self.__pending:
+            path = next(iter(self.__pending))
+            f, to_remove, to_add = self.__pending[path]
+            previous = self.messages.setdefault(path, {})
+            displayed = self.__displayed(f)
+
+            if displayed is not previous:
+                # The messages were removed since the changes were computed:
+                # create the messages for all the diagnostics again
+                removed = set(to_remove)
+                to_add[:0] = [k for k in previous if k not in removed]
+                del to_remove[:]
+
+            while to_remove or to_add:
+                if time.time() - start > self.max_refresh_time:
+                    return True
+
+                if to_remove:
+                    m = displayed.pop(to_remove.pop(), None)
+                    if m:
+                        m.remove()
+                else:
+                    key = to_add.pop()
+                    displayed[key] = self.__create_message(f, key)
+
+            del self.__pending[path]
+
+        self.__idle_id = None
+        return False
+
+    def remove_all_messages(self):
+        """Remove all the messages, and cancel the pending refreshes"""
+        if self.__idle_id is not None:
+            GLib.source_remove(self.__idle_id)
+            self.__idle_id = None
+        self.__pending = {}
+
+        # Some of the messages may already have been removed by the user
+        for m in GPS.Message.list(category=CATEGORY):
+            m.remove()
+        self.messages = {}
 
 
 #######################
@@ -122,8 +237,7 @@ class Clang_Module(Module):
     def preferences_changed(self, *args):
         if show_diags_pref.get() != self.show_diags_pref_val:
             self.show_diags_pref_val = show_diags_pref.get()
-            for m in self.clang_instance.messages:
-                m.remove()
+            self.clang_instance.remove_all_messages()
             self.refresh_current_editor()
 
 
@@ -46,5 +46,5 @@ XML = r"""<?xml version="1.0" ?>
 </GPS>
 """
 
-import GPS
-GPS.parse_xml(XML)
+from gps_utils import xml_registry
+xml_registry.register(XML, defer=False)
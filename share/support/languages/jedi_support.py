@@ -6,6 +6,8 @@ into GPS.
 
 import os
 import sys
+import hashlib
+from contextlib import contextmanager
 from itertools import chain
 
 try:
@@ -20,6 +22,7 @@ import GPS
 from completion import CompletionResolver, CompletionProposal
 import completion
 from modules import Module
+import workflows
 
 TYPE_LABELS = {
     # Global hash tabel for pop-out label icons
@@ -33,17 +36,153 @@ TYPE_LABELS = {
 }
 
 
+@contextmanager
+def extended_sys_path(sys_path):
+    """
+    Temporarily replace sys.path with sys_path, since that is where jedi
+    looks for the modules to import.
+    """
+    sys_path_backup = sys.path
+    sys.path = sys_path
+    try:
+        yield
+    finally:
+        sys.path = sys_path_backup
+
+
+class JediProposal(CompletionProposal):
+
+    """
+       A completion proposal for a jedi completion, whose documentation is
+       only computed when it is read.
+    """
+
+    def __init__(self, jedi_completion, sys_path):
+        self.__completion = jedi_completion
+        self.__sys_path = sys_path
+        self.__documentation = None
+        CompletionProposal.__init__(
+            self,
+            name=jedi_completion.name,
+            label=jedi_completion.name,
+            documentation=None,
+            language_category=TYPE_LABELS.get(
+                jedi_completion.type, completion.CAT_UNKNOWN))
+
+    @property
+    def documentation(self):
+        if self.__documentation is None:
+            try:
+                with extended_sys_path(self.__sys_path):
+                    self.__documentation = self.__completion.docstring()
+            except Exception:
+                self.__documentation = ""
+        return self.__documentation
+
+    @documentation.setter
+    def documentation(self, value):
+        self.__documentation = value
+
+
+class CompletionSession(object):
+
+    """
+       The state of the completion in one buffer, reused as long as the
+       user keeps typing the same identifier.
+    """
+
+    def __init__(self):
+        self.key = None
+        # Identifies the buffer contents (ignoring the identifier being
+        # typed) and the location of the identifier.
+
+        self.prefix = None
+        # The prefix for which the completions were computed
+
+        self.completions = []
+        # The jedi completions, sorted by name
+
+    def is_valid_for(self, key, prefix):
+        """
+           Whether the completions computed for a previous request can be
+           reused for the identifier starting with prefix.
+        """
+        return (self.key == key and self.prefix is not None and
+                prefix.startswith(self.prefix))
+
+
 class PythonResolver(CompletionResolver):
 
     """
        The Python Resolver class that inherits completion.CompletionResolver.
     """
 
+    max_preloaded_modules = 200
+    # Maximum number of modules preloaded by warm_up
+
     def __init__(self):
         self.__prefix = None
+        self.__prefix_column = None
         # additional directories that module search will perform
         self.source_dirs = set([])
 
+        self.__sessions = {}
+        # The completion sessions, indexed by file
+
+        self.__generation = 0
+        # Incremented for each completion request: the proposals of an
+        # outdated request are no longer computed.
+
+        self.__sys_path = None
+        self.__sys_path_dirs = None
+
+    def get_sys_path(self):
+        """
+           Return the value of sys.path to use when running jedi, which
+           includes the source dirs.
+        """
+        if self.__sys_path_dirs != self.source_dirs:
+            self.__sys_path_dirs = set(self.source_dirs)
+            self.__sys_path = list(sys.path) + list(self.__sys_path_dirs)
+        return self.__sys_path
+
+    def __session_key(self, loc, text):
+        """
+           Return a key that identifies the buffer contents and the location
+           of the identifier being completed, ignoring the characters of the
+           identifier itself.
+        """
+        lines = text.split("\n")
+        line = lines[loc.line() - 1]
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        line = line[:self.__prefix_column - 1] + line[loc.column() - 1:]
+
+        digest = hashlib.sha1()
+        for part in ("\n".join(lines[:loc.line() - 1]),
+                     line,
+                     "\n".join(lines[loc.line():])):
+            if not isinstance(part, bytes):
+                part = part.encode("utf-8")
+            digest.update(part)
+        return (loc.line(), self.__prefix_column, digest.hexdigest())
+
+    def __proposals(self, completions, sys_path, generation):
+        """
+           Generate the proposals for the given jedi completions. The
+           documentation of a proposal is only computed when the proposal is
+           taken by the completion window.
+        """
+        for i in completions:
+            if generation != self.__generation:
+                # The user has kept typing, a new request was made
+                return
+
+            if not i.name.startswith(self.__prefix):
+                continue
+
+            yield JediProposal(i, sys_path)
+
     def get_completions(self, loc):
         """
            Overridden method.
@@ -60,40 +199,44 @@ class PythonResolver(CompletionResolver):
                 (current_char in ['_', '.'] or current_char.isalnum())):
             return []
 
-        sys_path_backup = list(sys.path)
-        self.source_dirs.update([loc.buffer().file().directory()])
-        sys.path = sys.path + list(self.source_dirs)
+        self.__generation += 1
+        gps_file = loc.buffer().file()
+        self.source_dirs.add(gps_file.directory())
+        sys_path = self.get_sys_path()
 
         try:
             # filter out ^L in source text
             text = loc.buffer().get_chars()
             # text = text.replace('\x0c', ' ')
-            # Feed Jedi API
-            script = jedi.Script(
-                source=text,
-                line=loc.line(),
-                column=loc.column() - 1,
-            )
-
-            # Sort, filter results
-            result = sorted((CompletionProposal(
-                name=i.name,
-                label=i.name,
-                documentation=i.docstring(),
-                language_category=TYPE_LABELS.get(
-                    i.type, completion.CAT_UNKNOWN))
-                for i in script.completions()
-                if i.name.startswith(self.__prefix)),
-                key=lambda d: d.name)
-        except:
+
+            session = self.__sessions.setdefault(
+                gps_file.path, CompletionSession())
+            key = self.__session_key(loc, text)
+
+            if not session.is_valid_for(key, self.__prefix):
+                # Feed Jedi API. Passing the path lets jedi reuse its
+                # parsed version of the module between requests.
+                with extended_sys_path(sys_path):
+                    script = jedi.Script(
+                        source=text,
+                        line=loc.line(),
+                        column=loc.column() - 1,
+                        path=gps_file.path,
+                    )
+                    session.completions = sorted(
+                        script.completions(), key=lambda i: i.name)
+                session.key = key
+                session.prefix = self.__prefix
+
+            return self.__proposals(
+                session.completions, sys_path, self.__generation)
+
+        except Exception:
             jedi_log = GPS.Logger("JEDI_PARSING")
             jedi_log.log("jedi fails to parse:" +
                          loc.buffer().file().path)
-            result = []
-
-        # restore sys.path before exit
-        sys.path = sys_path_backup
-        return result
+            self.__sessions.pop(gps_file.path, None)
+            return []
 
     def get_completion_prefix(self, loc):
         """
@@ -105,15 +248,55 @@ class PythonResolver(CompletionResolver):
            Prefix is stored in a field.
         """
         beginning = completion.to_completion_point(loc)
+        self.__prefix_column = beginning.column()
         self.__prefix = loc.buffer().get_chars(beginning, loc)
         self.__prefix = self.__prefix.strip("\n")
         return self.__prefix
 
+    def forget_file(self, path):
+        """
+           Discard the completion session for the given file
+        """
+        self.__sessions.pop(path, None)
+
+    def warm_up(self, task):
+        """
+           A workflow that preloads, in jedi, the python modules found in
+           the source dirs, so that the first completion does not have to
+           parse them.
+        """
+        modules = []
+        for d in sorted(self.source_dirs):
+            try:
+                names = sorted(os.listdir(d))
+            except OSError:
+                continue
+            for name in names:
+                base, ext = os.path.splitext(name)
+                if ext == ".py" and base != "__init__":
+                    modules.append(base)
+                elif os.path.isfile(os.path.join(d, name, "__init__.py")):
+                    modules.append(name)
+
+        modules = modules[:self.max_preloaded_modules]
+        sys_path = self.get_sys_path()
+        for index, name in enumerate(modules):
+            task.set_progress(index, len(modules))
+            try:
+                with extended_sys_path(sys_path):
+                    jedi.preload_module(name)
+            except Exception:
+                pass
+            # Give control back to GPS between modules
+            yield None
+
 
 class Jedi_Module(Module):
 
     __resolver = PythonResolver()
 
+    __warm_up_task = None
+
     def __refresh_source_dirs(self):
         """
            Update resolver's source_dirs with user's working directory
@@ -124,6 +307,22 @@ class Jedi_Module(Module):
                                 GPS.Project.root().dependencies()
                                 if "python" in i.languages()))
 
+    def __start_warm_up(self):
+        """
+           Preload the project's python modules in the background,
+           interrupting any warm up still running for the previous project.
+        """
+        if self.__warm_up_task is not None:
+            try:
+                self.__warm_up_task.interrupt()
+            except Exception:
+                pass   # already finished
+            self.__warm_up_task = None
+
+        if self.__resolver.source_dirs:
+            self.__warm_up_task = workflows.task_workflow(
+                "preload python modules", self.__resolver.warm_up)
+
     # The followings are hooks:
 
     def setup(self):
@@ -132,6 +331,7 @@ class Jedi_Module(Module):
            and update its source dirs
         """
         GPS.Completion.register(self.__resolver, "python")
+        GPS.Hook("file_closed").add(self.__on_file_closed)
 
     def project_changed(self):
         """
@@ -142,5 +342,13 @@ class Jedi_Module(Module):
     def project_view_changed(self):
         """
            When project view changes, update source dirs for resolver
+           and preload the python modules they contain
         """
         self.__refresh_source_dirs()
+        self.__start_warm_up()
+
+    def __on_file_closed(self, hook, file):
+        """
+           Forget the completion session of a closed file
+        """
+        self.__resolver.forget_file(file.path)
@@ -26,6 +26,7 @@ following are provided:
 import GPS
 import sys
 import ast
+import hashlib
 import os.path
 import gps_utils
 import os_utils
@@ -53,11 +54,12 @@ class ASTVisitor(ast.NodeVisitor):
 
     def __init__(self, bufstr, clist):
         self.buflines = bufstr.splitlines()
-        self.lines_offsets = [0 for _ in self.buflines]
+        self.lines_offsets = []
 
-        for i in range(1, len(self.buflines)):
-            self.lines_offsets[i] = (self.lines_offsets[i - 1] +
-                                     len(self.buflines[i - 1]) + 1)
+        offset = 0
+        for line in self.buflines:
+            self.lines_offsets.append(offset)
+            offset += len(line) + 1
 
         self.clist = clist
 
@@ -118,7 +120,11 @@ class ASTVisitor(ast.NodeVisitor):
 
     def generic_visit(self, n):
         ast.NodeVisitor.generic_visit(self, n)
-        if getattr(n, "lineno", None):
+        if getattr(n, "end_lineno", None):
+            # Recent versions of the ast module already know where each
+            # node ends, no need to look at its children.
+            n.end_line = n.end_lineno
+        elif getattr(n, "lineno", None):
             end_line = n.lineno
             for node_name in n._fields:
                 _node = getattr(n, node_name)
@@ -158,20 +164,154 @@ class ASTVisitor(ast.NodeVisitor):
         self.add_private_construct(n, CAT_LOOP_STATEMENT)
 
 
+def content_digest(text):
+    """
+    Return a digest of text, suitable as a cache key.
+    :param str|unicode text: the text to hash
+    """
+    if not isinstance(text, bytes):
+        text = text.encode("utf-8")
+    return hashlib.sha1(text).hexdigest()
+
+
+class ConstructsRecorder(object):
+    """
+    Stand-in for a GPS.ConstructsList, which records the constructs added
+    to it so that they can be replayed later without walking the AST again.
+    """
+
+    def __init__(self):
+        self.constructs = []
+
+    def add_construct(self, *args):
+        self.constructs.append(args)
+
+    def replay(self, clist):
+        """Add all the recorded constructs to clist"""
+        for args in self.constructs:
+            clist.add_construct(*args)
+
+
+def _shift_construct(args, line_delta, offset_delta):
+    """
+    Return a copy of the arguments of add_construct, with all the source
+    locations moved by line_delta lines and offset_delta characters.
+    """
+    return args[:5] + tuple(
+        (line + line_delta, col, offset + offset_delta)
+        for line, col, offset in args[5:])
+
+
+class _FileConstructs(object):
+    """
+    The constructs computed for the last version of a file.
+
+    :ivar str digest: the digest of the whole buffer
+    :ivar list constructs: the add_construct arguments for the whole buffer
+    :ivar dict blocks: the add_construct arguments for each top-level block,
+       indexed by the digest of the block's text. Locations are relative to
+       the start of the block.
+    """
+
+    def __init__(self, digest, constructs, blocks):
+        self.digest = digest
+        self.constructs = constructs
+        self.blocks = blocks
+
+
 # noinspection PyMethodMayBeStatic
 class PythonLanguage(GPS.Language):
 
+    # Maximum number of files for which constructs are cached
+    max_cached_files = 32
+
     def __init__(self):
-        pass
+        # The cached constructs, indexed by file name
+        self._files = {}
+        self._files_order = []
+
+    def _top_level_blocks(self, tree, buflines):
+        """
+        Split the buffer into blocks, one per top-level statement (or group
+        of statements starting on the same line). Each block extends up to
+        the line before the next one, so that comments and blank lines that
+        follow a statement belong to it.
+        Return a list of (first_line, last_line, statements).
+        """
+        blocks = []
+        for stmt in tree.body:
+            first = min([stmt.lineno] +
+                        [d.lineno for d in
+                         getattr(stmt, "decorator_list", [])])
+            if blocks and blocks[-1][0] == first:
+                blocks[-1][2].append(stmt)
+            else:
+                blocks.append([first, None, [stmt]])
+
+        for index, block in enumerate(blocks):
+            if index + 1 < len(blocks):
+                block[1] = blocks[index + 1][0] - 1
+            else:
+                block[1] = len(buflines)
+        return blocks
+
+    def _remember(self, key, entry):
+        """Store the constructs for file key, forgetting the oldest files"""
+        if key in self._files:
+            self._files_order.remove(key)
+        self._files[key] = entry
+        self._files_order.append(key)
+        while len(self._files_order) > self.max_cached_files:
+            del self._files[self._files_order.pop(0)]
 
     def parse_constructs(self, constructs_list, gps_file, string):
-        del gps_file
+        key = gps_file.path if gps_file else None
+        digest = content_digest(string)
+        previous = self._files.get(key)
+
+        if previous and previous.digest == digest:
+            for args in previous.constructs:
+                constructs_list.add_construct(*args)
+            return
+
         try:
             tree = ast.parse(string)
-            tree.lineno = 0
-            ASTVisitor(string, constructs_list).visit(tree)
         except SyntaxError:
-            pass
+            return
+
+        tree.lineno = 0
+        recorder = ConstructsRecorder()
+        visitor = ASTVisitor(string, recorder)
+        old_blocks = previous.blocks if previous else {}
+        blocks = {}
+
+        # Only the top-level blocks whose text changed since the last parse
+        # need to be visited, the others are copied from the cache.
+
+        for first, last, stmts in self._top_level_blocks(
+                tree, visitor.buflines):
+            block_digest = content_digest(
+                "\n".join(visitor.buflines[first - 1:last]))
+            base_offset = visitor.lines_offsets[first - 1]
+            relative = old_blocks.get(block_digest)
+
+            if relative is None:
+                start = len(recorder.constructs)
+                for stmt in stmts:
+                    visitor.visit(stmt)
+                relative = [
+                    _shift_construct(args, 1 - first, -base_offset)
+                    for args in recorder.constructs[start:]]
+            else:
+                recorder.constructs.extend(
+                    _shift_construct(args, first - 1, base_offset)
+                    for args in relative)
+
+            blocks[block_digest] = relative
+
+        self._remember(key, _FileConstructs(
+            digest, recorder.constructs, blocks))
+        recorder.replay(constructs_list)
 
 
 class PythonSupport(object):
@@ -3,6 +3,7 @@
 """
 
 import glob
+import json
 import os
 import plistlib
 import sys
@@ -34,6 +35,9 @@ color_prefs = {
     "entity.name.function":   "current_block",
 }
 
+CATALOG_FILE = "themes_catalog.json"
+# The file, in the GPS home directory, in which the parsed themes are cached
+
 
 def to_GPS_prefs(d):
     """ Considering a dictionary d representing prefs in the theme plist,
@@ -97,7 +101,13 @@ class TextmateTheme(object):
         self.general = self.o['settings'][0]['settings']
 
     def theme(self):
-        """ Return a dictionary of preferences
+        """ Return the theme
+        """
+        return Theme(*self.theme_values())
+
+    def theme_values(self):
+        """ Return a tuple (name, is_light, d) where d is a dictionary of
+            preferences
         """
         d = {}  # The result dict
 
@@ -200,26 +210,90 @@ class TextmateTheme(object):
             "DEFAULT", transparent,
             e_smart_color)
 
-        return Theme(self.name, is_light, d)
+        return (self.name, is_light, d)
 
 
-def textmate_themes():
-    """ Find all themes installed in the color_themes directory
-        and return them as a list of dictionary objects.
+def to_json(value):
+    """ Convert a value of a theme dictionary to a value that can be
+        serialized in JSON.
     """
+    if isinstance(value, Color):
+        return {"c": [value.r, value.g, value.b, value.a]}
+    elif isinstance(value, tuple):
+        return {"v": [to_json(v) for v in value]}
+    else:
+        return value
+
 
-    results = []
+def from_json(value):
+    """ The reverse of to_json
+    """
+    if isinstance(value, dict):
+        if "c" in value:
+            color = Color(from_rgba=(0, 0, 0))
+            color.r, color.g, color.b, color.a = value["c"]
+            return color
+        else:
+            return tuple(from_json(v) for v in value["v"])
+    elif isinstance(value, unicode):
+        return value.encode("utf-8")
+    else:
+        return value
 
-    default_themes = glob.glob(os.path.join(
-        GPS.get_system_dir(),
-        'share', 'gps', 'color_themes', 'themes', '*', '*.tmTheme'))
 
-    user_themes = glob.glob(os.path.join(
-        GPS.get_home_dir(), 'themes', '*.tmTheme'))
+class ThemeCatalog(object):
+    """ The themes defined in .tmTheme files.
+        The parsed themes are saved in a cache file, and a theme file is only
+        parsed again if its size or modification time have changed.
+    """
 
-    for file in default_themes + user_themes:
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.__entries = None   # indexed by theme file name
+        self.__modified = False
+
+    def __load(self):
+        if self.__entries is None:
+            try:
+                with open(self.cache_file) as f:
+                    self.__entries = json.load(f)
+            except (IOError, ValueError):
+                self.__entries = {}
+
+    def __save(self):
+        if self.__modified:
+            try:
+                with open(self.cache_file, "w") as f:
+                    json.dump(self.__entries, f, separators=(",", ":"))
+            except IOError:
+                pass
+            self.__modified = False
+
+    def __entry(self, file):
+        """ Return the cached entry for file, parsing it if needed
+        """
+        st = os.stat(file)
+        entry = self.__entries.get(file)
+        if (entry is None or entry["size"] != st.st_size or
+                entry["mtime"] != st.st_mtime):
+            name, is_light, d = TextmateTheme(file).theme_values()
+            entry = {"size": st.st_size,
+                     "mtime": st.st_mtime,
+                     "name": name,
+                     "light": is_light,
+                     "values": {k: to_json(v) for k, v in d.iteritems()}}
+            self.__entries[file] = entry
+            self.__modified = True
+        return entry
+
+    def __theme(self, file):
+        """ Return the theme defined in file, or None if it can't be parsed
+        """
         try:
-            results.append(TextmateTheme(file).theme())
+            entry = self.__entry(file)
+            return Theme(from_json(entry["name"]), entry["light"],
+                         {from_json(k): from_json(v)
+                          for k, v in entry["values"].iteritems()})
         except Exception:
             msg, _, tb = sys.exc_info()
             tb = "\n".join(traceback.format_list(traceback.extract_tb(tb)))
@@ -227,5 +301,41 @@ def textmate_themes():
             GPS.Console("Messages").write(
                 "Exception when parsing theme file '%s':\n%s\n%s\n"
                 % (file, msg, str(tb)))
+            return None
+
+    def theme_files(self):
+        """ Return the list of .tmTheme files
+        """
+        default_themes = glob.glob(os.path.join(
+            GPS.get_system_dir(),
+            'share', 'gps', 'color_themes', 'themes', '*', '*.tmTheme'))
 
-    return results
+        user_themes = glob.glob(os.path.join(
+            GPS.get_home_dir(), 'themes', '*.tmTheme'))
+
+        return default_themes + user_themes
+
+    def themes(self):
+        """ Return the list of all themes
+        """
+        self.__load()
+        files = self.theme_files()
+        results = [t for t in (self.__theme(f) for f in files) if t]
+
+        # Forget about the theme files that have been removed
+        for file in set(self.__entries).difference(files):
+            del self.__entries[file]
+            self.__modified = True
+
+        self.__save()
+        return results
+
+
+catalog = ThemeCatalog(os.path.join(GPS.get_home_dir(), CATALOG_FILE))
+
+
+def textmate_themes():
+    """ Find all themes installed in the color_themes directory
+        and return them as a list of dictionary objects.
+    """
+    return catalog.themes()
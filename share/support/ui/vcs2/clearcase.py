@@ -17,6 +17,7 @@ ID_HEADER = "Event "
 # The actions must only be registered once
 ALREADY_LOADED = False
 VOBS = None
+# The VOB_Index built from "cleartool lsvob", None until first needed
 
 CC_PATH = "Clearcase/"
 UNCHECKOUT_PREF = "Uncheckout behavior"
@@ -38,6 +39,69 @@ GPS.Preference(CC_PATH + CHECKOUT_PREF).create(
     True)
 
 
+class VOB_Index(object):
+    """
+    The root directories of the VOBs, stored as a tree of path components,
+    so that finding the VOB containing a directory only depends on the
+    depth of that directory, not on the number of VOBs.
+    """
+
+    def __init__(self, roots=()):
+        self.trie = {}
+        for root in roots:
+            self.add(root)
+
+    @staticmethod
+    def from_lsvob(output):
+        """
+        Build the index from the output of "cleartool lsvob", whose lines
+        have the format {*} {tag} {vob dir} {public | private}
+        """
+        index = VOB_Index()
+        for line in output.splitlines():
+            fields = line.split()
+            if fields and fields[0] == '*':
+                # The VOB is mounted
+                fields = fields[1:]
+            if len(fields) >= 2:
+                tag, vob_dir = fields[0], fields[1]
+                index.add(os.path.dirname(vob_dir) + tag)
+        return index
+
+    @staticmethod
+    def _components(path):
+        return [c for c in os.path.normpath(path).split(os.sep) if c]
+
+    def add(self, root):
+        """Add the VOB whose root directory is root"""
+        node = self.trie
+        for c in self._components(root):
+            node = node.setdefault(c, {})
+        node[None] = root   # None cannot be a path component
+
+    def find(self, directory):
+        """
+        Return the root of the innermost VOB containing directory, or ""
+        """
+        node = self.trie
+        result = node.get(None, "")
+        for c in self._components(directory):
+            node = node.get(c)
+            if node is None:
+                break
+            result = node.get(None, result)
+        return result
+
+
+def refresh_vobs():
+    """
+    Query the list of VOBs again, for instance after a new VOB was
+    created or mounted.
+    """
+    global VOBS
+    VOBS = None
+
+
 class Activity(Enum):
     YES = 0
     NO = 1
@@ -57,27 +121,17 @@ class Clearcase(core_staging.Emulate_Staging,
 
         # Only query the VOBs once to not slowdown GPS
         if VOBS is None:
-            # Map of tag path to VOB dir
-            VOBS = []
             p = subprocess.Popen(['cleartool', 'lsvob'],
                                  stdout=subprocess.PIPE,
                                  stderr=subprocess.STDOUT)
             output, error = p.communicate()
             status = p.wait()
             if status or not output:
-                return ""
+                VOBS = VOB_Index()
             else:
-                for line in output.splitlines():
-                    # The format is {tag} {vob dir} {public | private}
-                    tag = line.split()[0]
-                    vob_dir = line.split()[1]
-                    VOBS.append(os.path.dirname(vob_dir) + tag)
+                VOBS = VOB_Index.from_lsvob(output)
 
-        cur_dir = os.path.dirname(file.path)
-        for path in VOBS:
-            if path in cur_dir:
-                return path
-        return ""
+        return VOBS.find(os.path.dirname(file.path))
 
     def _cleartool(self, args, block_exit=False):
         p = ProcessWrapper(
@@ -116,6 +170,11 @@ class Clearcase(core_staging.Emulate_Staging,
             _register_clearcase_action("uncheckout", self._uncheckout_current)
             _register_clearcase_action("create", self._create_current)
             _register_clearcase_action("remove", self._remove_current)
+            gps_utils.make_interactive(
+                callback=refresh_vobs,
+                name='clearcase refresh vobs',
+                category=CATEGORY,
+                description=refresh_vobs.__doc__)
             GPS.Logger(LOG_ID).log("Finishing registering the actions")
 
     def _set_clearcase_status(self, cmd_line):
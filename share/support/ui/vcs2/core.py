@@ -9,9 +9,9 @@ import workflows
 import time
 from workflows.promises import Promise
 import types
-import difflib
 import io
 import platform
+from . import diff
 
 
 GPS.VCS2.Status = gps_utils.enum(
@@ -47,6 +47,14 @@ Traverse_Limit_Pref.create(
     "How much directories should GPS traverse when looking for " +
     "VCS root counting from project file directory.", 99, 0)
 
+Diff_Engine_Pref = GPS.Preference(":VCS/Diff-Engine")
+Diff_Engine_Pref.create(
+    "Diff engine",
+    "string",
+    "The algorithm used to compare files when no external diff tool is " +
+    "available. One of " + ", ".join(diff.engines()) + ".",
+    diff.DEFAULT_ENGINE)
+
 
 class _Branch(list):
     """
@@ -813,29 +821,7 @@ def _diff(left_file, right_file, result_file):
     f = io.open(right_file.path, "rb")
     right = f.readlines()
     f.close()
-    diff = difflib.SequenceMatcher(isjunk=None, a=left, b=right)
-    codes = diff.get_opcodes()
-    out = []
-    for code in codes:
-        if code[0] == "replace":
-            op = "c"
-        elif code[0] == "insert":
-            op = "a"
-        elif code[0] == "delete":
-            op = "d"
-        else:
-            op = None
-
-        if op:
-            out.append("%s%s%s\n" % (code[2] if code[1] + 1 >= code[2] else
-                                     "{},{}".format(code[1] + 1, code[2]),
-                                     op,
-                                     code[4] if code[3] + 1 >= code[4] else
-                                     "{},{}".format(code[3] + 1, code[4])))
-            for x in range(code[1], code[2]):
-                out.append("< %s" % (left[x]))
-            for x in range(code[3], code[4]):
-                out.append("> %s" % (right[x]))
+    out = diff.normal_diff(left, right, engine=Diff_Engine_Pref.get())
 
     f = io.open(result_file.path, "wb")
     f.writelines(out)
@@ -0,0 +1,370 @@
+"""
+Line-based diff engines used by GPS.VCS2._diff.
+
+This module does not depend on GPS, so that it can be tested and benchmarked
+outside of it. An engine is a function that takes two lists of lines and
+returns a list of opcodes, in the same format as
+difflib.SequenceMatcher.get_opcodes: (tag, i1, i2, j1, j2) tuples, where tag
+is one of "equal", "replace", "delete" or "insert".
+
+The default engine implements the linear space variant of the algorithm
+described in "An O(ND) Difference Algorithm and Its Variations" (Eugene W.
+Myers, 1986). Lines are first replaced with integers, so that comparing two
+lines is a single integer comparison, and the common prefix and suffix of
+the two files, as well as the lines that only appear in one of them, are
+removed before running the algorithm.
+
+Like GNU diff, the engine gives up on finding a minimal edit script when it
+becomes too expensive, which happens on large files with little in common:
+past a number of steps of the algorithm proportional to the size of the
+files (see COST_PER_LINE), the files are compared with difflib
+instead, which is much faster in that case.
+
+New engines can be registered with register_engine::
+
+    from vcs2 import diff
+
+    def my_engine(a, b):
+        ...
+        return opcodes
+
+    diff.register_engine("mine", my_engine)
+    diff.normal_diff(left_lines, right_lines, engine="mine")
+"""
+
+import difflib
+from collections import OrderedDict
+
+DEFAULT_ENGINE = "myers"
+
+COST_PER_LINE = 10
+MIN_COST = 200000
+# The maximal number of diagonals explored and lines compared by the Myers
+# engine, before falling back to difflib, is COST_PER_LINE times the number
+# of lines to compare, or MIN_COST for small files.
+
+
+class _TooExpensive(Exception):
+    """Raised when the Myers engine exceeds its budget"""
+    pass
+
+
+def _common_prefix(a, alo, ahi, b, blo, bhi):
+    """
+    Return the length of the common prefix of a[alo:ahi] and b[blo:bhi]
+    """
+    n = 0
+    max_n = min(ahi - alo, bhi - blo)
+    while n < max_n and a[alo + n] == b[blo + n]:
+        n += 1
+    return n
+
+
+def _common_suffix(a, alo, ahi, b, blo, bhi):
+    """
+    Return the length of the common suffix of a[alo:ahi] and b[blo:bhi]
+    """
+    n = 0
+    max_n = min(ahi - alo, bhi - blo)
+    while n < max_n and a[ahi - n - 1] == b[bhi - n - 1]:
+        n += 1
+    return n
+
+
+def _middle_snake(a, b, budget):
+    """
+    Find the middle snake of an optimal edit script between a and b, by
+    running the algorithm forward from the start and backward from the end
+    at the same time until the two paths overlap.
+    Return the (x, y) coordinates of the split point, or None if a and b
+    have nothing in common.
+
+    :param list a: a list of integers. a and b must not share a common
+       prefix or suffix, and must not be empty.
+    :param list b: a list of integers
+    :param list budget: a list containing the number of steps left, which
+       is decremented as the algorithm progresses. _TooExpensive is raised
+       when it drops below zero.
+    """
+    n = len(a)
+    m = len(b)
+    max_d = (n + m + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    v1 = [-1] * v_length
+    v2 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2[v_offset + 1] = 0
+    delta = n - m
+    front = delta % 2 != 0
+
+    # k1start, k1end, k2start and k2end restrict the diagonals to explore
+    # once the paths have reached the edges of the edit graph
+    k1start = k1end = k2start = k2end = 0
+
+    for d in range(max_d):
+        # Each pass explores up to 2 * (d + 1) diagonals, and the snakes
+        # can cover up to n lines.
+        budget[0] -= 2 * (d + 1)
+        if budget[0] < 0:
+            raise _TooExpensive()
+
+        # Forward path
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and
+                            v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            start = x1
+            while x1 < n and y1 < m and a[x1] == b[y1]:
+                x1 += 1
+                y1 += 1
+            budget[0] -= x1 - start
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                    if x1 >= n - v2[k2_offset]:
+                        return x1, y1
+
+        # Backward path
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and
+                            v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            start = x2
+            while x2 < n and y2 < m and a[n - x2 - 1] == b[m - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            budget[0] -= x2 - start
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    if x1 >= n - x2:
+                        return x1, v_offset + x1 - k1_offset
+
+    return None
+
+
+def _myers_matches(a, b, budget):
+    """
+    Return the list of (i, j, size) blocks of lines common to a and b, in
+    increasing order.
+
+    :param list a: a list of integers
+    :param list b: a list of integers
+    :param list budget: see _middle_snake
+    """
+    matches = []
+
+    # An explicit stack is used instead of recursion, since the depth
+    # can be large for files with many differences.
+    todo = [(0, len(a), 0, len(b))]
+
+    while todo:
+        alo, ahi, blo, bhi = todo.pop()
+
+        prefix = _common_prefix(a, alo, ahi, b, blo, bhi)
+        if prefix:
+            matches.append((alo, blo, prefix))
+            alo += prefix
+            blo += prefix
+
+        suffix = _common_suffix(a, alo, ahi, b, blo, bhi)
+        if suffix:
+            matches.append((ahi - suffix, bhi - suffix, suffix))
+            ahi -= suffix
+            bhi -= suffix
+
+        if alo == ahi or blo == bhi:
+            continue
+
+        split = _middle_snake(a[alo:ahi], b[blo:bhi], budget)
+        if split is None:
+            continue
+
+        x, y = split
+        if (x, y) in ((0, 0), (ahi - alo, bhi - blo)):
+            # Should not happen, but make sure we always progress
+            continue
+
+        todo.append((alo + x, ahi, blo + y, bhi))
+        todo.append((alo, alo + x, blo, blo + y))
+
+    matches.sort()
+    return matches
+
+
+def _to_opcodes(matches, len_a, len_b):
+    """
+    Convert a list of matching blocks into a list of opcodes.
+    """
+    opcodes = []
+    i = j = 0
+    for ai, bj, size in matches + [(len_a, len_b, 0)]:
+        if i < ai and j < bj:
+            opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(("delete", i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(("insert", i, ai, j, bj))
+
+        if size:
+            # Merge adjacent blocks
+            if opcodes and opcodes[-1][0] == "equal":
+                tag, i1, i2, j1, j2 = opcodes.pop()
+                opcodes.append(("equal", i1, ai + size, j1, bj + size))
+            else:
+                opcodes.append(("equal", ai, ai + size, bj, bj + size))
+
+        i = ai + size
+        j = bj + size
+    return opcodes
+
+
+def myers_opcodes(a, b):
+    """
+    Compare two lists of lines with the Myers algorithm, or with difflib if
+    that is too expensive.
+
+    :param list a: the lines of the first file
+    :param list b: the lines of the second file
+    :return: a list of (tag, i1, i2, j1, j2) tuples
+    """
+    # Identical prefix and suffix: this is the common case when comparing
+    # two versions of a file, and is cheap to detect on the lines
+    # themselves.
+    len_a = len(a)
+    len_b = len(b)
+    prefix = _common_prefix(a, 0, len_a, b, 0, len_b)
+    suffix = _common_suffix(a, prefix, len_a, b, prefix, len_b)
+    matches = []
+    if prefix:
+        matches.append((0, 0, prefix))
+
+    # Replace lines with integers, and drop the lines that only appear on
+    # one side: they can never be part of a match. This considerably
+    # reduces the cost of the algorithm for files with many changes.
+    ids = {}
+    a_ids = [ids.setdefault(line, len(ids))
+             for line in a[prefix:len_a - suffix]]
+    in_a = len(ids)
+    b_ids = [ids.setdefault(line, len(ids))
+             for line in b[prefix:len_b - suffix]]
+    in_b = set(b_ids)
+
+    a_index = [i for i, id in enumerate(a_ids) if id in in_b]
+    b_index = [j for j, id in enumerate(b_ids) if id < in_a]
+
+    budget = max(MIN_COST, COST_PER_LINE * (len(a_index) + len(b_index)))
+    try:
+        common = _myers_matches([a_ids[i] for i in a_index],
+                                [b_ids[j] for j in b_index],
+                                [budget])
+    except _TooExpensive:
+        return difflib_opcodes(a, b)
+
+    for i, j, size in common:
+        # A block in the filtered lists might not be contiguous in the
+        # original ones: split it as needed.
+        for k in range(size):
+            ai = a_index[i + k] + prefix
+            bj = b_index[j + k] + prefix
+            last = matches[-1] if matches else None
+            if last and last[0] + last[2] == ai and last[1] + last[2] == bj:
+                matches[-1] = (last[0], last[1], last[2] + 1)
+            else:
+                matches.append((ai, bj, 1))
+
+    if suffix:
+        matches.append((len_a - suffix, len_b - suffix, suffix))
+
+    return _to_opcodes(matches, len_a, len_b)
+
+
+def difflib_opcodes(a, b):
+    """
+    Compare two lists of lines with difflib.SequenceMatcher.
+    """
+    return difflib.SequenceMatcher(isjunk=None, a=a, b=b).get_opcodes()
+
+
+_engines = OrderedDict([
+    ("myers", myers_opcodes),
+    ("difflib", difflib_opcodes)])
+
+
+def register_engine(name, engine):
+    """
+    Register a new diff engine.
+
+    :param str name: the name of the engine, as given to get_engine
+    :param engine: a function that takes two lists of lines and returns
+       a list of opcodes, see difflib.SequenceMatcher.get_opcodes
+    """
+    _engines[name] = engine
+
+
+def engines():
+    """
+    Return the names of the registered engines.
+    """
+    return list(_engines)
+
+
+def get_engine(name=None):
+    """
+    Return the engine registered under name, or the default engine if
+    there is no such engine.
+    """
+    return _engines.get(name) or _engines[DEFAULT_ENGINE]
+
+
+def normal_diff(left, right, engine=None):
+    """
+    Compare two lists of lines, and return the result as a list of lines
+    in the format of "diff --normal left right".
+
+    :param list left: the lines of the first file, including the line
+       terminators
+    :param list right: the lines of the second file
+    :param str engine: the name of the engine to use
+    """
+    out = []
+    for tag, i1, i2, j1, j2 in get_engine(engine)(left, right):
+        if tag == "replace":
+            op = "c"
+        elif tag == "insert":
+            op = "a"
+        elif tag == "delete":
+            op = "d"
+        else:
+            continue
+
+        out.append("%s%s%s\n" % (i2 if i1 + 1 >= i2 else
+                                 "{},{}".format(i1 + 1, i2),
+                                 op,
+                                 j2 if j1 + 1 >= j2 else
+                                 "{},{}".format(j1 + 1, j2)))
+        for x in range(i1, i2):
+            out.append("< %s" % (left[x]))
+        for x in range(j1, j2):
+            out.append("> %s" % (right[x]))
+    return out
@@ -1,6 +1,8 @@
 import json
 import os
-from workflows.promises import ProcessWrapper
+import time
+import workflows
+from workflows.promises import ProcessWrapper, Promise
 import GPS
 from . import core
 from . import git
@@ -9,11 +11,143 @@ CAT_REVIEWS = 'REVIEWS'
 
 CAN_RENAME = True
 
+Cache_TTL_Pref = GPS.Preference(":VCS/Gerrit-Cache-TTL")
+Cache_TTL_Pref.create(
+    "Gerrit cache duration",
+    "integer",
+    "How long, in seconds, the list of reviews fetched from Gerrit is " +
+    "reused before querying the server again.", 60, 0)
+
+AGE_MARGIN = 60
+# When only fetching the changes updated since the last query, how many
+# seconds to add to the age, to account for clock differences.
+
+
+class ReviewCache(object):
+    """
+    The open reviews of a Gerrit project.
+
+    The reviews are fetched from the server with "gerrit query", and reused
+    for ttl seconds. After that, only the changes updated since the last
+    query are fetched, including the ones that have been closed. Callers
+    that ask for the reviews while a query is running all wait for that
+    query, instead of starting their own.
+    """
+
+    def __init__(self, command, project, ttl):
+        """
+        :param list command: the command that runs gerrit on the server,
+           for instance ['ssh', 'gerrit.example.com', 'gerrit']
+        :param str project: the Gerrit project
+        :param int ttl: how long the reviews are reused, in seconds
+        """
+        self.command = command
+        self.project = project
+        self.ttl = ttl
+        self.accessible = True
+        self.reviews = {}         # the changes, indexed by number
+        self.last_query = None    # the start time of the last query
+        self.expires = 0          # when the reviews must be fetched again
+        self._waiting = None      # the promises waiting for the query
+
+    def invalidate(self):
+        """Force a query on the next call to get"""
+        self.expires = 0
+
+    def get(self):
+        """
+        Return a promise resolved with the list of open changes, as decoded
+        from the JSON output of gerrit, most recently updated first.
+        """
+        p = Promise()
+        if time.time() < self.expires:
+            p.resolve(self.__sorted())
+        elif self._waiting is not None:
+            self._waiting.append(p)
+        else:
+            self._waiting = [p]
+            self.__query()
+        return p
+
+    def __sorted(self):
+        return sorted(self.reviews.itervalues(),
+                      key=lambda c: c.get(u'lastUpdated', 0), reverse=True)
+
+    @workflows.run_as_workflow
+    def __query(self):
+        start = time.time()
+        full = self.last_query is None
+        args = ['query', '--format=json', '--current-patch-set',
+                'project:%s' % self.project]
+        if full:
+            args.append('status:open')
+        else:
+            args.append(
+                '-age:%ds' % (start - self.last_query + AGE_MARGIN))
+
+        p = ProcessWrapper(self.command + args, block_exit=False)
+        status, output = yield p.wait_until_terminate()
+
+        if output.startswith('Bad port'):
+            # Seems like Gerrit can't be accessed
+            self.accessible = False
+        elif status == 0:
+            if full:
+                self.reviews = {}
+            for line in output.splitlines():
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    continue
+                if change and change.get(u'subject', None) is not None:
+                    if change.get(u'open', True):
+                        self.reviews[change[u'number']] = change
+                    else:
+                        self.reviews.pop(change[u'number'], None)
+            self.last_query = start
+            self.expires = start + self.ttl
+
+        waiting, self._waiting = self._waiting, None
+        reviews = self.__sorted()
+        for w in waiting:
+            w.resolve(reviews)
+
+
+_caches = {}
+# The review caches, indexed by (host, port, project)
+
+
+def get_review_cache(host, port, project):
+    """
+    Return the review cache for the given Gerrit project, shared by all
+    the repositories that use it.
+    """
+    key = (host, port, project)
+    cache = _caches.get(key)
+    if cache is None:
+        # We use -q to hide warnings which could for instance occur
+        # when redirecting ports if ~/.ssh/config contains
+        #   Host ...
+        #      RemoteForward 3142 localhost:22
+        cache = _caches[key] = ReviewCache(
+            ['ssh',
+             '-x',
+             '-q',  # Hide warnings
+             '-p' if port else '', port,
+             host,
+             'gerrit'],
+            project,
+            Cache_TTL_Pref.get())
+    else:
+        cache.ttl = Cache_TTL_Pref.get()
+    return cache
+
 
 class Gerrit(core.Extension):
     def __init__(self, base_vcs):
         super(Gerrit, self).__init__(base_vcs)
         self.gerrit_accessible = True
+        self.cache = None
 
     def applies(self):
         gitreview = os.path.join(self.base.working_dir.path, '.gitreview')
@@ -37,65 +171,46 @@ class Gerrit(core.Extension):
             return False
 
     def async_branches(self, visitor):
-        # We use -q to hide warnings which could for instance occur
-        # when redirecting ports if ~/.ssh/config contains
-        #   Host ...
-        #      RemoteForward 3142 localhost:22
-
         if not self.gerrit_accessible:
             return
 
-        p = ProcessWrapper(
-            ['ssh',
-             '-x',
-             '-q',  # Hide warnings
-             '-p' if self.port else '', self.port,
-             self.host,
-             'gerrit',
-             'query',
-             '--format=json',
-             '--current-patch-set',
-             'project:%s' % self.project,
-             'status:open'], block_exit=False)
+        if self.cache is None:
+            self.cache = get_review_cache(self.host, self.port, self.project)
+
+        patches = yield self.cache.get()
+
+        if not self.cache.accessible:
+            GPS.Console().write('Can\'t access Gerrit %s:%s\n' % (
+                self.host, self.port))
+            self.gerrit_accessible = False
+            return
 
         reviews = []
-        while True:
-            line = yield p.wait_line()
-            if line is None:
-                if reviews:
-                    visitor.branches(
-                        CAT_REVIEWS, 'vcs-gerrit-symbolic',
-                        not CAN_RENAME, reviews)
-                break
-
-            if line.startswith('Bad port'):
-                # Seems like Gerrit can't be accessed
-                GPS.Console().write('Can\'t access Gerrit %s:%s\n' % (
-                    self.host, self.port))
-                self.gerrit_accessible = False
-                break
-
-            patch = json.loads(line)
-            if patch and patch.get(u'subject', None) is not None:
-                review = '0'
-                workflow = ''
-                patchset = patch[u'currentPatchSet']
-                if patchset.get(u'approvals', None) is not None:
-                    for a in patchset[u'approvals']:
-                        if a[u'type'] == u'Workflow':
-                            workflow = '|%s' % a['value']
-                        elif a[u'type'] == u'Code-Review':
-                            review = a['value']
-
-                id = {'url': patch.get(u'url', ''),
-                      'number': patch.get(u'number', '')}
-
-                reviews.append(
-                    ('%s: %s' % (patchset[u'author'][u'username'],
-                                 patch[u'subject']),
-                     False,   # not active
-                     '%s%s' % (review, workflow),
-                     json.dumps(id)))
+        for patch in patches:
+            review = '0'
+            workflow = ''
+            patchset = patch[u'currentPatchSet']
+            if patchset.get(u'approvals', None) is not None:
+                for a in patchset[u'approvals']:
+                    if a[u'type'] == u'Workflow':
+                        workflow = '|%s' % a['value']
+                    elif a[u'type'] == u'Code-Review':
+                        review = a['value']
+
+            id = {'url': patch.get(u'url', ''),
+                  'number': patch.get(u'number', '')}
+
+            reviews.append(
+                ('%s: %s' % (patchset[u'author'][u'username'],
+                             patch[u'subject']),
+                 False,   # not active
+                 '%s%s' % (review, workflow),
+                 json.dumps(id)))
+
+        if reviews:
+            visitor.branches(
+                CAT_REVIEWS, 'vcs-gerrit-symbolic',
+                not CAN_RENAME, reviews)
 
     def async_action_on_branch(self, visitor, action, category, id, text=''):
         if not self.gerrit_accessible:
@@ -137,6 +252,8 @@ class Gerrit(core.Extension):
             spawn_console='')
         status, _ = yield p.wait_until_terminate()
         if status == 0:
+            if self.cache:
+                self.cache.invalidate()
             GPS.MDI.information_popup(
                 'Pushed to review', 'vcs-cloud-symbolic')
 
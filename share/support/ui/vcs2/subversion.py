@@ -2,6 +2,8 @@ from . import core, core_staging
 import GPS
 import re
 import os
+import time
+import workflows
 from workflows.promises import ProcessWrapper, join
 
 
@@ -10,6 +12,15 @@ CAT_TAGS = 'TAGS'
 
 CAN_RENAME = True
 
+Server_Check_Pref = GPS.Preference(":VCS/Svn-Server-Check-Interval")
+Server_Check_Pref.create(
+    "Subversion server check interval",
+    "integer",
+    "Minimal delay, in seconds, between two queries to the Subversion " +
+    "server to find the files that need an update. The status of the " +
+    "working copy is refreshed locally in between. Set to 0 to query the " +
+    "server on each refresh, or -1 to never query it.", 300, -1)
+
 
 @core.register_vcs(name='subversion',
                    default_status=GPS.VCS2.Status.UNTRACKED)
@@ -20,6 +31,19 @@ class SVN(core_staging.Emulate_Staging,
         '^(?P<status>....... .)\s+(?P<rev>\S+)\s+' +
         '(?P<lastcommit>\S+)\s+(?P<author>\S+)\s+(?P<file>.+)$')
 
+    # The output of "svn status -u -q" for files that need an update. The
+    # working revision is missing for files added on the server.
+    __re_out_of_date = re.compile(
+        r'^.{8}\*\s+(?:(?P<rev>\d+)\s+)?(?P<file>.+)$')
+
+    __re_head = re.compile(r'^Status against revision:\s+(?P<rev>\d+)')
+
+    def __init__(self, *args, **kwargs):
+        super(SVN, self).__init__(*args, **kwargs)
+        self._out_of_date = {}      # file -> revision on the server
+        self._last_server_check = None
+        self._checking_server = False
+
     @staticmethod
     def discover_working_dir(file):
         return core.find_admin_directory(file, '.svn')
@@ -41,14 +65,15 @@ class SVN(core_staging.Emulate_Staging,
     def _update(self):
         p = self._svn(['update'], spawn_console='')
         yield p.wait_until_terminate()
+        self._out_of_date = {}
+        self._last_server_check = None
 
     @core.run_in_background
     def _compute_status(self, all_files, args=[]):
         with self.set_status_for_all_files(all_files) as s:
             list = [self._relpath(arg) for arg in args]
-            p = self._svn(
-                # -u: Compare with server (slower but more helpful)
-                ['status', '-v', '-u'] + list)
+            # The server is queried separately, in _check_server
+            p = self._svn(['status', '-v'] + list)
 
             while True:
                 line = yield p.wait_line()
@@ -101,11 +126,73 @@ class SVN(core_staging.Emulate_Staging,
                     if line[6] == 'C':
                         status = status | GPS.VCS2.Status.CONFLICT
 
-                    if line[7] == '*':   # Only if we use -u
+                    if f in self._out_of_date:
                         status = status | GPS.VCS2.Status.NEEDS_UPDATE
+                        rrev = self._out_of_date[f]
 
                     s.set_status(GPS.File(f), status, rev, rrev)
 
+        self._check_server()
+
+    def async_fetch_status_for_all_files(self, from_user):
+        if from_user:
+            # An explicit refresh also queries the server
+            self._last_server_check = None
+        super(SVN, self).async_fetch_status_for_all_files(from_user)
+
+    @workflows.run_as_workflow
+    def _check_server(self):
+        """
+        Query the server for the files that need an update, unless it was
+        done recently, and update the status of the files that changed.
+        This does not mark the VCS as busy, so that the local status can be
+        refreshed while the server is slow to answer.
+        """
+        interval = Server_Check_Pref.get()
+        if (self._checking_server or
+                interval < 0 or
+                (self._last_server_check is not None and
+                 time.time() - self._last_server_check < interval)):
+            return
+
+        self._checking_server = True
+        self._last_server_check = time.time()
+        files = []
+        head = ''
+
+        p = self._svn(['status', '-u', '-q'])
+        status, output = yield p.wait_until_terminate()
+        self._checking_server = False
+        if status != 0:
+            # Keep the previous results, for instance when offline
+            return
+
+        for line in output.splitlines():
+            m = self.__re_out_of_date.search(line)
+            if m:
+                files.append(
+                    os.path.join(self.working_dir.path, m.group('file')))
+            else:
+                m = self.__re_head.search(line)
+                if m:
+                    head = m.group('rev')
+
+        out_of_date = dict.fromkeys(files, head)
+
+        # Only update the files whose state has changed
+        s = self.set_status_for_all_files()
+        for f in set(out_of_date).symmetric_difference(self._out_of_date):
+            file = GPS.File(f)
+            st, version, repo_version = self.get_file_status(file)
+            if f in out_of_date:
+                s.set_status(file, st | GPS.VCS2.Status.NEEDS_UPDATE,
+                             version, head)
+            else:
+                s.set_status(file, st & ~GPS.VCS2.Status.NEEDS_UPDATE,
+                             version, repo_version)
+        self._out_of_date = out_of_date
+        s.set_status_for_remaining_files()
+
     @core.run_in_background
     def async_commit_staged_files(self, visitor, message):
         for f in self._staged:
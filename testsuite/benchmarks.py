@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+The benchmark suite: run the benchmarks in the "benchmarks" directory,
+write their measures in a JSON file and compare them with a baseline.
+"""
+
+from drivers import benchmark
+from drivers.benchmark import BenchmarkDriver
+from testsuite import GPSPublicTestsuite
+import json
+import logging
+import os
+
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baseline.json')
+
+
+class GPSBenchmarkSuite(GPSPublicTestsuite):
+    TEST_SUBDIR = 'benchmarks'
+    DRIVERS = {'default': BenchmarkDriver}
+
+    def add_options(self):
+        super(GPSBenchmarkSuite, self).add_options()
+        self.main.argument_parser.add_argument(
+            "--baseline",
+            default=DEFAULT_BASELINE,
+            help="the file containing the reference measures")
+        self.main.argument_parser.add_argument(
+            "--update-baseline",
+            default=False,
+            action="store_true",
+            help="store the measures of this run in the baseline file")
+        self.main.argument_parser.add_argument(
+            "--tolerance",
+            default=0.2,
+            type=float,
+            help="how much a measure can exceed the baseline, as a ratio,"
+                 " unless the benchmark specifies its own tolerance")
+        self.main.argument_parser.add_argument(
+            "--results",
+            default="benchmarks.json",
+            help="the file in which the measures are written, relative to"
+                 " the output directory")
+
+    def tear_up(self):
+        super(GPSBenchmarkSuite, self).tear_up()
+        baseline = {}
+        if os.path.exists(self.main.args.baseline):
+            with open(self.main.args.baseline) as f:
+                baseline = json.load(f)
+        benchmark.settings['baseline'] = baseline
+        benchmark.settings['tolerance'] = self.main.args.tolerance
+
+    def tear_down(self):
+        results = os.path.join(self.output_dir, self.main.args.results)
+        with open(results, 'w') as f:
+            json.dump(benchmark.results, f, indent=2, sort_keys=True)
+        logging.info('Measures written in %s', results)
+
+        if self.main.args.update_baseline:
+            baseline = dict(benchmark.settings['baseline'])
+            baseline.update(benchmark.results)
+            with open(self.main.args.baseline, 'w') as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+            logging.info('Baseline updated in %s', self.main.args.baseline)
+
+        super(GPSBenchmarkSuite, self).tear_down()
+
+    @property
+    def default_driver(self):
+        return 'default'
@@ -0,0 +1,27 @@
+"""
+Measure the time needed to compute the completion of a prefix matching
+many entities.
+"""
+
+import time
+from GPS import *
+from gps_utils.internal.utils import *
+
+
+@run_test_driver
+def run_test():
+    buf = GPS.EditorBuffer.get(GPS.File("unit_0001.adb"))
+    yield wait_tasks()
+
+    # At the beginning of the body of the first subprogram
+    buf.insert(buf.at(7, 1), "      Unit_0002.Pro\n")
+    buf.current_view().goto(buf.at(7, 20))
+
+    start = time.time()
+    GPS.execute_action("Complete identifier (advanced)")
+    yield wait_tasks(other_than=known_tasks)
+    yield wait_idle()
+    record_metric("completion", time.time() - start)
+
+    send_key_event(GDK_ESCAPE)
+    buf.undo()
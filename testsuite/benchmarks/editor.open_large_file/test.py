@@ -0,0 +1,31 @@
+"""
+Measure the time needed to open a 28000 lines file, and to scroll to its
+end, which requires highlighting the lines that become visible.
+"""
+
+import time
+from GPS import *
+from gps_utils.internal.utils import *
+
+
+@run_test_driver
+def run_test():
+    start = time.time()
+    buf = GPS.EditorBuffer.get(GPS.File("unit_0000.adb"))
+    yield wait_idle()
+    record_metric("open", time.time() - start)
+
+    start = time.time()
+    view = buf.current_view()
+    view.goto(buf.end_of_buffer())
+    view.center()
+    yield wait_idle()
+    record_metric("scroll_to_end", time.time() - start)
+
+    start = time.time()
+    buf.insert(buf.at(10, 1), "      X := X + 1;\n")
+    yield wait_idle()
+    record_metric("edit", time.time() - start)
+
+    record_peak_memory()
+    buf.undo()
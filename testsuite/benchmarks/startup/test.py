@@ -0,0 +1,17 @@
+"""
+Measure the time needed to start GPS on a project with 200 units, until
+the gps_started hook is run, and the memory used at that point.
+"""
+
+import os
+import time
+from GPS import *
+from gps_utils.internal.utils import *
+
+
+@run_test_driver
+def run_test():
+    # run_test_driver waits for 10ms after gps_started
+    record_metric("startup",
+                  time.time() - float(os.environ["GPS_BENCHMARK_START"]))
+    record_peak_memory()
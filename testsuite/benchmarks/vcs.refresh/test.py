@@ -0,0 +1,21 @@
+"""
+Measure the time needed to compute the VCS status of all the files of a
+project with 1000 source files in a git repository.
+"""
+
+import time
+from GPS import *
+from gps_utils.internal.utils import *
+
+
+@run_test_driver
+def run_test():
+    yield wait_tasks()
+    vcs = GPS.VCS2.active_vcs()
+    gps_assert(vcs is not None, True, "git should be the active VCS")
+
+    start = time.time()
+    vcs.invalidate_status_cache()
+    vcs.ensure_status_for_all_source_files()
+    yield wait_tasks()
+    record_metric("refresh", time.time() - start)
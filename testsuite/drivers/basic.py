@@ -15,6 +15,31 @@ PREFS = """<?xml version="1.0"?>
 </GPS>
 """
 
+TIMEOUT = 120  # The maximum duration of a test, in seconds
+
+
+def create_gps_home(gps_home):
+    """Create a GPS home directory suitable for running the tests"""
+    mkdir(gps_home)
+    mkdir(os.path.join(gps_home, 'plug-ins'))
+    mkdir(os.path.join(gps_home, 'log_files'))
+    echo_to_file(os.path.join(gps_home, 'preferences.xml'), PREFS)
+    echo_to_file(os.path.join(gps_home, "gnatinspect_traces.cfg"),
+                 ">gnatinspect.log\n")
+
+
+def gps_executable():
+    """Return the GPS to run"""
+    # In the development environment, run the development GPS,
+    # otherwise use the GPS found on the PATH
+    base = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                        "..", ".."))
+    devel_gps = os.path.join(base, "gps", "obj", "gps")
+    if os.path.exists(devel_gps):
+        return devel_gps
+    else:
+        return "gps"
+
 
 class BasicTestDriver(GPSTestDriver):
     """ Each test should have:
@@ -37,12 +62,7 @@ class BasicTestDriver(GPSTestDriver):
 
         # Create .gps
         self.gps_home = os.path.join(self.test_env['working_dir'], '.gps')
-        mkdir(self.gps_home)
-        mkdir(os.path.join(self.gps_home, 'plug-ins'))
-        mkdir(os.path.join(self.gps_home, 'log_files'))
-        echo_to_file(os.path.join(self.gps_home, 'preferences.xml'), PREFS)
-        echo_to_file(os.path.join(self.gps_home, "gnatinspect_traces.cfg"),
-                     ">gnatinspect.log\n")
+        create_gps_home(self.gps_home)
 
     def run(self, previous_values):
         # Check whether the test should be skipped
@@ -54,34 +74,38 @@ class BasicTestDriver(GPSTestDriver):
 
         # If there's a test.cmd, execute it with the shell;
         # otherwise execute test.py.
-        wd = self.test_env['working_dir']
-        base = os.path.abspath(os.path.join(os.path.dirname(__file__),
-                                            "..", ".."))
-
-        # In the development environment, run the development GPS,
-        # otherwise use the GPS found on the PATH
-        devel_gps = os.path.join(base, "gps", "obj", "gps")
-        if os.path.exists(devel_gps):
-            the_gps = devel_gps
-        else:
-            the_gps = "gps"
+        process = self.run_gps()
+        self.set_result(process.status, process.out)
+
+    def run_gps(self, args=[], env={}):
+        """Run GPS on test.py in the working directory, and return the
+           process.
+
+           :param list args: additional arguments for GPS
+           :param dict env: additional environment variables
+        """
+        gps_env = {'GPS_HOME': self.gps_home}
+        gps_env.update(env)
 
         # TODO: add support for valgrind
-        process = Run(
-            [the_gps, "--load={}".format('test.py')],
-            cwd=wd,
-            timeout=None if 'GPS_PREVENT_EXIT' in os.environ else 120,
-            env={'GPS_HOME': self.gps_home},
+        return Run(
+            [gps_executable(), "--load={}".format('test.py')] + args,
+            cwd=self.test_env['working_dir'],
+            timeout=None if 'GPS_PREVENT_EXIT' in os.environ else TIMEOUT,
+            env=gps_env,
             ignore_environ=False)
-        output = process.out
 
+    def set_result(self, status, output):
+        """Set and push the result of the test, given the exit status of
+           GPS and its output.
+        """
         if output:
             # If there's an output, capture it
             self.result.out = output
 
-        if process.status:
+        if status:
             # Nonzero status?
-            if process.status == 100:
+            if status == 100:
                 # This one is an xfail
                 self.result.set_status(TestStatus.XFAIL)
             else:
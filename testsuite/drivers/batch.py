@@ -0,0 +1,183 @@
+"""
+A driver which runs the tests in long-lived GPS instances, instead of
+starting a new GPS for each test. See gps_utils/internal/batch.py for the
+GPS side of the protocol.
+
+Each worker of the testsuite takes an idle GPS instance from a pool (or
+starts a new one), sends it the test to run, and gives it back to the
+pool at the end of the test. If GPS exits, crashes or times out during a
+test, the instance is killed and the test is run again in a fresh GPS
+process, as done by BasicTestDriver.
+
+Tests which cannot run in a shared instance can opt out by adding
+    batch: false
+to their test.yaml.
+"""
+
+from drivers.basic import (BasicTestDriver, TIMEOUT, create_gps_home,
+                           gps_executable)
+import json
+import os
+import Queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+LOADER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'batch_loader.py')
+# The script loaded in GPS to start the batch runner
+
+STARTUP_TIMEOUT = 120  # In seconds
+
+READY = "@@batch ready@@"
+BEGIN_RE = re.compile(r'@@batch begin (\d+)@@')
+END_RE = re.compile(r'@@batch end (\d+) (\d+)@@')
+# These must match the markers in gps_utils/internal/batch.py
+
+
+class GPSInstance(object):
+    """A GPS process running the batch runner"""
+
+    def __init__(self):
+        self.home = tempfile.mkdtemp(prefix='gps_batch')
+        self.gps_home = os.path.join(self.home, '.gps')
+        create_gps_home(self.gps_home)
+        self.next_id = 0
+
+        env = dict(os.environ)
+        env['GPS_HOME'] = self.gps_home
+        self.process = subprocess.Popen(
+            [gps_executable(), '--load={}'.format(LOADER)],
+            cwd=self.home,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+
+        # The output of GPS is read in a separate thread, so that we can
+        # wait for it with a timeout
+        self.lines = Queue.Queue()
+        reader = threading.Thread(target=self._read_output)
+        reader.daemon = True
+        reader.start()
+
+        self.ready = self._wait_for_ready()
+
+    def _read_output(self):
+        for line in iter(self.process.stdout.readline, ''):
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def _next_line(self, deadline):
+        """Return the next line of output, or None if GPS has exited or
+           the deadline has expired.
+        """
+        try:
+            return self.lines.get(timeout=max(0, deadline - time.time()))
+        except Queue.Empty:
+            return None
+
+    def _wait_for_ready(self):
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            line = self._next_line(deadline)
+            if line is None:
+                self.kill()
+                return False
+            if READY in line:
+                return True
+
+    def run_test(self, directory, timeout):
+        """Run the test in directory.
+           Return a tuple (status, output). status is None if GPS has
+           exited or has not completed the test in time.
+        """
+        self.next_id += 1
+        try:
+            self.process.stdin.write(
+                json.dumps({'id': self.next_id, 'dir': directory}) + '\n')
+            self.process.stdin.flush()
+        except IOError:
+            return None, ''
+
+        deadline = time.time() + timeout
+        output = []
+        running = False
+
+        while True:
+            line = self._next_line(deadline)
+            if line is None:
+                return None, ''.join(output)
+
+            m = END_RE.search(line)
+            if m and int(m.group(1)) == self.next_id:
+                return int(m.group(2)), ''.join(output)
+
+            m = BEGIN_RE.search(line)
+            if m and int(m.group(1)) == self.next_id:
+                running = True
+            elif running:
+                output.append(line)
+
+    def close(self):
+        """Stop GPS, which exits when its input is closed"""
+        try:
+            self.process.stdin.close()
+            self.process.wait()
+        except (IOError, OSError):
+            pass
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+        shutil.rmtree(self.home, ignore_errors=True)
+
+
+_idle = Queue.Queue()
+# The GPS instances that are not running a test
+
+
+def shutdown():
+    """Stop all the GPS instances"""
+    while True:
+        try:
+            _idle.get_nowait().close()
+        except Queue.Empty:
+            return
+
+
+class BatchTestDriver(BasicTestDriver):
+    """Same as BasicTestDriver, but run the test in a shared GPS instance
+       when possible.
+    """
+
+    def run(self, previous_values):
+        if (self.should_skip() is not None or
+                not self.test_env.get('batch', True) or
+                'GPS_PREVENT_EXIT' in os.environ):
+            return BasicTestDriver.run(self, previous_values)
+
+        try:
+            instance = _idle.get_nowait()
+        except Queue.Empty:
+            instance = GPSInstance()
+
+        status = None
+        if instance.ready:
+            status, output = instance.run_test(
+                os.path.abspath(self.test_env['working_dir']), TIMEOUT)
+
+        if status is None:
+            # GPS has exited or crashed: run the test in its own process
+            instance.kill()
+            return BasicTestDriver.run(self, previous_values)
+
+        _idle.put(instance)
+        self.set_result(status, output)
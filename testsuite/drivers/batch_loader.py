@@ -0,0 +1,5 @@
+"""
+Loaded with --load by the batch driver, to start the batch runner in GPS.
+"""
+
+import gps_utils.internal.batch
@@ -0,0 +1,128 @@
+"""
+The driver for the benchmarks, in the "benchmarks" directory.
+
+A benchmark is a test which records its measures with
+gps_utils.internal.utils.record_metric. In addition to the keys supported
+by BasicTestDriver, its test.yaml can contain:
+
+- project: the parameters given to synthetic.generate_project to create
+  a project in the working directory, which is then loaded by GPS.
+  For instance:
+      project: {units: 200, subprograms: 20, git: true}
+
+- repeat: how many times GPS should be run. The lowest value of each
+  measure is kept. The default is 1.
+
+- tolerance: how much each measure can exceed the baseline, as a ratio
+  (0.2 means 20%). The default is given on the command line.
+
+- tolerances: a dict giving the tolerance for specific measures.
+
+Each run also records "wall_time", the time from the launch of GPS to its
+exit.
+"""
+
+from drivers import synthetic
+from drivers.basic import BasicTestDriver
+from e3.testsuite.result import TestStatus
+import json
+import os
+import time
+
+settings = {'baseline': {}, 'tolerance': 0.2}
+# Set by the benchmark testsuite before running the tests. 'baseline' is a
+# dict indexed by test names, whose values are dicts giving the expected
+# value of each measure.
+
+results = {}
+# The measures of each test, indexed by test name
+
+
+def read_metrics(filename):
+    """Return the measures found in filename, as a dict"""
+    metrics = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                m = json.loads(line)
+                metrics[m['name']] = m['value']
+    return metrics
+
+
+def compare(metrics, baseline, tolerance, tolerances):
+    """Compare metrics with baseline. Return a list of lines describing
+       each measure, and whether any of them exceeds its tolerance.
+    """
+    report = []
+    regressed = False
+    for name in sorted(metrics):
+        value = metrics[name]
+        expected = baseline.get(name)
+        tol = tolerances.get(name, tolerance)
+        if expected is None:
+            report.append("{}: {:.3f} (no baseline)".format(name, value))
+        else:
+            ratio = float(value) / expected if expected else 1.0
+            status = "ok"
+            if value > expected * (1 + tol):
+                status = "REGRESSION"
+                regressed = True
+            report.append("{}: {:.3f} (baseline {:.3f}, {:+.1%}, "
+                          "tolerance {:.0%}) {}".format(
+                              name, value, expected, ratio - 1, tol, status))
+    return report, regressed
+
+
+class BenchmarkDriver(BasicTestDriver):
+
+    def prepare(self, previous_values):
+        BasicTestDriver.prepare(self, previous_values)
+        self.project = None
+        if 'project' in self.test_env:
+            self.project = synthetic.generate_project(
+                self.test_env['working_dir'], **self.test_env['project'])
+
+    def run(self, previous_values):
+        skip = self.should_skip()
+        if skip is not None:
+            self.result.set_status(skip)
+            self.push_result()
+            return False
+
+        name = self.test_env['test_name']
+        metrics_file = os.path.join(self.test_env['working_dir'],
+                                    'metrics.out')
+        args = ['-P', self.project] if self.project else []
+        metrics = {}
+
+        for _ in range(self.test_env.get('repeat', 1)):
+            if os.path.exists(metrics_file):
+                os.remove(metrics_file)
+
+            start = time.time()
+            process = self.run_gps(
+                args, env={'GPS_BENCHMARK_START': repr(start)})
+            wall_time = time.time() - start
+
+            if process.status or process.out:
+                # The benchmark has failed
+                self.set_result(process.status, process.out)
+                return
+
+            run = read_metrics(metrics_file)
+            run['wall_time'] = wall_time
+            for m, value in run.items():
+                metrics[m] = min(value, metrics.get(m, value))
+
+        results[name] = metrics
+
+        report, regressed = compare(
+            metrics,
+            settings['baseline'].get(name, {}),
+            self.test_env.get('tolerance', settings['tolerance']),
+            self.test_env.get('tolerances', {}))
+
+        self.result.out = "\n".join(report)
+        self.result.set_status(
+            TestStatus.FAIL if regressed else TestStatus.PASS)
+        self.push_result()
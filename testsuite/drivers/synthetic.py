@@ -0,0 +1,107 @@
+"""
+Generate synthetic Ada projects for the benchmarks.
+
+The generated projects are deterministic, so that timings can be compared
+across runs. They contain a main procedure and a number of packages, each
+declaring a number of subprograms that call each other, so that the
+cross-references and the completion have some work to do.
+"""
+
+import os
+import subprocess
+
+PROJECT = """project Bench is
+   for Source_Dirs use ("src");
+   for Object_Dir use "obj";
+   for Main use ("main.adb");
+end Bench;
+"""
+
+
+def _unit_name(unit):
+    return "Unit_{:04d}".format(unit)
+
+
+def _spec(unit, subprograms):
+    name = _unit_name(unit)
+    lines = ["package {} is".format(name)]
+    for s in range(subprograms):
+        lines.append("   procedure Proc_{}_{} (X : in out Integer);"
+                     .format(unit, s))
+    lines.append("end {};".format(name))
+    return "\n".join(lines) + "\n"
+
+
+def _body(unit, subprograms, units):
+    name = _unit_name(unit)
+    lines = []
+    if unit + 1 < units:
+        lines.append("with {};".format(_unit_name(unit + 1)))
+    lines.append("package body {} is".format(name))
+    for s in range(subprograms):
+        lines.extend([
+            "",
+            "   procedure Proc_{}_{} (X : in out Integer) is".format(unit, s),
+            "      Local_Value : Integer := X * {};".format(s + 1),
+            "   begin",
+            "      for J in 1 .. 10 loop",
+            "         if Local_Value mod 2 = 0 then",
+            "            Local_Value := Local_Value / 2;",
+            "         else",
+            "            Local_Value := Local_Value * 3 + 1;",
+            "         end if;",
+            "      end loop;",
+            "      X := Local_Value;  --  a comment with \"a string\""])
+        if unit + 1 < units:
+            lines.append("      {}.Proc_{}_{} (X);".format(
+                _unit_name(unit + 1), unit + 1, s))
+        lines.append("   end Proc_{}_{};".format(unit, s))
+    lines.append("")
+    lines.append("end {};".format(name))
+    return "\n".join(lines) + "\n"
+
+
+def _main():
+    return ("with {0};\n"
+            "procedure Main is\n"
+            "   X : Integer := 1;\n"
+            "begin\n"
+            "   {0}.Proc_0_0 (X);\n"
+            "end Main;\n").format(_unit_name(0))
+
+
+def generate_project(directory, units=10, subprograms=10, git=False):
+    """Generate a project in directory, and return the name of its
+       project file.
+
+       :param int units: the number of packages
+       :param int subprograms: the number of subprograms in each package.
+          Each subprogram takes 14 lines in the body.
+       :param bool git: whether to create a git repository for the project,
+          with all the files committed and one of them modified
+    """
+    src = os.path.join(directory, "src")
+    if not os.path.isdir(src):
+        os.makedirs(src)
+
+    files = {"bench.gpr": PROJECT,
+             os.path.join("src", "main.adb"): _main()}
+    for unit in range(units):
+        base = os.path.join("src", _unit_name(unit).lower())
+        files[base + ".ads"] = _spec(unit, subprograms)
+        files[base + ".adb"] = _body(unit, subprograms, units)
+
+    for name, contents in files.items():
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(contents)
+
+    if git:
+        for args in (["init", "-q"],
+                     ["add", "bench.gpr", "src"],
+                     ["-c", "user.name=bench", "-c", "user.email=bench@bench",
+                      "commit", "-q", "-m", "initial"]):
+            subprocess.check_call(["git"] + args, cwd=directory)
+        with open(os.path.join(directory, "src", "main.adb"), "a") as f:
+            f.write("--  modified\n")
+
+    return os.path.join(directory, "bench.gpr")
@@ -0,0 +1,4 @@
+procedure Foo is
+begin
+   null;
+end Foo;
@@ -0,0 +1,133 @@
+"""
+Add many revisions of a file to its local history, and check that they
+can be read back. Record the time needed to add the revisions, and check
+that it is faster than checking them in with RCS, when RCS is available.
+Also check that an existing RCS archive is imported.
+"""
+
+import os
+import time
+import distutils.spawn
+from GPS import *
+from gps_utils.internal.utils import *
+
+NB_REVISIONS = 100
+
+RCS_ARCHIVE = """head\t1.2;
+access;
+symbols;
+locks; strict;
+comment\t@-- @;
+
+
+1.2
+date\t2018.05.04.10.10.00;\tauthor gps;\tstate Exp;
+branches;
+next\t1.1;
+
+1.1
+date\t2018.05.04.10.00.00;\tauthor gps;\tstate Exp;
+branches;
+next\t;
+
+
+desc
+@@
+
+
+1.2
+log
+@.
+@
+text
+@procedure Bar is
+begin
+   null;
+end Bar;
+@
+
+
+1.1
+log
+@.
+@
+text
+@d3 1
+a3 1
+   return;
+@
+"""
+
+
+def contents(rev):
+    return "procedure Foo is\nbegin\n   null; -- %d\nend Foo;\n" % rev
+
+
+def time_rcs(rcs_dir, name):
+    """The time needed to check in NB_REVISIONS revisions with RCS"""
+    start = time.time()
+    for rev in range(NB_REVISIONS):
+        with open(os.path.join(rcs_dir, name), "w") as f:
+            f.write(contents(rev))
+        if rev > 0:
+            Process("rcs -q -l %s,v" % name, directory=rcs_dir).wait()
+        proc = Process("ci -q %s" % name, directory=rcs_dir)
+        proc.send(".\n")
+        proc.wait()
+    return time.time() - start
+
+
+@run_test_driver
+def run_test():
+    local_history = load_python_startup_script("local_history")
+
+    hist = local_history.LocalHistory(File("foo.adb"))
+    start = time.time()
+    for rev in range(NB_REVISIONS):
+        with open("foo.adb", "w") as f:
+            f.write(contents(rev))
+        hist.add_to_history()
+    elapsed = time.time() - start
+    record_time(elapsed)
+
+    revisions = hist.get_revisions()
+    gps_assert(len(revisions), NB_REVISIONS,
+               "All revisions should be in the local history")
+    gps_assert(revisions[0][0], NB_REVISIONS,
+               "The most recent revision should be listed first")
+    gps_assert(hist.get_contents("1"), contents(0),
+               "Wrong contents for the first revision")
+
+    hist.add_to_history()
+    gps_assert(len(hist.get_revisions()), NB_REVISIONS,
+               "Saving unchanged contents should not create a revision")
+
+    hist.store.truncate(hist.name, NB_REVISIONS - 10)
+    gps_assert([r[0] for r in hist.get_revisions()],
+               range(NB_REVISIONS, NB_REVISIONS - 10, -1),
+               "Wrong revisions after truncating the history")
+
+    # Import of an RCS archive created by previous versions
+
+    with open(os.path.join(hist.rcs_dir, "bar.adb,v"), "w") as f:
+        f.write(RCS_ARCHIVE)
+    with open("bar.adb", "w") as f:
+        f.write("")
+
+    bar = local_history.LocalHistory(File("bar.adb"))
+    gps_assert(bar.get_revisions(),
+               [(2, "2018.05.04.10.10.00"), (1, "2018.05.04.10.00.00")],
+               "The RCS archive was not imported")
+    gps_assert(bar.get_contents("1"),
+               "procedure Bar is\nbegin\n   return;\nend Bar;\n",
+               "Wrong contents for an imported revision")
+    gps_assert(os.path.exists(bar.rcs_file), False,
+               "The RCS archive should have been renamed")
+
+    if distutils.spawn.find_executable("ci"):
+        rcs_dir = os.path.abspath("rcs")
+        os.mkdir(rcs_dir)
+        rcs_elapsed = time_rcs(rcs_dir, "foo.adb")
+        gps_assert(elapsed < rcs_elapsed, True,
+                   "Local history (%ss) should be faster than RCS (%ss)"
+                   % (elapsed, rcs_elapsed))
@@ -0,0 +1,2 @@
+install:
+	echo install
@@ -0,0 +1,31 @@
+"""
+Check that the targets of a Makefile include those of the files it
+includes, and that they are read again in the background when an included
+file changes.
+"""
+
+import os
+import time
+from GPS import *
+from gps_utils.internal.utils import *
+
+
+def targets():
+    return [t[0] for t in GPS.Hook("compute_build_targets").run("make")]
+
+
+@run_test_driver
+def run_test():
+    gps_assert(targets(), ["all", "build", "install"],
+               "wrong targets for the Makefile")
+
+    with open(os.path.join("mk", "common.mk"), "a") as f:
+        f.write("\nuninstall:\n\techo uninstall\n")
+    future = time.time() + 10
+    os.utime(os.path.join("mk", "common.mk"), (future, future))
+
+    gps_assert(targets(), ["all", "build", "install"],
+               "the cached targets should be used while reading the files")
+    yield wait_tasks()
+    gps_assert(targets(), ["all", "build", "install", "uninstall"],
+               "the targets should be updated after the background scan")
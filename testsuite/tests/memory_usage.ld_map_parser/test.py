@@ -0,0 +1,68 @@
+"""
+Parse a large synthetic ld map file, check the regions, sections and
+modules found, and record the time needed for the initial parsing.
+Parsing it again should reuse the cached result.
+"""
+
+import os
+import time
+from GPS import *
+from gps_utils.internal.utils import *
+from memory_usage_providers import ld_map
+
+NB_SECTIONS = 200
+NB_MODULES = 500
+
+
+def generate_map_file(name):
+    with open(name, "w") as f:
+        f.write("Memory Configuration\n\n"
+                "Name             Origin             Length             "
+                "Attributes\n"
+                "flash            0x08000000         0x00100000         xr\n"
+                "sram             0x20000000         0x00020000         xrw\n"
+                "*default*        0x00000000         0xffffffff\n\n"
+                "Linker script and memory map\n\n")
+        addr = 0x08000000
+        for s in range(NB_SECTIONS):
+            if s % 2:
+                f.write(".data.s%d       0x%08x     0x1000\n"
+                        % (s, 0x20000000 + s * 16))
+            else:
+                f.write(".debug_info.s%d 0x%08x     0x1000\n"
+                        % (s, s * 16))
+            for m in range(NB_MODULES):
+                f.write(" .text.f%d      0x%08x       0x4 obj/unit%d.o\n"
+                        "                0x%08x                sym_%d\n"
+                        % (m, addr, m % 100, addr, m))
+                addr += 4
+
+
+@run_test_driver
+def run_test():
+    name = os.path.abspath("map.txt")
+    generate_map_file(name)
+
+    start = time.time()
+    regions, sections, modules, symbols = ld_map.parse_map_file(
+        name, with_symbols=True)
+    elapsed = time.time() - start
+
+    gps_assert(regions, [("flash", "0x08000000", 0x100000),
+                         ("sram", "0x20000000", 0x20000)],
+               "wrong regions")
+    gps_assert(len(sections), NB_SECTIONS / 2,
+               "debug sections should be ignored")
+    gps_assert(set(s[3] for s in sections), set(["sram"]),
+               "sections should all be in sram")
+    gps_assert(len(modules), NB_SECTIONS / 2 * 100,
+               "wrong number of modules")
+    gps_assert(sum(m[3] for m in modules), NB_SECTIONS / 2 * NB_MODULES * 4,
+               "wrong size for the modules")
+    gps_assert(len(symbols), NB_SECTIONS / 2 * NB_MODULES,
+               "wrong number of symbols")
+
+    gps_assert(ld_map.get_cached(name, with_symbols=True)[0], regions,
+               "the map file should be cached")
+
+    record_time(elapsed)
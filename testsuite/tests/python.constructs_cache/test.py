@@ -0,0 +1,56 @@
+"""
+Check that the incremental parsing of python constructs gives the same
+result as a full parse, and record the time needed to parse a large module
+(clang's cindex.py) from scratch, from the cache and after editing the body
+of a single function.
+"""
+
+import ast
+import os
+import time
+from GPS import *
+from gps_utils.internal.utils import *
+import python_support
+
+
+def full_parse(text):
+    recorder = python_support.ConstructsRecorder()
+    tree = ast.parse(text)
+    tree.lineno = 0
+    python_support.ASTVisitor(text, recorder).visit(tree)
+    return recorder.constructs
+
+
+def incremental_parse(lang, text):
+    recorder = python_support.ConstructsRecorder()
+    start = time.time()
+    lang.parse_constructs(recorder, None, text)
+    return recorder.constructs, time.time() - start
+
+
+@run_test_driver
+def run_test():
+    with open(os.path.join(GPS.get_system_dir(), "share", "gps", "support",
+                           "core", "clang", "cindex.py")) as f:
+        text = f.read()
+
+    edited = text.replace(
+        "        return CursorKind.from_id(self._kind_id)\n",
+        "        kind = CursorKind.from_id(self._kind_id)\n"
+        "        return kind\n", 1)
+    gps_assert(edited != text, True, "cindex.py was not edited")
+
+    lang = python_support.PythonLanguage()
+    times = []
+    for label, content in (("cold", text),
+                           ("cached", text),
+                           ("one body edited", edited),
+                           ("line inserted at top", "import os\n" + edited)):
+        constructs, elapsed = incremental_parse(lang, content)
+        times.append(elapsed)
+        gps_assert(constructs, full_parse(content),
+                   "wrong constructs when parsing %s" % label)
+
+    gps_assert(times[1] < times[0], True,
+               "cached parse should be faster than the initial one")
+    record_time(sum(times))
@@ -0,0 +1,31 @@
+"""
+Check that the VOB containing a directory is found from the output of
+"cleartool lsvob", using the innermost VOB when they are nested.
+"""
+
+from GPS import *
+from gps_utils.internal.utils import *
+from vcs2.clearcase import VOB_Index
+
+LSVOB = """* /vobs/main /net/srv/vobstore/main.vbs public
+  /vobs/other /net/srv/vobstore/other.vbs private
+* /vobs/main/nested /net/srv/vobstore/nested.vbs public
+"""
+
+
+@run_test_driver
+def run_test():
+    index = VOB_Index.from_lsvob(LSVOB)
+    gps_assert(index.find("/net/srv/vobstore/vobs/main/src"),
+               "/net/srv/vobstore/vobs/main",
+               "wrong VOB for a directory in main")
+    gps_assert(index.find("/net/srv/vobstore/vobs/main/nested/src"),
+               "/net/srv/vobstore/vobs/main/nested",
+               "the innermost VOB should be used")
+    gps_assert(index.find("/net/srv/vobstore/vobs/other"),
+               "/net/srv/vobstore/vobs/other",
+               "the root of a VOB belongs to the VOB")
+    gps_assert(index.find("/net/srv/vobstore/vobs/mainly"), "",
+               "only full path components should match")
+    gps_assert(VOB_Index().find("/any/dir"), "",
+               "no VOB should be found in an empty index")
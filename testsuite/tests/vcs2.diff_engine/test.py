@@ -0,0 +1,94 @@
+"""
+Compare two large synthetic files with the default diff engine and with
+difflib, check that both produce an edit script of the same size, and
+record the time needed by the default engine. Also check that comparing
+two large files with little in common remains fast.
+"""
+
+import random
+import time
+from GPS import *
+from gps_utils.internal.utils import *
+from vcs2 import diff
+
+NB_LINES = 50000
+NB_CHANGES = 500
+NB_DISSIMILAR_LINES = 20000
+MAX_DISSIMILAR_TIME = 5.0   # In seconds
+
+
+def generate_files():
+    rand = random.Random(1)
+    left = ["   Line_%d := %d;\n" % (n, rand.randint(0, 1000))
+            for n in range(NB_LINES)]
+    right = list(left)
+    for n in range(NB_CHANGES):
+        pos = rand.randint(0, len(right) - 1)
+        kind = n % 3
+        if kind == 0:
+            del right[pos]
+        elif kind == 1:
+            right.insert(pos, "   --  inserted %d\n" % n)
+        else:
+            right[pos] = "   Changed_%d := 0;\n" % n
+    return left, right
+
+
+def generate_dissimilar_files():
+    """Two files made of the same few lines, in a different order"""
+    rand = random.Random(2)
+    pool = ["end;\n", "\n", "begin\n", "   null;\n", "   return;\n"] + \
+        ["   X_%d := X_%d + 1;\n" % (n, n) for n in range(50)]
+    return ([rand.choice(pool) for n in range(NB_DISSIMILAR_LINES)],
+            [rand.choice(pool) for n in range(NB_DISSIMILAR_LINES)])
+
+
+def changed_lines(opcodes):
+    return sum(i2 - i1 + j2 - j1
+               for tag, i1, i2, j1, j2 in opcodes if tag != "equal")
+
+
+def apply_opcodes(left, right, opcodes):
+    result = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            result.extend(left[i1:i2])
+        else:
+            result.extend(right[j1:j2])
+    return result
+
+
+@run_test_driver
+def run_test():
+    left, right = generate_files()
+
+    start = time.time()
+    opcodes = diff.myers_opcodes(left, right)
+    elapsed = time.time() - start
+
+    start = time.time()
+    reference = diff.difflib_opcodes(left, right)
+    elapsed_difflib = time.time() - start
+
+    gps_assert(apply_opcodes(left, right, opcodes), right,
+               "the edit script should transform left into right")
+    gps_assert(changed_lines(opcodes) <= changed_lines(reference), True,
+               "the edit script should not be longer than difflib's")
+    gps_assert(diff.normal_diff(left, left), [],
+               "identical files should have no differences")
+    gps_assert(diff.normal_diff(["a\n", "b\n"], ["a\n", "c\n", "d\n"]),
+               ["2c2,3\n", "< b\n", "> c\n", "> d\n"],
+               "wrong output for a simple change")
+
+    left, right = generate_dissimilar_files()
+    start = time.time()
+    opcodes = diff.myers_opcodes(left, right)
+    elapsed_dissimilar = time.time() - start
+    gps_assert(apply_opcodes(left, right, opcodes), right,
+               "the edit script of dissimilar files is wrong")
+    gps_assert(elapsed_dissimilar < MAX_DISSIMILAR_TIME, True,
+               "comparing dissimilar files took %fs" % elapsed_dissimilar)
+
+    GPS.Console().write("myers: %fs, difflib: %fs, dissimilar: %fs\n"
+                        % (elapsed, elapsed_difflib, elapsed_dissimilar))
+    record_time(elapsed)
@@ -0,0 +1,19 @@
+"""
+Replace "ssh host gerrit": log the arguments in calls.txt, and output the
+changes found in changes.json, as done by "gerrit query --format=json".
+"""
+
+import json
+import sys
+
+with open("calls.txt", "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\n")
+
+with open("changes.json") as f:
+    changes = json.load(f)
+
+incremental = any(arg.startswith("-age:") for arg in sys.argv)
+for c in changes:
+    if incremental or c["open"]:
+        print(json.dumps(c))
+print(json.dumps({"type": "stats", "rowCount": len(changes)}))
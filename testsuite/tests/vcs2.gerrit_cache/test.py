@@ -0,0 +1,78 @@
+"""
+Check that the reviews fetched from Gerrit are cached: concurrent requests
+share a single query, the reviews are reused until the cache expires, and
+then only the changes updated since the last query are fetched.
+"""
+
+import json
+import os
+from GPS import *
+from gps_utils.internal.utils import *
+from vcs2 import gerrit
+
+
+def change(number, subject, updated, open=True):
+    return {"number": str(number),
+            "subject": subject,
+            "url": "http://gerrit/%d" % number,
+            "lastUpdated": updated,
+            "open": open,
+            "currentPatchSet": {"author": {"username": "user"}}}
+
+
+def set_changes(changes):
+    with open("changes.json", "w") as f:
+        json.dump(changes, f)
+
+
+def queries():
+    if not os.path.exists("calls.txt"):
+        return []
+    with open("calls.txt") as f:
+        return f.read().splitlines()
+
+
+def subjects(reviews):
+    return [r["subject"] for r in reviews]
+
+
+@run_test_driver
+def run_test():
+    set_changes([change(1, "first", 100),
+                 change(2, "second", 200),
+                 change(3, "closed", 300, open=False)])
+
+    cache = gerrit.ReviewCache(
+        ["python", os.path.abspath("fake_gerrit.py")], "project", 3600)
+
+    # Concurrent requests share the same query
+    p1 = cache.get()
+    p2 = cache.get()
+    reviews = yield p1
+    reviews2 = yield p2
+    gps_assert(subjects(reviews), ["second", "first"],
+               "wrong reviews after the first query")
+    gps_assert(subjects(reviews2), ["second", "first"],
+               "concurrent requests should get the same reviews")
+    gps_assert(len(queries()), 1, "concurrent requests should be coalesced")
+    gps_assert("status:open" in queries()[0], True,
+               "the first query should fetch all open changes")
+
+    # The reviews are reused until the cache expires
+    reviews = yield cache.get()
+    gps_assert(subjects(reviews), ["second", "first"],
+               "wrong reviews from the cache")
+    gps_assert(len(queries()), 1, "the cache should have been used")
+
+    # After expiration, only the changes updated recently are fetched
+    set_changes([change(1, "first", 400, open=False),
+                 change(4, "new", 500)])
+    cache.invalidate()
+    reviews = yield cache.get()
+    gps_assert(subjects(reviews), ["new", "second"],
+               "wrong reviews after the incremental query")
+    gps_assert(len(queries()), 2, "the expired cache should be refreshed")
+    gps_assert("-age:" in queries()[1], True,
+               "the second query should be incremental")
+    gps_assert("status:open" in queries()[1], False,
+               "the incremental query should also fetch closed changes")
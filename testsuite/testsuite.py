@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 from drivers.basic import BasicTestDriver
+from drivers import batch
 from e3.fs import ls
 from e3.testsuite import Testsuite
 from e3.os.process import Run, STDOUT
@@ -47,7 +48,8 @@ class Xvfb(object):
 
 class GPSPublicTestsuite(Testsuite):
     TEST_SUBDIR = 'tests'
-    DRIVERS = {'default': BasicTestDriver}
+    DRIVERS = {'default': BasicTestDriver,
+               'batch': batch.BatchTestDriver}
 
     def add_options(self):
         self.main.argument_parser.add_argument(
@@ -60,6 +62,12 @@ class GPSPublicTestsuite(Testsuite):
             default="",
             action="store",
             help="Ignored, here for compatibility purposes")
+        self.main.argument_parser.add_argument(
+            "--batch",
+            default=False,
+            action="store_true",
+            help="run the tests in a few long-lived GPS instances, instead"
+                 " of starting GPS for each test")
 
     def tear_up(self):
         # Set a gnatdebug common to all tests
@@ -73,6 +81,7 @@ class GPSPublicTestsuite(Testsuite):
             os.environ['DISPLAY'] = ':1'
 
     def tear_down(self):
+        batch.shutdown()
         super(GPSPublicTestsuite, self).tear_down()
         if self.xvfb:
             self.xvfb.stop()
@@ -103,4 +112,4 @@ class GPSPublicTestsuite(Testsuite):
 
     @property
     def default_driver(self):
-        return 'default'
+        return 'batch' if self.main.args.batch else 'default'